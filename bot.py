@@ -7,26 +7,47 @@ import time
 
 from telegram import Update
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler,
-    PreCheckoutQueryHandler, filters, ContextTypes, PicklePersistence,
+    ApplicationBuilder, CommandHandler, MessageHandler,
+    PreCheckoutQueryHandler, filters, ContextTypes,
 )
 
-from config import BOT_TOKEN
-from database import init_db, get_session, Subject
+from config import (
+    BOT_TOKEN, LEADERBOARD_SNAPSHOT_INTERVAL, SEEN_FLUSH_INTERVAL, RATINGS_FLUSH_INTERVAL,
+    PERSISTENCE_URL, PERSISTENCE_INTERVAL, PERSISTENCE_SHARED, CONCURRENT_UPDATES, API_CACHE_CHECK_INTERVAL,
+)
+from database import init_db, get_session, Subject, async_engine
+from utils.question_bank import question_bank
+from utils.render_cache import render_cache
+from utils.response_cache import response_cache, content_refresh_job
+from utils.leaderboard import leaderboard, leaderboard_snapshot_job
+from utils.write_behind import write_behind
+from utils.seen import seen_questions, seen_flush_job
+from utils.answer_events import answer_events_rollover_job
+from utils.item_stats import setup_item_stats_job
+from utils.adaptive import adaptive, ratings_flush_job
+from utils.deadlines import deadlines
+from utils.post_process import post_process
+from utils.update_processor import PerUserUpdateProcessor
+from utils.rate_limiter import rate_limiter, BULK
+from utils.persistence import build_persistence
+from utils.router import Router
 
 # === Handlers ===
 from handlers.start import start_command, help_command, subjects_command, back_to_subjects_callback
-from handlers.quiz import subject_selected_callback, answer_callback, difficulty_selected_callback, mock_test_callback
+from handlers.quiz import (
+    subject_selected_callback, answer_callback, difficulty_selected_callback, mock_test_callback,
+    quiz_answer_callback, mode_answer_callback,
+)
 from handlers.stats import my_stats_command, my_stats_callback, leaderboard_command, leaderboard_callback, band_history_callback
-from handlers.admin import import_command, admin_stats_command, handle_document, handle_text_import
-from handlers.mistakes import mistakes_command, review_mistakes_callback, clear_mistakes_callback
+from handlers.admin import import_command, admin_stats_command, admin_metrics_command, handle_document, handle_text_import
+from handlers.mistakes import mistakes_command, review_mistakes_callback, clear_mistakes_callback, mistake_answer_callback
 from handlers.tips import tips_command, tips_callback, show_tips_menu_callback, writing_command, writing_callback, show_writing_menu_callback
 from handlers.daily import daily_word_command, random_word_callback, reminder_command, reminder_toggle_callback, setup_daily_jobs
 from handlers.achievements import achievements_command
 from handlers.challenge import challenge_command
-from handlers.audio import audio_test_command
+from handlers.audio import audio_test_command, audio_answer_callback
 from handlers.certificate import certificate_command
-from handlers.spaced import spaced_command
+from handlers.spaced import spaced_command, spaced_answer_callback
 from handlers.speaking import (
     speaking_command, speak_part1_callback, speak_p1_topic_callback,
     speak_part2_callback, speak_part3_callback, speak_random_callback,
@@ -38,7 +59,7 @@ from handlers.flashcards import (
 )
 from handlers.extras import (
     studyplan_command, plan_create_callback, plan_done_callback, plan_delete_callback,
-    speed_command, speed_start_callback,
+    speed_command, speed_start_callback, speed_answer_callback,
     translation_command, translation_toggle_callback,
     miniapp_command,
 )
@@ -78,12 +99,12 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     
     for admin_id in ADMIN_IDS:
         try:
-            await context.bot.send_message(chat_id=admin_id, text=message, parse_mode="HTML")
+            await context.bot.send_message(chat_id=admin_id, text=message, parse_mode="HTML", rate_limit_args=BULK)
         except Exception as e:
             # Agar xabar juda uzun bo'lsa yoki boshqa xato bo'lsa, qisqaroq variantni yuboramiz
             try:
                 short_msg = f"⚠️ <b>Xato:</b> {str(context.error)[:200]}"
-                await context.bot.send_message(chat_id=admin_id, text=short_msg, parse_mode="HTML")
+                await context.bot.send_message(chat_id=admin_id, text=short_msg, parse_mode="HTML", rate_limit_args=BULK)
             except:
                 pass
 
@@ -132,6 +153,37 @@ def load_initial_data():
         session.close()
 
 
+async def post_init(application) -> None:
+    """Persistence dan tiklangan testlarning savol taymerlarini qayta qo'yish"""
+    restored = deadlines.start(application)
+    if restored:
+        logger.info(f"⏱️ {restored} ta savol taymeri tiklandi")
+
+
+async def post_shutdown(application) -> None:
+    """Fon vazifalari, buferdagi qatorlar, ko'rilgan savollar va reyting snapshotini yozish, async DB pool ni yopish"""
+    await deadlines.stop()
+    # Achievement vazifalari WrongAnswer ni o'qiydi — write-behind dan oldin
+    await post_process.stop()
+    try:
+        await write_behind.stop()
+    except Exception as e:
+        logger.error(f"Write-behind flush xatosi (navbatda {write_behind.depth} ta qator): {e}")
+    try:
+        await seen_questions.flush()
+    except Exception as e:
+        logger.error(f"Seen bitset flush xatosi: {e}")
+    try:
+        await adaptive.flush()
+    except Exception as e:
+        logger.error(f"Reytinglar flush xatosi: {e}")
+    try:
+        await leaderboard.snapshot_async()
+    except Exception as e:
+        logger.error(f"Reyting snapshot xatosi: {e}")
+    await async_engine.dispose()
+
+
 def main():
     if os.environ.get("RENDER"):
         print("⏳ Render muhiti aniqlandi. 30 soniya kutilyapti...")
@@ -143,11 +195,43 @@ def main():
 
     init_db()
     load_initial_data()
+    # Bank + kontent versiyasi (boshqa jarayondagi importlarni content_refresh_job kuzatadi)
+    response_cache.ensure_fresh()
+    render_cache.warm()
+    logger.info(f"📚 Savollar banki: {question_bank.count()} ta savol xotiraga yuklandi")
+    leaderboard.ensure_fresh(max_age=0)
 
-    # Persistence - sessiyalarni saqlash
-    persistence = PicklePersistence(filepath="persistence.pickle")
+    # Persistence - sessiyalarni saqlash (faqat o'zgargan foydalanuvchilar yoziladi)
+    persistence = build_persistence(
+        PERSISTENCE_URL, shared=PERSISTENCE_SHARED, update_interval=PERSISTENCE_INTERVAL,
+    )
+    update_processor = PerUserUpdateProcessor(CONCURRENT_UPDATES)
+
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .persistence(persistence)
+        # Turli foydalanuvchilar parallel, bitta foydalanuvchi — navbat bilan
+        .concurrent_updates(update_processor)
+        # Chiquvchi xabarlar: chat/umumiy limitlar, eslatmalardan oldin javoblar
+        .rate_limiter(rate_limiter)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    app = ApplicationBuilder().token(BOT_TOKEN).persistence(persistence).build()
+    if PERSISTENCE_SHARED and hasattr(persistence, "write_through"):
+        # Bir nechta worker: holat update dan keyin darhol (foydalanuvchi qulfi ostida) yoziladi
+        async def write_through(update):
+            user = update.effective_user
+            if user and user.id in app.user_data:
+                try:
+                    await persistence.write_through(user.id, app.user_data[user.id])
+                except Exception as e:
+                    # Interval dagi yozishda qayta urinadi
+                    logger.warning(f"Holatni yozib bo'lmadi ({user.id}): {e}")
+
+        update_processor.after_update = write_through
 
     # === Buyruqlar ===
     commands = [
@@ -163,6 +247,7 @@ def main():
         ("webapp", miniapp_command), ("speaking", speaking_command),
         ("admin", admin_command),
         ("import", import_command), ("admin_stats", admin_stats_command),
+        ("admin_metrics", admin_metrics_command),
     ]
     for cmd, handler in commands:
         app.add_handler(CommandHandler(cmd, handler))
@@ -170,64 +255,79 @@ def main():
     # === To'lov handlerlari (Manual Receipt) ===
     app.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL, handle_premium_receipt))
 
-    # === Callback querylar ===
+    # === Callback querylar va menyu tugmalari (utils/router.py) ===
+    # "_" bilan tugagan kalit — prefiks; keyingi elementlar argument turlari
+    router = Router()
+    subjects = ("Reading", "Listening", "Grammar", "Vocabulary", "Speaking")
+    plans = ("1_month", "3_months", "6_months")
     callbacks = [
-        (r"^subject_\d+$", subject_selected_callback),
-        (r"^diff_\d+_(easy|medium|hard|all)$", difficulty_selected_callback),
-        (r"^mock_\d+$", mock_test_callback),
-        (r"^answer_\d+_[abcd]$", answer_callback),
-        (r"^back_subjects$", back_to_subjects_callback),
-        (r"^my_stats$", my_stats_callback),
-        (r"^band_history$", band_history_callback),
-        (r"^leaderboard$", leaderboard_callback),
-        (r"^review_mistakes$", review_mistakes_callback),
-        (r"^clear_mistakes$", clear_mistakes_callback),
-        (r"^tips_(Reading|Listening|Grammar|Vocabulary|Speaking)$", tips_callback),
-        (r"^show_tips_menu$", show_tips_menu_callback),
-        (r"^writing_(task1|task2|random)$", writing_callback),
-        (r"^show_writing_menu$", show_writing_menu_callback),
-        (r"^random_word$", random_word_callback),
-        (r"^reminder_(on|off)$", reminder_toggle_callback),
+        ("subject_", subject_selected_callback, int),
+        ("diff_", difficulty_selected_callback, int, ("easy", "medium", "hard", "all", "adaptive")),
+        ("mock_", mock_test_callback, int),
+        # Javoblar: rejim tugmada yoziladi; eski answer_ tugmalari holat bo'yicha
+        ("ans_quiz_", quiz_answer_callback, int, ("a", "b", "c", "d")),
+        ("ans_speed_", mode_answer_callback(speed_answer_callback), int, ("a", "b", "c", "d")),
+        ("ans_spaced_", mode_answer_callback(spaced_answer_callback), int, ("a", "b", "c", "d")),
+        ("ans_mistake_", mode_answer_callback(mistake_answer_callback), int, ("a", "b", "c", "d")),
+        ("ans_audio_", mode_answer_callback(audio_answer_callback), int, ("a", "b", "c", "d")),
+        ("answer_", answer_callback, int, ("a", "b", "c", "d")),
+        ("back_subjects", back_to_subjects_callback),
+        ("my_stats", my_stats_callback),
+        ("band_history", band_history_callback),
+        ("leaderboard", leaderboard_callback),
+        ("lb_", leaderboard_callback, ("all", "week", "month"), int),
+        ("review_mistakes", review_mistakes_callback),
+        ("clear_mistakes", clear_mistakes_callback),
+        ("tips_", tips_callback, subjects),
+        ("show_tips_menu", show_tips_menu_callback),
+        ("writing_", writing_callback, ("task1", "task2", "random")),
+        ("show_writing_menu", show_writing_menu_callback),
+        ("random_word", random_word_callback),
+        ("reminder_", reminder_toggle_callback, ("on", "off")),
         # Premium & Payment
-        (r"^buy_premium_(1_month|3_months|6_months)$", buy_premium_callback),
-        (r"^go_premium$", go_premium_callback),
+        ("buy_premium_", buy_premium_callback, plans),
+        ("go_premium", go_premium_callback),
         # Flashcards
-        (r"^fc_study$", study_flashcard_callback),
-        (r"^fc_load_defaults$", load_defaults_callback),
-        (r"^fc_reveal_\d+$", reveal_flashcard_callback),
-        (r"^fc_(knew|didnt)_\d+$", flashcard_response_callback),
-        (r"^fc_stats$", flashcard_stats_callback),
+        ("fc_study", study_flashcard_callback),
+        ("fc_load_defaults", load_defaults_callback),
+        ("fc_reveal_", reveal_flashcard_callback, int),
+        ("fc_knew_", flashcard_response_callback, int),
+        ("fc_didnt_", flashcard_response_callback, int),
+        ("fc_stats", flashcard_stats_callback),
         # Study Plan
-        (r"^plan_create_(30|60|90)$", plan_create_callback),
-        (r"^plan_done_today$", plan_done_callback),
-        (r"^plan_delete$", plan_delete_callback),
+        ("plan_create_", plan_create_callback, ("30", "60", "90")),
+        ("plan_done_today", plan_done_callback),
+        ("plan_delete", plan_delete_callback),
         # Speed Round
-        (r"^speed_start$", speed_start_callback),
-        (r"^speed_restart$", speed_start_callback),
+        ("speed_start", speed_start_callback),
+        ("speed_restart", speed_start_callback),
         # Translation
-        (r"^translate_(on|off)$", translation_toggle_callback),
+        ("translate_", translation_toggle_callback, ("on", "off")),
         # Speaking Practice
-        (r"^speak_part1$", speak_part1_callback),
-        (r"^speak_p1_\w+$", speak_p1_topic_callback),
-        (r"^speak_part2$", speak_part2_callback),
-        (r"^speak_part3$", speak_part3_callback),
-        (r"^speak_random$", speak_random_callback),
-        (r"^speak_back$", speak_back_callback),
+        ("speak_part1", speak_part1_callback),
+        ("speak_p1_", speak_p1_topic_callback, str),
+        ("speak_part2", speak_part2_callback),
+        ("speak_part3", speak_part3_callback),
+        ("speak_random", speak_random_callback),
+        ("speak_back", speak_back_callback),
         # Manual Payment Admin Approval
-        (r"^adm_approve_", admin_approve_callback),
-        (r"^adm_reject_", admin_reject_callback),
-        (r"^adm_give_premium$", admin_give_premium_callback),
-        (r"^adm_revoke_premium$", admin_revoke_premium_callback),
-        (r"^adm_setprem_", admin_set_premium_callback),
-        (r"^adm_users$", admin_users_callback),
-        (r"^adm_quiz_users$", admin_quiz_users_callback),
-        (r"^adm_full_stats$", admin_full_stats_callback),
-        (r"^adm_back$", admin_back_callback),
+        ("adm_give_premium", admin_give_premium_callback),
+        ("adm_revoke_premium", admin_revoke_premium_callback),
+        ("adm_users", admin_users_callback),
+        ("adm_quiz_users", admin_quiz_users_callback),
+        ("adm_full_stats", admin_full_stats_callback),
+        ("adm_back", admin_back_callback),
     ]
-    for pattern, handler in callbacks:
-        app.add_handler(CallbackQueryHandler(handler, pattern=pattern))
+    for key, handler, *spec in callbacks:
+        router.callback(key, handler, *spec)
+    # Argumentlarini handler o'zi ajratadi
+    for key, handler in (
+        ("adm_approve_", admin_approve_callback),
+        ("adm_reject_", admin_reject_callback),
+        ("adm_setprem_", admin_set_premium_callback),
+    ):
+        router.callback(key, handler, any_suffix=True)
 
-    # === Reply keyboard tugmalari ===
     button_handlers = {
         "📚 Bo'limlar": subjects_command, "📝 Test boshlash": subjects_command,
         "📊 Natijalarim": my_stats_command, "🏆 Reyting": leaderboard_command,
@@ -242,7 +342,8 @@ def main():
         "🎤 Speaking": speaking_command, "⚙️ Admin": admin_command,
     }
     for text, handler in button_handlers.items():
-        app.add_handler(MessageHandler(filters.Regex(f"^{text}$"), handler))
+        router.text(text, handler)
+    router.install(app)
 
     # === Fayl, matn va voice (Group 1 - Pastroq ustuvorlik) ===
     # Bu guruhdagi handlerlar faqat Group 0 dagi tugmalarga mos kelmasa ishlaydi
@@ -255,6 +356,24 @@ def main():
 
     # === Jobs ===
     setup_daily_jobs(app.job_queue)
+    setup_item_stats_job(app.job_queue)
+    app.job_queue.run_repeating(
+        leaderboard_snapshot_job, interval=LEADERBOARD_SNAPSHOT_INTERVAL,
+        first=LEADERBOARD_SNAPSHOT_INTERVAL, name="leaderboard_snapshot",
+    )
+    app.job_queue.run_repeating(
+        seen_flush_job, interval=SEEN_FLUSH_INTERVAL, first=SEEN_FLUSH_INTERVAL, name="seen_flush",
+    )
+    app.job_queue.run_repeating(
+        ratings_flush_job, interval=RATINGS_FLUSH_INTERVAL, first=RATINGS_FLUSH_INTERVAL, name="ratings_flush",
+    )
+    app.job_queue.run_repeating(
+        content_refresh_job, interval=API_CACHE_CHECK_INTERVAL, first=API_CACHE_CHECK_INTERVAL,
+        name="content_refresh",
+    )
+    app.job_queue.run_repeating(
+        answer_events_rollover_job, interval=6 * 3600, first=60, name="answer_events_rollover",
+    )
 
     print("🤖 IELTS Preparation Bot ishga tushdi!")
     
@@ -20,6 +20,14 @@ else:
     DB_PATH = os.path.join(os.path.dirname(__file__), "exam_bot.db")
     DB_URL = f"sqlite:///{DB_PATH}"
 
+# Connection pool (Postgres) — /metrics dagi kutish vaqti va overflow bo'yicha sozlanadi
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))
+
+# /metrics endpointi uchun token (bo'sh bo'lsa — ochiq)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 # Admin foydalanuvchilar (Telegram user ID)
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 
@@ -27,9 +35,69 @@ ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 PAYMENT_CARD_NUMBER = os.getenv("PAYMENT_CARD_NUMBER", "9860350147502123")
 PAYMENT_CARD_HOLDER = os.getenv("PAYMENT_CARD_HOLDER", "Sayfullayev Bekzod")
 
+# Premium holati keshi (soniya): musbat natija obuna tugashigacha, lekin
+# TTL dan oshmay saqlanadi; manfiy natija qisqaroq saqlanadi
+PREMIUM_CACHE_TTL = int(os.getenv("PREMIUM_CACHE_TTL", "600"))
+PREMIUM_CACHE_NEGATIVE_TTL = int(os.getenv("PREMIUM_CACHE_NEGATIVE_TTL", "60"))
+
+# Reyting snapshotini DB ga yozish oralig'i (soniya)
+LEADERBOARD_SNAPSHOT_INTERVAL = int(os.getenv("LEADERBOARD_SNAPSHOT_INTERVAL", "300"))
+
+# Write-behind bufer: shuncha qator yig'ilganda yoki shuncha soniyada bir yoziladi
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "2"))
+
+# Test yakunidan keyingi fon ishlari (achievementlar, xabarnomalar):
+# parallel workerlar soni va xato bo'lsa qayta urinishlar soni
+POST_PROCESS_WORKERS = int(os.getenv("POST_PROCESS_WORKERS", "2"))
+POST_PROCESS_RETRIES = int(os.getenv("POST_PROCESS_RETRIES", "3"))
+
+# Bir vaqtda qayta ishlanadigan update lar (turli foydalanuvchilar); bitta
+# foydalanuvchining update lari baribir navbat bilan (utils/update_processor.py)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Chiquvchi xabarlar limiti (utils/rate_limiter.py): butun bot bo'yicha xabar/soniya,
+# bitta shaxsiy chatga xabar/soniya va bitta guruhga xabar/daqiqa
+RATE_LIMIT_GLOBAL = float(os.getenv("RATE_LIMIT_GLOBAL", "30"))
+RATE_LIMIT_CHAT = float(os.getenv("RATE_LIMIT_CHAT", "1"))
+RATE_LIMIT_GROUP_PER_MINUTE = float(os.getenv("RATE_LIMIT_GROUP_PER_MINUTE", "20"))
+
+# Bot holati (user_data va h.k.) qayerda saqlanadi: "sql" (DATABASE_URL),
+# "redis://[:parol@]host:port/db" yoki eski "pickle"
+PERSISTENCE_URL = os.getenv("PERSISTENCE_URL", "sql")
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "60"))
+# Bir nechta bot worker: har bir update oldidan foydalanuvchi holatini qayta o'qish
+# va update dan keyin darhol yozish (utils/persistence.py)
+PERSISTENCE_SHARED = os.getenv("PERSISTENCE_SHARED", "").lower() in ("1", "true", "yes")
+
+# Ko'rilgan savollar bitsetlari (utils/seen.py): xotirada saqlanadigan
+# foydalanuvchilar soni va DB ga yozish oralig'i (soniya)
+SEEN_CACHE_SIZE = int(os.getenv("SEEN_CACHE_SIZE", "5000"))
+SEEN_FLUSH_INTERVAL = int(os.getenv("SEEN_FLUSH_INTERVAL", "30"))
+
+# Javob hodisalari (utils/answer_events.py) oylik jadvallari nechta oy
+# saqlanadi; 0 — o'chirilmaydi
+ANSWER_EVENTS_RETENTION_MONTHS = int(os.getenv("ANSWER_EVENTS_RETENTION_MONTHS", "0"))
+
+# Savol statistikasi (utils/item_stats.py): necha oylik javoblar olinadi va
+# qiyinlik kalibrlanishi uchun savolga kamida nechta javob kerak
+ITEM_STATS_MONTHS = int(os.getenv("ITEM_STATS_MONTHS", "6"))
+ITEM_STATS_MIN_ANSWERS = int(os.getenv("ITEM_STATS_MIN_ANSWERS", "30"))
+
+# Adaptiv test (utils/adaptive.py): reytinglarni DB ga yozish oralig'i (soniya)
+RATINGS_FLUSH_INTERVAL = int(os.getenv("RATINGS_FLUSH_INTERVAL", "30"))
+
+# Web API keshi (utils/response_cache.py): kontent versiyasini tekshirish (webapp va bot)
+# oralig'i va fanlar/savollar javoblari uchun Cache-Control max-age (soniya)
+API_CACHE_CHECK_INTERVAL = float(os.getenv("API_CACHE_CHECK_INTERVAL", "5"))
+API_CACHE_MAX_AGE = int(os.getenv("API_CACHE_MAX_AGE", "3600"))
+
 # Quiz sozlamalari
 QUESTIONS_PER_QUIZ = 10  # Har bir testda savollar soni
-TIME_PER_QUESTION = 30   # Har bir savol uchun vaqt (soniya)
+# Har bir savol uchun vaqt (soniya) — oddiy test, mock test va speed round
+TIME_PER_QUESTION = int(os.getenv("TIME_PER_QUESTION", "30"))
+TIME_PER_QUESTION_MOCK = int(os.getenv("TIME_PER_QUESTION_MOCK", "30"))
+TIME_PER_QUESTION_SPEED = int(os.getenv("TIME_PER_QUESTION_SPEED", "20"))
 
 # Premium narxlar (so'm)
 PREMIUM_PLANS = {
@@ -1,9 +1,15 @@
-from contextlib import contextmanager
-from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Float, Boolean, text, BigInteger
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, Column, Integer, String, Text, Date, DateTime, ForeignKey, Float, Boolean, Index, JSON, LargeBinary, text, BigInteger, select
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
-from config import DB_URL
+from config import (
+    DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE,
+    PREMIUM_CACHE_TTL, PREMIUM_CACHE_NEGATIVE_TTL,
+)
+from utils.metrics import timed_pool, instrument_engine
 
 # Engine sozlamalari (PostgreSQL uchun optimallash)
 if "postgresql" in DB_URL:
@@ -13,15 +19,50 @@ if "postgresql" in DB_URL:
         DB_URL,
         echo=False,
         connect_args=connect_args,
+        poolclass=timed_pool(QueuePool, "sync"),
         pool_pre_ping=True,
-        pool_recycle=300,
-        pool_size=5,
-        max_overflow=10
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW
     )
 else:
-    engine = create_engine(DB_URL, echo=False)
+    engine = create_engine(DB_URL, echo=False, poolclass=timed_pool(QueuePool, "sync"))
+
+
+def _async_db_url(url):
+    """Sync URL ni async drayverli URL ga o'girish (aiosqlite / psycopg)"""
+    scheme, rest = url.split("://", 1)
+    base = scheme.split("+", 1)[0]
+    if base == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    if base == "postgresql":
+        return f"postgresql+psycopg://{rest}"
+    return url
+
+
+# Async engine — bot handlerlari event loop ni bloklamasligi uchun
+if "postgresql" in DB_URL:
+    async_engine = create_async_engine(
+        _async_db_url(DB_URL),
+        echo=False,
+        connect_args={"sslmode": "require"},
+        poolclass=timed_pool(AsyncAdaptedQueuePool, "async"),
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW
+    )
+else:
+    async_engine = create_async_engine(
+        _async_db_url(DB_URL), echo=False, poolclass=timed_pool(AsyncAdaptedQueuePool, "async")
+    )
+
+# So'rov vaqtlari — utils/metrics.py (/metrics, /admin_metrics)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
 
 Session = sessionmaker(bind=engine)
+AsyncSessionFactory = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -58,6 +99,10 @@ class Question(Base):
     difficulty = Column(Integer, default=1)
     subject = relationship("Subject", back_populates="questions")
 
+    __table_args__ = (
+        Index("ix_questions_subject_difficulty", "subject_id", "difficulty"),
+    )
+
     def get_options(self):
         return {"a": self.option_a, "b": self.option_b, "c": self.option_c, "d": self.option_d}
 
@@ -77,6 +122,31 @@ class UserResult(Base):
     completed_at = Column(DateTime, default=datetime.utcnow)
     subject = relationship("Subject", back_populates="results")
 
+    __table_args__ = (
+        Index("ix_user_results_user_completed", "user_id", "completed_at"),
+    )
+
+
+class UserStats(Base):
+    """Foydalanuvchi natijalari yig'indisi — har bir test bilan bir tranzaksiyada yangilanadi"""
+    __tablename__ = "user_stats"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, unique=True, nullable=False, index=True)
+    total_tests = Column(Integer, nullable=False, default=0)
+    sum_pct = Column(Float, nullable=False, default=0.0)
+    mock_count = Column(Integer, nullable=False, default=0)
+    best_pct = Column(Float, nullable=False, default=0.0)
+    best_mock_pct = Column(Float, nullable=False, default=0.0)
+    # {"subject_id": [tests, sum_pct, best_pct]}
+    subjects = Column(JSON, nullable=False, default=dict)
+    # Har bir yangi natijada +1 — /api/stats ETag i shundan quriladi
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    @property
+    def avg_pct(self):
+        return self.sum_pct / self.total_tests if self.total_tests else 0.0
+
 
 class WrongAnswer(Base):
     __tablename__ = "wrong_answers"
@@ -89,6 +159,10 @@ class WrongAnswer(Base):
     reviewed = Column(Boolean, default=False)
     question = relationship("Question")
 
+    __table_args__ = (
+        Index("ix_wrong_answers_user_reviewed", "user_id", "reviewed"),
+    )
+
 
 class UserAchievement(Base):
     __tablename__ = "user_achievements"
@@ -99,6 +173,11 @@ class UserAchievement(Base):
     achievement_emoji = Column(String(10), default="🏅")
     earned_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Parallel post-process (bir xil foydalanuvchi) bitta yutuqni ikki marta bermasin
+        Index("uq_user_achievements_user_key", "user_id", "achievement_key", unique=True),
+    )
+
 
 class UserSettings(Base):
     __tablename__ = "user_settings"
@@ -130,10 +209,14 @@ class SpacedRepetition(Base):
     easiness_factor = Column(Float, default=2.5)
     interval = Column(Integer, default=1)
     repetitions = Column(Integer, default=0)
-    next_review = Column(String(10), default="")
-    last_reviewed = Column(String(10), default="")
+    next_review = Column(Date, nullable=True)
+    last_reviewed = Column(Date, nullable=True)
     question = relationship("Question")
 
+    __table_args__ = (
+        Index("ix_spaced_repetition_user_next_review", "user_id", "next_review"),
+    )
+
 
 class Flashcard(Base):
     __tablename__ = "flashcards"
@@ -146,6 +229,10 @@ class Flashcard(Base):
     mastered = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_flashcards_user_mastered", "user_id", "mastered"),
+    )
+
 
 class StudyPlan(Base):
     __tablename__ = "study_plans"
@@ -158,6 +245,88 @@ class StudyPlan(Base):
     completed = Column(Boolean, default=False)
 
 
+class AppState(Base):
+    """Kichik kalit-qiymat holatlar (watermarklar, versiyalar)"""
+    __tablename__ = "app_state"
+    key = Column(String(50), primary_key=True)
+    value = Column(Text, nullable=False, default="")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class BotState(Base):
+    """PTB persistence (utils/persistence.py): namespace/key bo'yicha pickle qilingan holat"""
+    __tablename__ = "bot_state"
+    namespace = Column(String(40), primary_key=True)  # "user", "chat", "bot", "conv:<name>"
+    key = Column(String(64), primary_key=True)
+    value = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SyncEvent(Base):
+    """Mini-app /api/sync hodisalari — qayta yuborilgan hodisa ikki marta qo'llanmaydi"""
+    __tablename__ = "sync_events"
+    user_id = Column(BigInteger, primary_key=True)
+    event_id = Column(String(64), primary_key=True)  # mijoz yaratgan id (UUID)
+    kind = Column(String(20), nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SeenQuestions(Base):
+    """utils/seen.py: foydalanuvchi ko'rgan savollar — question.id bo'yicha bitset (ikki avlod)"""
+    __tablename__ = "seen_questions"
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    current = Column(LargeBinary, nullable=False, default=b"")
+    previous = Column(LargeBinary, nullable=False, default=b"")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class QuestionStats(Base):
+    """utils/item_stats.py: answer_events dan hisoblangan savol statistikasi (kunlik)"""
+    __tablename__ = "question_stats"
+    question_id = Column(Integer, primary_key=True, autoincrement=False)
+    answers = Column(Integer, nullable=False, default=0)
+    p_value = Column(Float, nullable=False, default=0.0)        # to'g'ri javoblar ulushi
+    discrimination = Column(Float)                             # point-biserial (rest-score bilan)
+    mean_latency_ms = Column(Float)
+    pick_a = Column(Float, nullable=False, default=0.0)        # variantlar tanlanish ulushi
+    pick_b = Column(Float, nullable=False, default=0.0)
+    pick_c = Column(Float, nullable=False, default=0.0)
+    pick_d = Column(Float, nullable=False, default=0.0)
+    timeout_rate = Column(Float, nullable=False, default=0.0)
+    difficulty = Column(Integer)                               # kalibrlangan 1/2/3; javoblar kam bo'lsa NULL
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UserRating(Base):
+    """utils/adaptive.py: foydalanuvchining fan bo'yicha Elo reytingi"""
+    __tablename__ = "user_ratings"
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    subject_id = Column(Integer, primary_key=True, autoincrement=False)
+    rating = Column(Float, nullable=False)
+    answers = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class QuestionRating(Base):
+    """utils/adaptive.py: savolning Elo reytingi (javoblar bilan onlayn yangilanadi)"""
+    __tablename__ = "question_ratings"
+    question_id = Column(Integer, primary_key=True, autoincrement=False)
+    rating = Column(Float, nullable=False)
+    answers = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class LeaderboardSnapshot(Base):
+    """utils/leaderboard.py xotiradagi reytinglarining nusxasi"""
+    __tablename__ = "leaderboard_snapshots"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    board = Column(String(40), nullable=False, index=True)  # "all", "all:3", "week:2026-W42", "month:2026-10:3"
+    user_id = Column(BigInteger, nullable=False)
+    tests = Column(Integer, nullable=False, default=0)
+    sum_pct = Column(Float, nullable=False, default=0.0)
+    full_name = Column(String(200), default="")
+
+
 class PremiumSubscription(Base):
     __tablename__ = "premium_subscriptions"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -171,29 +340,105 @@ class PremiumSubscription(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_premium_subscriptions_user_active_end", "user_id", "is_active", "end_date"),
+    )
+
+
+# === Premium entitlement keshi ===
+# user_id -> (is_premium, valid_until). Musbat yozuv obuna tugash vaqtida
+# aniq eskiradi; TTL esa boshqa jarayonlardagi (webapp <-> bot) o'zgarishlar
+# uchun yuqori chegara. Shu jarayondagi o'zgarishlar invalidate_premium()
+# orqali darhol tozalanadi.
+_premium_cache = {}
+
+
+def _premium_cache_get(user_id):
+    entry = _premium_cache.get(user_id)
+    if entry is None:
+        return None
+    is_prem, valid_until = entry
+    if datetime.utcnow() >= valid_until:
+        _premium_cache.pop(user_id, None)
+        return None
+    return is_prem
+
+
+def _premium_cache_put(user_id, is_prem, end_date=None):
+    now = datetime.utcnow()
+    ttl = PREMIUM_CACHE_TTL if is_prem else PREMIUM_CACHE_NEGATIVE_TTL
+    valid_until = now + timedelta(seconds=ttl)
+    if end_date is not None and end_date < valid_until:
+        valid_until = end_date
+    _premium_cache[user_id] = (is_prem, valid_until)
+
+
+def invalidate_premium(user_id=None):
+    """Premium keshini tozalash (obuna berilgan/olingan paytda)"""
+    if user_id is None:
+        _premium_cache.clear()
+    else:
+        _premium_cache.pop(user_id, None)
+
+
+def _resolve_premium(settings, sub):
+    """(is_premium, end_date, expired) — check_premium va async varianti uchun umumiy qoida"""
+    if not (settings and settings.is_premium):
+        return False, None, False
+    if sub is None:
+        return True, None, False
+    if sub.end_date > datetime.utcnow():
+        return True, sub.end_date, False
+    return False, None, True
+
 
 def check_premium(user_id):
+    cached = _premium_cache_get(user_id)
+    if cached is not None:
+        return cached
     session = Session()
     try:
         settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+        sub = None
         if settings and settings.is_premium:
             sub = session.query(PremiumSubscription).filter_by(
                 user_id=user_id, is_active=True
             ).order_by(PremiumSubscription.end_date.desc()).first()
-            if sub and sub.end_date > datetime.utcnow():
-                return True
-            elif sub and sub.end_date <= datetime.utcnow():
-                settings.is_premium = False
-                sub.is_active = False
-                session.commit()
-                return False
-            else:
-                return True
-        return False
+        is_prem, end_date, expired = _resolve_premium(settings, sub)
+        if expired:
+            settings.is_premium = False
+            sub.is_active = False
+            session.commit()
+        _premium_cache_put(user_id, is_prem, end_date)
+        return is_prem
     finally:
         session.close()
 
 
+async def check_premium_async(user_id):
+    """check_premium ning async varianti (bot handlerlari uchun)"""
+    cached = _premium_cache_get(user_id)
+    if cached is not None:
+        return cached
+    async with get_async_session() as session:
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user_id).limit(1))
+        sub = None
+        if settings and settings.is_premium:
+            sub = await session.scalar(
+                select(PremiumSubscription)
+                .filter_by(user_id=user_id, is_active=True)
+                .order_by(PremiumSubscription.end_date.desc())
+                .limit(1)
+            )
+        is_prem, end_date, expired = _resolve_premium(settings, sub)
+        if expired:
+            settings.is_premium = False
+            sub.is_active = False
+            await session.commit()
+        _premium_cache_put(user_id, is_prem, end_date)
+        return is_prem
+
+
 def fix_sequences():
     """PostgreSQL sequences sinxronizatsiya qilish"""
     if "postgresql" not in DB_URL:
@@ -203,7 +448,7 @@ def fix_sequences():
         "users", "subjects", "questions", "user_results", "wrong_answers",
         "user_achievements", "user_settings", "daily_streaks",
         "spaced_repetition", "flashcards", "study_plans",
-        "premium_subscriptions"
+        "premium_subscriptions", "user_stats", "leaderboard_snapshots"
     ]
 
     with engine.connect() as conn:
@@ -217,7 +462,13 @@ def fix_sequences():
 
 
 def init_db():
+    from utils.migrations import migrate
+    from utils.answer_events import answer_events
+
     Base.metadata.create_all(engine)
+    for step in migrate(engine):
+        print(f"🔧 Migratsiya: {step}")
+    answer_events.ensure_tables(engine)
     fix_sequences()
     print("✅ Database tayyor (Sequences sinxronlandi)!")
 
@@ -226,6 +477,20 @@ def get_session():
     return Session()
 
 
+def get_state(session, key, default=None):
+    row = session.get(AppState, key)
+    return row.value if row else default
+
+
+def set_state(session, key, value):
+    """app_state qiymatini yozish (commit chaqiruvchida)"""
+    row = session.get(AppState, key)
+    if row:
+        row.value = str(value)
+    else:
+        session.add(AppState(key=key, value=str(value)))
+
+
 @contextmanager
 def session_scope():
     """Tranzaksiyalar uchun context manager"""
@@ -239,3 +504,21 @@ def session_scope():
     finally:
         session.close()
 
+
+def get_async_session():
+    """Async sessiya: `async with get_async_session() as session:`"""
+    return AsyncSessionFactory()
+
+
+@asynccontextmanager
+async def async_session_scope():
+    """Async tranzaksiyalar uchun context manager"""
+    session = AsyncSessionFactory()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
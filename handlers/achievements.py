@@ -1,11 +1,20 @@
 """Achievement badges tizimi"""
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_session, UserAchievement, UserResult, DailyStreak, WrongAnswer
-from sqlalchemy import func
+from config import DB_URL
+from database import get_async_session, UserAchievement, DailyStreak, WrongAnswer
+from sqlalchemy import select, func
+from utils.question_bank import question_bank
+from utils.user_stats import get_user_stats
+from utils.rate_limiter import BULK
+
+if "postgresql" in DB_URL:
+    from sqlalchemy.dialects.postgresql import insert
+else:
+    from sqlalchemy.dialects.sqlite import insert
 
 
 # Barcha achievementlar
@@ -28,9 +37,8 @@ ACHIEVEMENTS = {
 async def achievements_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/yutuqlar buyrug'i"""
     user_id = update.effective_user.id
-    session = get_session()
-    try:
-        earned = session.query(UserAchievement).filter_by(user_id=user_id).all()
+    async with get_async_session() as session:
+        earned = (await session.scalars(select(UserAchievement).filter_by(user_id=user_id))).all()
         earned_keys = {a.achievement_key for a in earned}
 
         text = "🏅 <b>Yutuqlar (Achievements)</b>\n\n"
@@ -52,23 +60,27 @@ async def achievements_command(update: Update, context: ContextTypes.DEFAULT_TYP
             if len(remaining) > 6:
                 text += f"  ... va yana {len(remaining) - 6} ta\n"
 
-        keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
-        await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+
 
+async def check_and_award_achievements(user_id, context, stats=None, current_streak=None):
+    """Yangi achievement tekshirish va berish.
 
-async def check_and_award_achievements(user_id, context):
-    """Yangi achievement tekshirish va berish"""
-    session = get_session()
+    `stats` — _finish_quiz da yangilangan UserStats qatori, `current_streak` —
+    o'sha tranzaksiyadagi streak; berilmasa DB dan o'qiladi. _finish_quiz uni
+    post_process navbati orqali fonda chaqiradi.
+    """
     new_achievements = []
-    try:
-        earned_keys = {
-            a.achievement_key
-            for a in session.query(UserAchievement).filter_by(user_id=user_id).all()
-        }
+    async with get_async_session() as session:
+        earned_keys = set((await session.scalars(
+            select(UserAchievement.achievement_key).filter_by(user_id=user_id)
+        )).all())
+        if stats is None:
+            stats = await get_user_stats(session, user_id)
 
-        total_tests = session.query(func.count(UserResult.id)).filter_by(user_id=user_id).scalar() or 0
+        total_tests = stats.total_tests if stats else 0
+        best_pct = stats.best_pct if stats else 0.0
 
         # Test count achievements
         for key, count in [("first_test", 1), ("ten_tests", 10), ("fifty_tests", 50), ("hundred_tests", 100)]:
@@ -76,101 +88,96 @@ async def check_and_award_achievements(user_id, context):
                 new_achievements.append(key)
 
         # Perfect score
-        if "perfect_score" not in earned_keys:
-            perfect = session.query(UserResult).filter_by(user_id=user_id).filter(UserResult.percentage >= 100).first()
-            if perfect:
-                new_achievements.append("perfect_score")
+        if "perfect_score" not in earned_keys and best_pct >= 100:
+            new_achievements.append("perfect_score")
 
         # Band 7+
-        if "band_7" not in earned_keys:
-            band7 = session.query(UserResult).filter_by(user_id=user_id).filter(UserResult.percentage >= 75).first()
-            if band7:
-                new_achievements.append("band_7")
+        if "band_7" not in earned_keys and best_pct >= 75:
+            new_achievements.append("band_7")
 
         # All sections
-        if "all_sections" not in earned_keys:
-            unique_subjects = session.query(func.count(func.distinct(UserResult.subject_id))).filter_by(user_id=user_id).scalar() or 0
-            from database import Subject
-            total_subjects = session.query(func.count(Subject.id)).scalar() or 0
-            if total_subjects > 0 and unique_subjects >= total_subjects:
+        if "all_sections" not in earned_keys and stats:
+            total_subjects = len(question_bank.subjects())
+            if total_subjects > 0 and len(stats.subjects or {}) >= total_subjects:
                 new_achievements.append("all_sections")
 
         # Streaks
-        streak = session.query(DailyStreak).filter_by(user_id=user_id).first()
-        if streak:
+        if current_streak is None:
+            streak = await session.scalar(select(DailyStreak).filter_by(user_id=user_id).limit(1))
+            current_streak = streak.current_streak if streak else 0
+        if current_streak:
             for key, days in [("streak_3", 3), ("streak_7", 7), ("streak_30", 30)]:
-                if key not in earned_keys and streak.current_streak >= days:
+                if key not in earned_keys and current_streak >= days:
                     new_achievements.append(key)
 
         # Mistake fixer
         if "mistake_fixer" not in earned_keys:
-            fixed = session.query(func.count(WrongAnswer.id)).filter_by(user_id=user_id, reviewed=True).scalar() or 0
+            fixed = await session.scalar(
+                select(func.count(WrongAnswer.id))
+                .where(WrongAnswer.user_id == user_id, WrongAnswer.reviewed.is_(True))
+            ) or 0
             if fixed >= 10:
                 new_achievements.append("mistake_fixer")
 
         # Mock master
-        if "mock_master" not in earned_keys:
-            mock_pass = session.query(UserResult).filter_by(user_id=user_id, is_mock=True).filter(UserResult.percentage >= 70).first()
-            if mock_pass:
-                new_achievements.append("mock_master")
-
-        # Award new achievements
-        for key in new_achievements:
-            info = ACHIEVEMENTS[key]
-            ua = UserAchievement(
-                user_id=user_id,
-                achievement_key=key,
-                achievement_name=info["name"],
-                achievement_emoji=info["emoji"],
+        if "mock_master" not in earned_keys and stats and stats.best_mock_pct >= 70:
+            new_achievements.append("mock_master")
+
+        # Award new achievements — parallel worker allaqachon bergan bo'lsa,
+        # unique indeks qatorni o'tkazib yuboradi va xabar yuborilmaydi
+        if new_achievements:
+            stmt = (
+                insert(UserAchievement)
+                .values([
+                    {
+                        "user_id": user_id,
+                        "achievement_key": key,
+                        "achievement_name": ACHIEVEMENTS[key]["name"],
+                        "achievement_emoji": ACHIEVEMENTS[key]["emoji"],
+                        "earned_at": datetime.utcnow(),
+                    }
+                    for key in new_achievements
+                ])
+                .on_conflict_do_nothing(index_elements=["user_id", "achievement_key"])
+                .returning(UserAchievement.achievement_key)
             )
-            session.add(ua)
-
-        session.commit()
-
-        # Notify user
-        for key in new_achievements:
-            info = ACHIEVEMENTS[key]
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"🎉 <b>Yangi yutuq!</b>\n\n{info['emoji']} <b>{info['name']}</b>\n{info['desc']}",
-                    parse_mode="HTML",
-                )
-            except Exception:
-                pass
-
-        return new_achievements
-    finally:
-        session.close()
-
-
-def update_streak(user_id):
-    """Kundalik streak yangilash"""
-    session = get_session()
-    try:
-        streak = session.query(DailyStreak).filter_by(user_id=user_id).first()
-        today = date.today().isoformat()
-
-        if not streak:
-            streak = DailyStreak(user_id=user_id, current_streak=1, longest_streak=1, last_active_date=today, total_tests=1)
-            session.add(streak)
+            inserted = set((await session.scalars(stmt)).all())
+            new_achievements = [key for key in new_achievements if key in inserted]
+
+        await session.commit()
+
+    # Notify user
+    for key in new_achievements:
+        info = ACHIEVEMENTS[key]
+        try:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=f"🎉 <b>Yangi yutuq!</b>\n\n{info['emoji']} <b>{info['name']}</b>\n{info['desc']}",
+                parse_mode="HTML",
+                rate_limit_args=BULK,
+            )
+        except Exception:
+            pass
+
+    return new_achievements
+
+
+async def apply_streak(session, user_id):
+    """Kundalik streakni chaqiruvchi tranzaksiyasi ichida yangilash (commit qilinmaydi)"""
+    streak = await session.scalar(select(DailyStreak).filter_by(user_id=user_id).limit(1))
+    today = date.today()
+
+    if not streak:
+        streak = DailyStreak(user_id=user_id, current_streak=1, longest_streak=1, last_active_date=today.isoformat(), total_tests=1)
+        session.add(streak)
+        return streak
+
+    streak.total_tests = (streak.total_tests or 0) + 1
+    if streak.last_active_date != today.isoformat():  # Bugun birinchi test
+        if streak.last_active_date == (today - timedelta(days=1)).isoformat():
+            streak.current_streak += 1
         else:
-            streak.total_tests += 1
-            if streak.last_active_date == today:
-                pass  # Bugun allaqachon test yechgan
-            elif streak.last_active_date == date.today().replace(day=date.today().day - 1).isoformat() if date.today().day > 1 else "":
-                streak.current_streak += 1
-            else:
-                from datetime import timedelta
-                yesterday = (date.today() - timedelta(days=1)).isoformat()
-                if streak.last_active_date == yesterday:
-                    streak.current_streak += 1
-                else:
-                    streak.current_streak = 1
-
-            streak.longest_streak = max(streak.longest_streak, streak.current_streak)
-            streak.last_active_date = today
-
-        session.commit()
-    finally:
-        session.close()
+            streak.current_streak = 1
+        streak.longest_streak = max(streak.longest_streak, streak.current_streak)
+        streak.last_active_date = today.isoformat()
+    return streak
@@ -1,14 +1,19 @@
+import asyncio
 import json
 import tempfile
 import os
+from html import escape
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from config import ADMIN_IDS
-from database import get_session, Subject, Question, UserResult, User
+from config import ADMIN_IDS, ITEM_STATS_MIN_ANSWERS
+from database import get_async_session, Subject, Question, UserResult, User, QuestionStats
 from utils.importer import import_from_json
-from sqlalchemy import func
+from utils import metrics
+from utils.write_behind import write_behind
+from utils.rate_limiter import rate_limiter
+from sqlalchemy import select, func
 
 
 def is_admin(user_id):
@@ -70,7 +75,8 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         with open(temp_path, "r", encoding="utf-8") as f:
             json_data = json.load(f)
 
-        added, subject_name, error_msg = import_from_json(json_data)
+        # Import sinxron (katta fayllar) — event loop ni bloklamaslik uchun threadda
+        added, subject_name, error_msg = await asyncio.to_thread(import_from_json, json_data)
 
         text = (
             f"📥 <b>Import natijasi</b>\n\n"
@@ -116,7 +122,7 @@ async def handle_text_import(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     try:
-        added, subject_name, error_msg = import_from_json(text)
+        added, subject_name, error_msg = await asyncio.to_thread(import_from_json, text)
 
         result_text = (
             f"📥 <b>Import natijasi</b>\n\n"
@@ -139,19 +145,26 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("⛔ Bu buyruq faqat adminlar uchun.")
         return
 
-    session = get_session()
-    try:
-        total_subjects = session.query(func.count(Subject.id)).scalar()
-        total_questions = session.query(func.count(Question.id)).scalar()
-        total_results = session.query(func.count(UserResult.id)).filter_by(is_mock=False).scalar()
-        unique_users = session.query(func.count(User.id)).scalar()
+    async with get_async_session() as session:
+        total_subjects = await session.scalar(select(func.count(Subject.id)))
+        total_questions = await session.scalar(select(func.count(Question.id)))
+        total_results = await session.scalar(
+            select(func.count(UserResult.id)).where(UserResult.is_mock.is_(False))
+        )
+        unique_users = await session.scalar(select(func.count(User.id)))
 
         # Fan bo'yicha savollar soni
-        subjects = session.query(Subject).all()
+        q_counts = dict((await session.execute(
+            select(Question.subject_id, func.count(Question.id)).group_by(Question.subject_id)
+        )).all())
+        r_counts = dict((await session.execute(
+            select(UserResult.subject_id, func.count(UserResult.id)).group_by(UserResult.subject_id)
+        )).all())
+        subjects = (await session.scalars(select(Subject))).all()
         subject_info = ""
         for s in subjects:
-            q_count = session.query(func.count(Question.id)).filter_by(subject_id=s.id).scalar()
-            r_count = session.query(func.count(UserResult.id)).filter_by(subject_id=s.id).scalar()
+            q_count = q_counts.get(s.id, 0)
+            r_count = r_counts.get(s.id, 0)
             subject_info += f"  {s.emoji} {s.name}: {q_count} savol, {r_count} test\n"
 
         text = (
@@ -165,7 +178,89 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         if subject_info:
             text += f"{'─' * 25}\n📚 <b>Fanlar tafsiloti:</b>\n\n{subject_info}"
 
+        text += await _item_stats_section(session)
+
         await update.message.reply_text(text, parse_mode="HTML")
 
-    finally:
-        session.close()
+
+# Point-biserial shundan past bo'lsa savol kuchli/kuchsizni ajratmaydi
+WEAK_DISCRIMINATION = 0.15
+
+
+async def _item_stats_section(session):
+    """question_stats (utils/item_stats.py) bo'yicha kalibrlash xulosasi"""
+    measured, calibrated, avg_p = (await session.execute(
+        select(func.count(QuestionStats.question_id), func.count(QuestionStats.difficulty), func.avg(QuestionStats.p_value))
+    )).one()
+    if not measured:
+        return ""
+    mismatched = await session.scalar(
+        select(func.count(Question.id))
+        .join(QuestionStats, QuestionStats.question_id == Question.id)
+        .where(QuestionStats.difficulty.isnot(None), QuestionStats.difficulty != Question.difficulty)
+    )
+    weak = (await session.scalars(
+        select(QuestionStats)
+        .where(QuestionStats.answers >= ITEM_STATS_MIN_ANSWERS, QuestionStats.discrimination < WEAK_DISCRIMINATION)
+        .order_by(QuestionStats.discrimination)
+        .limit(5)
+    )).all()
+
+    text = (
+        f"\n{'─' * 25}\n📐 <b>Savollar kalibrlash:</b>\n\n"
+        f"  Statistikasi bor: {measured} | kalibrlangan: {calibrated}\n"
+        f"  Qo'lda qo'yilgan qiyinlikdan farqli: {mismatched}\n"
+        f"  O'rtacha p-value: {avg_p:.2f}\n"
+    )
+    if weak:
+        text += f"\n⚠️ Ajratmaydigan savollar (r &lt; {WEAK_DISCRIMINATION}):\n"
+        for st in weak:
+            picks = {"A": st.pick_a, "B": st.pick_b, "C": st.pick_c, "D": st.pick_d}
+            option, rate = max(picks.items(), key=lambda kv: kv[1])
+            text += (
+                f"  #{st.question_id}: p={st.p_value:.2f}, r={st.discrimination:.2f}, "
+                f"ko'p tanlangan {option} ({rate:.0%}), {st.answers} javob\n"
+            )
+    return text
+
+
+async def admin_metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/admin_metrics — bot jarayonining DB pool va so'rov metrikalari"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Bu buyruq faqat adminlar uchun.")
+        return
+
+    text = "📈 <b>DB metrikalar (bot jarayoni)</b>\n\n"
+    for name, p in metrics.pool_summary().items():
+        text += (
+            f"🔌 <b>{name}</b> pool: {p['checked_out']}/{p['size']} band, "
+            f"overflow {p['overflow']} (max {p['max_overflow_seen']})\n"
+            f"    Checkout: {p['checkouts']} ta | kutish p50 {p['wait_p50_ms']:.1f} ms, "
+            f"p99 {p['wait_p99_ms']:.1f} ms, max {p['wait_max_ms']:.1f} ms | timeout: {p['timeouts']}\n"
+        )
+    text += f"📝 Write-behind navbati: <b>{write_behind.depth}</b>\n"
+
+    limiter = rate_limiter.stats()
+    text += (
+        f"📤 Chiquvchi navbat: <b>{limiter['queued']}</b> | chatlar: {limiter['chat_buckets']} | "
+        f"RetryAfter: {limiter['retry_after']} ({limiter['retry_after_seconds']:.0f} s) | "
+        f"yo'qolgan: {limiter['failed']}\n"
+    )
+    for name, p in limiter["priorities"].items():
+        text += (
+            f"    {name}: {p['sent']} ta | kutish p50 {p['wait_p50_ms']:.0f} ms, "
+            f"p99 {p['wait_p99_ms']:.0f} ms, max {p['wait_max_ms']:.0f} ms\n"
+        )
+
+    for title, by in (("⏱️ Eng ko'p vaqt olgan so'rovlar", "total"), ("🐢 Eng sekin so'rovlar (p95)", "p95")):
+        text += f"\n{'─' * 25}\n{title}:\n\n"
+        for row in metrics.top_statements(5, by=by):
+            text += (
+                f"• {row['count']}× | jami {row['total_ms']:.0f} ms | o'rt. {row['avg_ms']:.1f} ms | "
+                f"p95 {row['p95_ms']:.0f} ms\n<code>{escape(row['sql'][:160])}</code>\n"
+            )
+
+    if len(text) > 4000:
+        # HTML teglar yarmida kesilmasligi uchun qator chegarasida
+        text = text[:text.rfind("\n", 0, 4000)]
+    await update.message.reply_text(text, parse_mode="HTML")
@@ -1,13 +1,14 @@
 """Audio Listening — TTS orqali eshitib tushunish"""
 import os
 import tempfile
+import time
 from gtts import gTTS
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-
-from database import get_session, Subject, Question
-from keyboards.inline import answer_keyboard
+from keyboards.inline import answer_keyboard, parse_answer
+from utils.answer_events import answer_events
+from utils.question_bank import question_bank
 import random
 
 
@@ -16,20 +17,19 @@ async def audio_test_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     from handlers.payment import require_premium
     if not await require_premium(update, "🎧 Audio Listening"):
         return
-    session = get_session()
     try:
         # Listening bo'limini topish
-        subject = session.query(Subject).filter_by(name="Listening").first()
+        subject = question_bank.subject_by_name("Listening")
         if not subject:
             await update.message.reply_text("❌ Listening bo'limi topilmadi!")
             return
 
-        questions = session.query(Question).filter_by(subject_id=subject.id).all()
-        if not questions:
+        question_ids = question_bank.ids(subject.id)
+        if not question_ids:
             await update.message.reply_text("❌ Listening savollari topilmadi!")
             return
 
-        q = random.choice(questions)
+        q = question_bank.get(random.choice(question_ids))
         options = q.get_options()
 
         # Audio yaratish
@@ -78,15 +78,41 @@ async def audio_test_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
         # Javob uchun context saqlash
+        kb = answer_keyboard(q.id, "audio")
+        await update.message.reply_text(text, parse_mode="HTML", reply_markup=kb)
         context.user_data["audio_question"] = {
             "question_id": q.id,
             "correct": q.correct_answer,
+            "shown_at": time.time(),
         }
 
-        kb = answer_keyboard(q.id)
-        await update.message.reply_text(text, parse_mode="HTML", reply_markup=kb)
-
     except Exception as e:
         await update.message.reply_text(f"❌ Audio xatolik: {str(e)[:100]}")
-    finally:
-        session.close()
+
+
+async def audio_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Audio savol javobi (`ans_audio_<id>_<harf>`)"""
+    query = update.callback_query
+    audio = context.user_data.get("audio_question")
+    question_id, user_answer = parse_answer(query.data)
+    if not audio or audio["question_id"] != question_id:
+        return False
+
+    context.user_data.pop("audio_question", None)
+    correct = audio["correct"]
+    is_correct = user_answer == correct
+    answer_events.record(query.from_user.id, question_id, "audio", user_answer, is_correct, audio.get("shown_at"))
+
+    if is_correct:
+        await query.answer("✅ To'g'ri!")
+        result = "✅ <b>To'g'ri!</b> 🎉"
+    else:
+        await query.answer("❌ Noto'g'ri!")
+        q = question_bank.get(question_id)
+        correct_text = q.get_options()[correct] if q else ""
+        result = f"❌ <b>Noto'g'ri!</b>\n✅ To'g'ri: {correct.upper()}) {correct_text}"
+
+    await query.edit_message_text(
+        f"{query.message.text_html}\n\n{result}\n\n🎧 Yana bitta: /audio", parse_mode="HTML",
+    )
+    return True
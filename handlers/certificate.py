@@ -7,8 +7,8 @@ from fpdf import FPDF
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database import get_session, UserResult, Subject
-from sqlalchemy import desc
+from database import get_async_session, UserResult, Subject
+from sqlalchemy import select, desc
 
 
 class CertificatePDF(FPDF):
@@ -88,14 +88,14 @@ async def certificate_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not await require_premium(update, "📊 PDF Sertifikat"):
         return
     user_id = update.effective_user.id
-    session = get_session()
+    session = get_async_session()
     try:
         # Oxirgi natijani olish
-        result = (
-            session.query(UserResult)
+        result = await session.scalar(
+            select(UserResult)
             .filter_by(user_id=user_id)
             .order_by(desc(UserResult.completed_at))
-            .first()
+            .limit(1)
         )
 
         if not result:
@@ -105,7 +105,7 @@ async def certificate_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return
 
-        subject = session.query(Subject).get(result.subject_id)
+        subject = await session.get(Subject, result.subject_id)
         s_name = subject.name if subject else "Unknown"
 
         # Band hisoblash
@@ -146,4 +146,4 @@ async def certificate_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception as e:
         await update.message.reply_text(f"❌ Xatolik: {str(e)[:100]}")
     finally:
-        session.close()
+        await session.close()
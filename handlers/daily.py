@@ -1,13 +1,18 @@
 """Daily test, daily word, reminders"""
 import json
+import logging
 import os
 import random
 from datetime import datetime, time
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, JobQueue
+from sqlalchemy import select
 
-from database import get_session, Subject, Question, UserSettings, DailyStreak
+from database import get_async_session, UserSettings
+from utils.rate_limiter import BULK
+
+logger = logging.getLogger(__name__)
 
 
 def _load_daily_words():
@@ -73,25 +78,22 @@ async def random_word_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 async def reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/eslatma buyrug'i"""
     user_id = update.effective_user.id
-    session = get_session()
-    try:
-        settings = session.query(UserSettings).filter_by(user_id=user_id).first()
-        status = "✅ Yoqilgan" if settings and settings.reminder_enabled else "❌ O'chirilgan"
-
-        keyboard = [
-            [InlineKeyboardButton("✅ Eslatmani yoqish", callback_data="reminder_on")],
-            [InlineKeyboardButton("❌ Eslatmani o'chirish", callback_data="reminder_off")],
-            [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
-        ]
-        await update.message.reply_text(
-            f"🔔 <b>Kundalik eslatma</b>\n\n"
-            f"Holati: {status}\n\n"
-            f"Bot sizga har kuni ertalab test yechishni eslatadi.",
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-    finally:
-        session.close()
+    async with get_async_session() as session:
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user_id).limit(1))
+    status = "✅ Yoqilgan" if settings and settings.reminder_enabled else "❌ O'chirilgan"
+
+    keyboard = [
+        [InlineKeyboardButton("✅ Eslatmani yoqish", callback_data="reminder_on")],
+        [InlineKeyboardButton("❌ Eslatmani o'chirish", callback_data="reminder_off")],
+        [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
+    ]
+    await update.message.reply_text(
+        f"🔔 <b>Kundalik eslatma</b>\n\n"
+        f"Holati: {status}\n\n"
+        f"Bot sizga har kuni ertalab test yechishni eslatadi.",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
 
 
 async def reminder_toggle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -103,9 +105,8 @@ async def reminder_toggle_callback(update: Update, context: ContextTypes.DEFAULT
     action = query.data.replace("reminder_", "")
     enable = action == "on"
 
-    session = get_session()
-    try:
-        settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+    async with get_async_session() as session:
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user_id).limit(1))
         if not settings:
             settings = UserSettings(user_id=user_id)
             session.add(settings)
@@ -113,59 +114,57 @@ async def reminder_toggle_callback(update: Update, context: ContextTypes.DEFAULT
         settings.reminder_enabled = enable
         settings.daily_word_enabled = enable
         settings.daily_test_enabled = enable
-        session.commit()
-
-        if enable:
-            text = (
-                "✅ <b>Eslatma yoqildi!</b>\n\n"
-                "Har kuni sizga:\n"
-                "📅 Kundalik test\n"
-                "💡 Yangi IELTS so'z\n"
-                "🔔 Eslatma xabari\n\nyuboriladi!"
-            )
-        else:
-            text = "❌ <b>Eslatma o'chirildi.</b>\n\nIstagan vaqt qayta yoqishingiz mumkin."
+        await session.commit()
+
+    if enable:
+        text = (
+            "✅ <b>Eslatma yoqildi!</b>\n\n"
+            "Har kuni sizga:\n"
+            "📅 Kundalik test\n"
+            "💡 Yangi IELTS so'z\n"
+            "🔔 Eslatma xabari\n\nyuboriladi!"
+        )
+    else:
+        text = "❌ <b>Eslatma o'chirildi.</b>\n\nIstagan vaqt qayta yoqishingiz mumkin."
 
-        keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
-        await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 # === Scheduled Jobs ===
 
 async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
     """Har kunlik eslatma (JobQueue orqali chaqiriladi)"""
-    session = get_session()
-    try:
-        users = session.query(UserSettings).filter_by(reminder_enabled=True).all()
-        words = _load_daily_words()
-        day_index = datetime.now().timetuple().tm_yday % len(words)
-        word = words[day_index] if words else None
-
-        for user in users:
-            try:
-                # Eslatma
-                text = "🔔 <b>Kundalik eslatma!</b>\n\nBugun IELTS test yechdingizmi? 📝\n\n"
-
-                if word:
-                    text += (
-                        f"💡 <b>Bugungi so'z:</b> <b>{word['word']}</b>\n"
-                        f"📖 {word['meaning']}\n"
-                        f"📝 <i>{word['example']}</i>\n\n"
-                    )
-
-                text += "Testni boshlash uchun /bolimlar ni bosing!"
-
-                await context.bot.send_message(
-                    chat_id=user.user_id,
-                    text=text,
-                    parse_mode="HTML",
+    async with get_async_session() as session:
+        user_ids = (await session.scalars(
+            select(UserSettings.user_id).filter_by(reminder_enabled=True)
+        )).all()
+    words = _load_daily_words()
+    day_index = datetime.now().timetuple().tm_yday % len(words)
+    word = words[day_index] if words else None
+
+    for user_id in user_ids:
+        try:
+            # Eslatma
+            text = "🔔 <b>Kundalik eslatma!</b>\n\nBugun IELTS test yechdingizmi? 📝\n\n"
+
+            if word:
+                text += (
+                    f"💡 <b>Bugungi so'z:</b> <b>{word['word']}</b>\n"
+                    f"📖 {word['meaning']}\n"
+                    f"📝 <i>{word['example']}</i>\n\n"
                 )
-            except Exception:
-                pass
-    finally:
-        session.close()
+
+            text += "Testni boshlash uchun /bolimlar ni bosing!"
+
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=text,
+                parse_mode="HTML",
+                rate_limit_args=BULK,
+            )
+        except Exception as e:
+            logger.warning(f"Eslatma yuborilmadi ({user_id}): {e}")
 
 
 def setup_daily_jobs(job_queue: JobQueue):
@@ -1,11 +1,20 @@
 """Study Plan — 30/60/90 kunlik reja + Speed Round + Premium + Translation"""
+import functools
+import time
 from datetime import date, timedelta, datetime
-import random
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from sqlalchemy import select, delete
 
-from database import get_session, StudyPlan, UserSettings, Subject, Question, UserResult
+from config import TIME_PER_QUESTION_SPEED
+from database import get_async_session, StudyPlan, UserSettings
+from utils.answer_events import answer_events
+from utils.question_bank import question_bank
+from utils.seen import seen_questions
+from utils.render_cache import render_cache
+from utils.deadlines import deadlines
+from keyboards.inline import parse_answer
 
 
 # === Study Plan ===
@@ -59,9 +68,8 @@ async def studyplan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_premium(update, "📅 Study Plan"):
         return
     user_id = update.effective_user.id
-    session = get_session()
-    try:
-        plan = session.query(StudyPlan).filter_by(user_id=user_id).first()
+    async with get_async_session() as session:
+        plan = await session.scalar(select(StudyPlan).filter_by(user_id=user_id).limit(1))
 
         if plan and not plan.completed:
             # Mavjud rejani ko'rsatish
@@ -104,9 +112,7 @@ async def studyplan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
             ]
 
-        await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def plan_create_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -116,10 +122,9 @@ async def plan_create_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = query.from_user.id
     plan_type = query.data.split("_")[2]
 
-    session = get_session()
-    try:
+    async with get_async_session() as session:
         # Eski rejani o'chirish
-        session.query(StudyPlan).filter_by(user_id=user_id).delete()
+        await session.execute(delete(StudyPlan).where(StudyPlan.user_id == user_id))
 
         plan = StudyPlan(
             user_id=user_id,
@@ -129,7 +134,7 @@ async def plan_create_callback(update: Update, context: ContextTypes.DEFAULT_TYP
             current_day=1,
         )
         session.add(plan)
-        session.commit()
+        await session.commit()
 
         plan_info = STUDY_PLANS[plan_type]
         text = (
@@ -141,10 +146,8 @@ async def plan_create_callback(update: Update, context: ContextTypes.DEFAULT_TYP
             f"📝 {plan_info['weeks'][0]['daily']}\n\n"
             f"Har kuni /reja buyrug'ini bosib, vazifangizni tekshiring!"
         )
-        keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
-        await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def plan_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -153,14 +156,13 @@ async def plan_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer("✅ Bugungi vazifa bajarildi!")
     user_id = query.from_user.id
 
-    session = get_session()
-    try:
-        plan = session.query(StudyPlan).filter_by(user_id=user_id).first()
+    async with get_async_session() as session:
+        plan = await session.scalar(select(StudyPlan).filter_by(user_id=user_id).limit(1))
         if plan:
             plan.current_day += 1
             if plan.current_day > int(plan.plan_type):
                 plan.completed = True
-            session.commit()
+            await session.commit()
 
             if plan.completed:
                 text = "🎉 <b>Tabriklaymiz!</b> Reja to'liq tugatildi! 🏆"
@@ -169,21 +171,16 @@ async def plan_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
         await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
 
 
 async def plan_delete_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer("🗑️ Reja o'chirildi!")
     user_id = query.from_user.id
-    session = get_session()
-    try:
-        session.query(StudyPlan).filter_by(user_id=user_id).delete()
-        session.commit()
-        await query.edit_message_text("🗑️ Reja o'chirildi. /reja orqali yangi reja yarating.")
-    finally:
-        session.close()
+    async with get_async_session() as session:
+        await session.execute(delete(StudyPlan).where(StudyPlan.user_id == user_id))
+        await session.commit()
+    await query.edit_message_text("🗑️ Reja o'chirildi. /reja orqali yangi reja yarating.")
 
 
 # === Speed Round ===
@@ -193,40 +190,34 @@ async def speed_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     from handlers.payment import require_premium
     if not await require_premium(update, "🎮 Speed Round"):
         return
-    session = get_session()
-    try:
-        subjects = session.query(Subject).all()
-        if not subjects:
-            await update.message.reply_text("❌ Bo'limlar topilmadi!")
-            return
-
-        # Barcha fanlardan 15 ta tasodifiy savol
-        all_questions = session.query(Question).all()
-        if len(all_questions) < 5:
-            await update.message.reply_text("❌ Yetarli savol yo'q!")
-            return
-
-        selected = random.sample(all_questions, min(15, len(all_questions)))
-
-        context.user_data["speed"] = {
-            "questions": [q.id for q in selected],
-            "current_index": 0,
-            "score": 0,
-            "total": len(selected),
-            "start_time": datetime.utcnow().isoformat(),
-            "times": [],
-        }
+    if not question_bank.subjects():
+        await update.message.reply_text("❌ Bo'limlar topilmadi!")
+        return
 
-        text = (
-            "🎮 <b>SPEED ROUND!</b>\n\n"
-            f"⚡ {len(selected)} ta savol — eng tez javob bering!\n"
-            "⏱️ Vaqtingiz hisoblanadi!\n\n"
-            "Tayyor? 👇"
-        )
-        keyboard = [[InlineKeyboardButton("🚀 BOSHLASH!", callback_data="speed_start")]]
-        await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    # Barcha fanlardan 15 ta tasodifiy savol
+    if question_bank.count() < 5:
+        await update.message.reply_text("❌ Yetarli savol yo'q!")
+        return
+
+    selected = await seen_questions.sample(update.effective_user.id, 15)
+
+    context.user_data["speed"] = {
+        "questions": selected,
+        "current_index": 0,
+        "score": 0,
+        "total": len(selected),
+        "start_time": datetime.utcnow().isoformat(),
+        "times": [],
+    }
+
+    text = (
+        "🎮 <b>SPEED ROUND!</b>\n\n"
+        f"⚡ {len(selected)} ta savol — eng tez javob bering!\n"
+        f"⏱️ Vaqtingiz hisoblanadi! Har bir savolga {TIME_PER_QUESTION_SPEED} soniya.\n\n"
+        "Tayyor? 👇"
+    )
+    keyboard = [[InlineKeyboardButton("🚀 BOSHLASH!", callback_data="speed_start")]]
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def speed_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -237,32 +228,85 @@ async def speed_start_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     speed["q_start_time"] = datetime.utcnow().isoformat()
-    session = get_session()
-    try:
-        await _send_speed_question(query, context, session)
-    finally:
-        session.close()
+    if not _skip_missing(speed):
+        context.user_data.pop("speed", None)
+        await query.edit_message_text("❌ Savollar topilmadi. Qaytadan boshlang: /speed")
+        return
+    await _send_speed_question(query, context)
+
+
+async def _send_speed_question(query, context):
+    await _show_speed_question(
+        context, query.from_user.id, query.edit_message_text,
+        query.message.chat_id, getattr(query.message, "message_id", None),
+    )
+
+
+def _skip_missing(speed):
+    """Bankda yo'q id larni (tiklangan holat) chiqarib tashlash; savol qoldimi"""
+    while speed["current_index"] < speed["total"]:
+        if render_cache.get(speed["questions"][speed["current_index"]], "speed"):
+            return True
+        del speed["questions"][speed["current_index"]]
+        speed["total"] -= 1
+    return False
 
 
-async def _send_speed_question(query, context, session):
+async def _show_speed_question(context, user_id, edit, chat_id, message_id):
     speed = context.user_data.get("speed")
     idx = speed["current_index"]
     qid = speed["questions"][idx]
-    q = session.query(Question).get(qid)
-    options = q.get_options()
+    r = render_cache.get(qid, "speed")
+    await edit(r.text(idx + 1, speed["total"]), parse_mode="HTML", reply_markup=r.markup)
+    speed["q_start_time"] = datetime.utcnow().isoformat()
+
+    # Vaqt chegarasi (utils/deadlines.py)
+    data = {"chat_id": chat_id, "message_id": message_id, "index": idx}
+    speed["deadline"] = deadlines.arm("speed", user_id, TIME_PER_QUESTION_SPEED, data)
+    speed["deadline_data"] = data
+
+
+def _speed_result(speed):
+    total_time = sum(speed["times"])
+    avg_time = total_time / len(speed["times"])
+    score = speed["score"]
+    total = speed["total"]
 
-    from keyboards.inline import answer_keyboard
     text = (
-        f"⚡ <b>Speed #{idx + 1}/{speed['total']}</b>\n\n"
-        f"❓ {q.text}\n\n"
-        f"🅰️ <b>A)</b> {options['a']}\n"
-        f"🅱️ <b>B)</b> {options['b']}\n"
-        f"🅲 <b>C)</b> {options['c']}\n"
-        f"🅳 <b>D)</b> {options['d']}"
+        f"🏁 <b>Speed Round tugadi!</b>\n\n"
+        f"⏱️ Umumiy vaqt: <b>{total_time:.1f}s</b>\n"
+        f"⚡ O'rtacha: <b>{avg_time:.1f}s</b> / savol\n\n"
+        f"✅ To'g'ri: {score}/{total}\n"
+        f"📊 Aniqlik: {score/total*100:.0f}%\n\n"
     )
-    kb = answer_keyboard(q.id)
-    await query.edit_message_text(text, parse_mode="HTML", reply_markup=kb)
-    speed["q_start_time"] = datetime.utcnow().isoformat()
+
+    if avg_time < 5:
+        text += "🏆 Chaqmoq tezligida! Ajoyib!"
+    elif avg_time < 10:
+        text += "⚡ Juda tez! Yaxshi natija!"
+    elif avg_time < 20:
+        text += "👍 Yaxshi tezlik!"
+    else:
+        text += "🐢 Yaxshi mashq qiling. Tezlikni oshiring!"
+
+    keyboard = [
+        [InlineKeyboardButton("🔄 Yana o'ynash", callback_data="speed_restart")],
+        [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def _speed_next(context, user_id, edit, chat_id, message_id):
+    speed = context.user_data["speed"]
+    speed["current_index"] += 1
+
+    if _skip_missing(speed):
+        await _show_speed_question(context, user_id, edit, chat_id, message_id)
+    else:
+        # Tugadi
+        text, markup = _speed_result(speed)
+        await edit(text, parse_mode="HTML", reply_markup=markup)
+        context.user_data.pop("speed", None)
 
 
 async def speed_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -272,12 +316,15 @@ async def speed_answer_callback(update: Update, context: ContextTypes.DEFAULT_TY
     if not speed:
         return False
 
-    parts = query.data.split("_")
-    question_id = int(parts[1])
+    question_id, user_answer = parse_answer(query.data)
     if question_id not in speed["questions"]:
         return False
+    if question_id != speed["questions"][speed["current_index"]]:
+        await query.answer("⏱️ Bu savol vaqti tugagan!")
+        return True
 
-    user_answer = parts[2]
+    deadlines.cancel("speed", query.from_user.id)
+    speed.pop("deadline", None)
     await query.answer()
 
     # Vaqt hisoblash
@@ -285,51 +332,33 @@ async def speed_answer_callback(update: Update, context: ContextTypes.DEFAULT_TY
     elapsed = (datetime.utcnow() - q_start).total_seconds()
     speed["times"].append(elapsed)
 
-    session = get_session()
-    try:
-        q = session.query(Question).get(question_id)
-        is_correct = user_answer == q.correct_answer
-        if is_correct:
-            speed["score"] += 1
-
-        speed["current_index"] += 1
-
-        if speed["current_index"] < speed["total"]:
-            await _send_speed_question(query, context, session)
-        else:
-            # Tugadi
-            total_time = sum(speed["times"])
-            avg_time = total_time / len(speed["times"])
-            score = speed["score"]
-            total = speed["total"]
-
-            text = (
-                f"🏁 <b>Speed Round tugadi!</b>\n\n"
-                f"⏱️ Umumiy vaqt: <b>{total_time:.1f}s</b>\n"
-                f"⚡ O'rtacha: <b>{avg_time:.1f}s</b> / savol\n\n"
-                f"✅ To'g'ri: {score}/{total}\n"
-                f"📊 Aniqlik: {score/total*100:.0f}%\n\n"
-            )
+    q = question_bank.get(question_id)
+    is_correct = q is not None and user_answer == q.correct_answer
+    answer_events.record(query.from_user.id, question_id, "speed", user_answer, is_correct, time.time() - elapsed)
+    if is_correct:
+        speed["score"] += 1
 
-            if avg_time < 5:
-                text += "🏆 Chaqmoq tezligida! Ajoyib!"
-            elif avg_time < 10:
-                text += "⚡ Juda tez! Yaxshi natija!"
-            elif avg_time < 20:
-                text += "👍 Yaxshi tezlik!"
-            else:
-                text += "🐢 Yaxshi mashq qiling. Tezlikni oshiring!"
+    await _speed_next(
+        context, query.from_user.id, query.edit_message_text,
+        query.message.chat_id, getattr(query.message, "message_id", None),
+    )
+    return True
 
-            keyboard = [
-                [InlineKeyboardButton("🔄 Yana o'ynash", callback_data="speed_restart")],
-                [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
-            ]
-            await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-            context.user_data.pop("speed", None)
 
-        return True
-    finally:
-        session.close()
+async def speed_deadline_expired(context, user_id, data):
+    """Speed savol vaqti tugadi: to'liq vaqt hisoblanadi, keyingi savolga o'tiladi"""
+    speed = context.user_data.get("speed")
+    # Eski (javob berilgan yoki qayta boshlangan) taymer — e'tiborsiz
+    if not speed or speed.get("deadline_data") != data or not data.get("message_id"):
+        return
+    speed.pop("deadline", None)
+    speed["times"].append(float(TIME_PER_QUESTION_SPEED))
+    qid = speed["questions"][speed["current_index"]]
+    answer_events.record(user_id, qid, "speed", None, False, time.time() - TIME_PER_QUESTION_SPEED)
+    edit = functools.partial(
+        context.bot.edit_message_text, chat_id=data["chat_id"], message_id=data["message_id"],
+    )
+    await _speed_next(context, user_id, edit, data["chat_id"], data["message_id"])
 
 
 # === Translation Mode ===
@@ -340,9 +369,8 @@ async def translation_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not await require_premium(update, "🌐 Tarjima rejimi"):
         return
     user_id = update.effective_user.id
-    session = get_session()
-    try:
-        settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+    async with get_async_session() as session:
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user_id).limit(1))
         current = settings.translation_mode if settings else False
         status = "✅ Yoqilgan" if current else "❌ O'chirilgan"
 
@@ -358,8 +386,6 @@ async def translation_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup(keyboard),
         )
-    finally:
-        session.close()
 
 
 async def translation_toggle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -368,20 +394,17 @@ async def translation_toggle_callback(update: Update, context: ContextTypes.DEFA
     user_id = query.from_user.id
     enable = "on" in query.data
 
-    session = get_session()
-    try:
-        settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+    async with get_async_session() as session:
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user_id).limit(1))
         if not settings:
             settings = UserSettings(user_id=user_id)
             session.add(settings)
         settings.translation_mode = enable
-        session.commit()
+        await session.commit()
 
-        status = "✅ Yoqildi" if enable else "❌ O'chirildi"
-        keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
-        await query.edit_message_text(f"🌐 Tarjima rejimi: {status}", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    status = "✅ Yoqildi" if enable else "❌ O'chirildi"
+    keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
+    await query.edit_message_text(f"🌐 Tarjima rejimi: {status}", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 
@@ -407,3 +430,5 @@ async def miniapp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
+
+deadlines.register("speed", speed_deadline_expired)
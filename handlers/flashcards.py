@@ -5,8 +5,9 @@ import random
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from sqlalchemy import select, func
 
-from database import get_session, Flashcard
+from database import get_async_session, Flashcard
 
 
 def _load_default_cards():
@@ -22,30 +23,35 @@ async def flashcards_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not await require_premium(update, "🗂️ Flashcards"):
         return
     user_id = update.effective_user.id
-    session = get_session()
-    try:
-        total = session.query(Flashcard).filter_by(user_id=user_id).count()
-        mastered = session.query(Flashcard).filter_by(user_id=user_id, mastered=True).count()
-        learning = total - mastered
-
-        keyboard = [
-            [InlineKeyboardButton("🎴 Kartochka ko'rish", callback_data="fc_study")],
-            [InlineKeyboardButton("➕ Default kartalar yuklash", callback_data="fc_load_defaults")],
-            [InlineKeyboardButton("📊 Statistika", callback_data="fc_stats")],
-            [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
-        ]
-
-        await update.message.reply_text(
-            f"🗂️ <b>Flashcards</b>\n\n"
-            f"📊 Jami kartalar: <b>{total}</b>\n"
-            f"📗 O'rganilgan: <b>{mastered}</b>\n"
-            f"📙 O'rganilmoqda: <b>{learning}</b>\n\n"
-            f"Kartochkalarni ko'rish va o'rganish uchun bosing:",
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-    finally:
-        session.close()
+    total, mastered = await _flashcard_counts(user_id)
+    learning = total - mastered
+
+    keyboard = [
+        [InlineKeyboardButton("🎴 Kartochka ko'rish", callback_data="fc_study")],
+        [InlineKeyboardButton("➕ Default kartalar yuklash", callback_data="fc_load_defaults")],
+        [InlineKeyboardButton("📊 Statistika", callback_data="fc_stats")],
+        [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
+    ]
+
+    await update.message.reply_text(
+        f"🗂️ <b>Flashcards</b>\n\n"
+        f"📊 Jami kartalar: <b>{total}</b>\n"
+        f"📗 O'rganilgan: <b>{mastered}</b>\n"
+        f"📙 O'rganilmoqda: <b>{learning}</b>\n\n"
+        f"Kartochkalarni ko'rish va o'rganish uchun bosing:",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def _flashcard_counts(user_id):
+    """(jami, o'rganilgan) kartalar soni — bitta so'rov"""
+    async with get_async_session() as session:
+        row = (await session.execute(
+            select(func.count(Flashcard.id), func.count(Flashcard.id).filter(Flashcard.mastered.is_(True)))
+            .where(Flashcard.user_id == user_id)
+        )).one()
+    return row[0] or 0, row[1] or 0
 
 
 async def load_defaults_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -54,9 +60,8 @@ async def load_defaults_callback(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     user_id = query.from_user.id
 
-    session = get_session()
-    try:
-        existing = session.query(Flashcard).filter_by(user_id=user_id).count()
+    async with get_async_session() as session:
+        existing = await session.scalar(select(func.count(Flashcard.id)).where(Flashcard.user_id == user_id))
         if existing > 0:
             await query.edit_message_text(
                 "✅ Kartalar allaqachon yuklangan!\n\n"
@@ -77,7 +82,7 @@ async def load_defaults_callback(update: Update, context: ContextTypes.DEFAULT_T
                 category="vocabulary",
             )
             session.add(card)
-        session.commit()
+        await session.commit()
 
         await query.edit_message_text(
             f"✅ <b>{len(words)}</b> ta kartochka yuklandi!\n\n"
@@ -87,8 +92,6 @@ async def load_defaults_callback(update: Update, context: ContextTypes.DEFAULT_T
                 InlineKeyboardButton("🎴 Boshlash", callback_data="fc_study")
             ]]),
         )
-    finally:
-        session.close()
 
 
 async def study_flashcard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -97,12 +100,11 @@ async def study_flashcard_callback(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     user_id = query.from_user.id
 
-    session = get_session()
-    try:
+    async with get_async_session() as session:
         # O'rganilmagan kartalardan tasodifiy
-        cards = session.query(Flashcard).filter_by(user_id=user_id, mastered=False).all()
+        cards = (await session.scalars(select(Flashcard).filter_by(user_id=user_id, mastered=False))).all()
         if not cards:
-            cards = session.query(Flashcard).filter_by(user_id=user_id).all()
+            cards = (await session.scalars(select(Flashcard).filter_by(user_id=user_id))).all()
 
         if not cards:
             await query.edit_message_text(
@@ -130,8 +132,6 @@ async def study_flashcard_callback(update: Update, context: ContextTypes.DEFAULT
         ]
 
         await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
 
 
 async def reveal_flashcard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -140,9 +140,8 @@ async def reveal_flashcard_callback(update: Update, context: ContextTypes.DEFAUL
     await query.answer()
 
     card_id = int(query.data.split("_")[2])
-    session = get_session()
-    try:
-        card = session.query(Flashcard).get(card_id)
+    async with get_async_session() as session:
+        card = await session.get(Flashcard, card_id)
         if not card:
             await query.edit_message_text("❌ Kartochka topilmadi!")
             return
@@ -166,8 +165,6 @@ async def reveal_flashcard_callback(update: Update, context: ContextTypes.DEFAUL
         ]
 
         await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
 
 
 async def flashcard_response_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -179,25 +176,22 @@ async def flashcard_response_callback(update: Update, context: ContextTypes.DEFA
     knew = parts[1] == "knew"
     card_id = int(parts[2])
 
-    session = get_session()
-    try:
-        card = session.query(Flashcard).get(card_id)
+    async with get_async_session() as session:
+        card = await session.get(Flashcard, card_id)
         if card and knew:
             card.mastered = True
-            session.commit()
+            await session.commit()
 
-        if knew:
-            text = "✅ <b>Ajoyib!</b> Kartochka o'rganildi deb belgilandi.\n\n⏭️ Keyingisiga o'tamiz!"
-        else:
-            text = "📖 Xavotir olmang, mashq qilsangiz o'rganasiz!\n\n⏭️ Keyingisiga o'tamiz!"
+    if knew:
+        text = "✅ <b>Ajoyib!</b> Kartochka o'rganildi deb belgilandi.\n\n⏭️ Keyingisiga o'tamiz!"
+    else:
+        text = "📖 Xavotir olmang, mashq qilsangiz o'rganasiz!\n\n⏭️ Keyingisiga o'tamiz!"
 
-        keyboard = [
-            [InlineKeyboardButton("🎴 Keyingi kartochka", callback_data="fc_study")],
-            [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
-        ]
-        await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    keyboard = [
+        [InlineKeyboardButton("🎴 Keyingi kartochka", callback_data="fc_study")],
+        [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
+    ]
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def flashcard_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -206,27 +200,22 @@ async def flashcard_stats_callback(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     user_id = query.from_user.id
 
-    session = get_session()
-    try:
-        total = session.query(Flashcard).filter_by(user_id=user_id).count()
-        mastered = session.query(Flashcard).filter_by(user_id=user_id, mastered=True).count()
-        learning = total - mastered
-        pct = (mastered / total * 100) if total > 0 else 0
-
-        filled = round(10 * pct / 100)
-        bar = "🟩" * filled + "⬜" * (10 - filled)
-
-        text = (
-            f"🗂️ <b>Flashcard Statistika</b>\n\n"
-            f"📊 Jami: <b>{total}</b>\n"
-            f"✅ O'rganilgan: <b>{mastered}</b>\n"
-            f"📙 O'rganilmoqda: <b>{learning}</b>\n\n"
-            f"[{bar}] {pct:.0f}%"
-        )
-        keyboard = [
-            [InlineKeyboardButton("🎴 Davom etish", callback_data="fc_study")],
-            [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
-        ]
-        await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    total, mastered = await _flashcard_counts(user_id)
+    learning = total - mastered
+    pct = (mastered / total * 100) if total > 0 else 0
+
+    filled = round(10 * pct / 100)
+    bar = "🟩" * filled + "⬜" * (10 - filled)
+
+    text = (
+        f"🗂️ <b>Flashcard Statistika</b>\n\n"
+        f"📊 Jami: <b>{total}</b>\n"
+        f"✅ O'rganilgan: <b>{mastered}</b>\n"
+        f"📙 O'rganilmoqda: <b>{learning}</b>\n\n"
+        f"[{bar}] {pct:.0f}%"
+    )
+    keyboard = [
+        [InlineKeyboardButton("🎴 Davom etish", callback_data="fc_study")],
+        [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
+    ]
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
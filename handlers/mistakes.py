@@ -1,23 +1,29 @@
 """Xatolar ro'yxati — noto'g'ri javoblarni qayta yechish"""
+import time
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from sqlalchemy import select, update as sql_update
 
-from database import get_session, WrongAnswer, Question, Subject
-from keyboards.inline import answer_keyboard
+from database import get_async_session, WrongAnswer
+from keyboards.inline import parse_answer
+from utils.answer_events import answer_events
+from utils.render_cache import render_cache
+from utils.question_bank import question_bank
+from utils.write_behind import write_behind
 
 
 async def mistakes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/xatolar buyrug'i"""
     user_id = update.effective_user.id
-    session = get_session()
-    try:
-        wrongs = (
-            session.query(WrongAnswer)
+    await write_behind.flush()
+    async with get_async_session() as session:
+        wrong_qids = (await session.scalars(
+            select(WrongAnswer.question_id)
             .filter_by(user_id=user_id, reviewed=False)
             .order_by(WrongAnswer.answered_at.desc())
-            .all()
-        )
-        if not wrongs:
+        )).all()
+        if not wrong_qids:
             await update.message.reply_text(
                 "✅ <b>Ajoyib!</b> Sizda ko'rib chiqilmagan xatolar yo'q!\n\n"
                 "Yangi test yechib, bilimingizni sinab ko'ring 💪",
@@ -27,16 +33,16 @@ async def mistakes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Subject bo'yicha guruhlash
         subject_counts = {}
-        for w in wrongs:
-            q = session.query(Question).get(w.question_id)
+        for qid in wrong_qids:
+            q = question_bank.get(qid)
             if q:
-                s = session.query(Subject).get(q.subject_id)
+                s = question_bank.subject(q.subject_id)
                 key = s.id if s else 0
                 if key not in subject_counts:
                     subject_counts[key] = {"name": f"{s.emoji} {s.name}" if s else "?", "count": 0}
                 subject_counts[key]["count"] += 1
 
-        text = f"❌ <b>Xatolar ro'yxati</b>\n\nJami: <b>{len(wrongs)}</b> ta ko'rib chiqilmagan xato\n\n"
+        text = f"❌ <b>Xatolar ro'yxati</b>\n\nJami: <b>{len(wrong_qids)}</b> ta ko'rib chiqilmagan xato\n\n"
         for sid, info in subject_counts.items():
             text += f"  {info['name']}: {info['count']} ta\n"
         text += "\n👇 Xatolarni qayta yechish uchun bosing:"
@@ -47,8 +53,6 @@ async def mistakes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
         ]
         await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
 
 
 async def review_mistakes_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -57,14 +61,13 @@ async def review_mistakes_callback(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     user_id = query.from_user.id
 
-    session = get_session()
-    try:
-        wrongs = (
-            session.query(WrongAnswer)
+    await write_behind.flush()
+    async with get_async_session() as session:
+        wrongs = (await session.scalars(
+            select(WrongAnswer)
             .filter_by(user_id=user_id, reviewed=False)
             .limit(10)
-            .all()
-        )
+        )).all()
         if not wrongs:
             await query.edit_message_text("✅ Barcha xatolar ko'rib chiqilgan!")
             return
@@ -78,12 +81,10 @@ async def review_mistakes_callback(update: Update, context: ContextTypes.DEFAULT
             "total": len(wrongs),
         }
 
-        await _send_mistake_question(query, context, session)
-    finally:
-        session.close()
+        await _send_mistake_question(query, context)
 
 
-async def _send_mistake_question(query, context, session):
+async def _send_mistake_question(query, context):
     """Xato savolni ko'rsatish"""
     review = context.user_data.get("mistake_review")
     if not review:
@@ -91,25 +92,26 @@ async def _send_mistake_question(query, context, session):
 
     idx = review["current_index"]
     qid = review["question_ids"][idx]
-    q = session.query(Question).get(qid)
-    if not q:
+    r = render_cache.get(qid, "mistake")
+    if not r:
         return
 
-    s = session.query(Subject).get(q.subject_id)
-    options = q.get_options()
+    text, kb = r.text(idx + 1, review["total"]), r.markup
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=kb)
+    review["shown_at"] = time.time()
 
-    text = (
-        f"🔄 <b>Xato #{idx + 1}/{review['total']}</b>\n"
-        f"Bo'lim: {s.emoji} {s.name}\n\n"
-        f"❓ {q.text}\n\n"
-        f"🅰️ <b>A)</b> {options['a']}\n"
-        f"🅱️ <b>B)</b> {options['b']}\n"
-        f"🅲 <b>C)</b> {options['c']}\n"
-        f"🅳 <b>D)</b> {options['d']}"
-    )
 
-    kb = answer_keyboard(q.id)
-    await query.edit_message_text(text, parse_mode="HTML", reply_markup=kb)
+def _next_render(review):
+    """Joriy xato savolning render i; bankda yo'q id lar (tiklangan holat) tashlab o'tiladi"""
+    while review["current_index"] < review["total"]:
+        idx = review["current_index"]
+        r = render_cache.get(review["question_ids"][idx], "mistake")
+        if r:
+            return r
+        del review["question_ids"][idx]
+        del review["wrong_ids"][idx]
+        review["total"] -= 1
+    return None
 
 
 async def mistake_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -119,56 +121,41 @@ async def mistake_answer_callback(update: Update, context: ContextTypes.DEFAULT_
     if not review:
         return False  # Not a mistake review
 
-    parts = query.data.split("_")
-    question_id = int(parts[1])
+    question_id, user_answer = parse_answer(query.data)
 
     if question_id not in review["question_ids"]:
         return False  # Not part of mistake review
 
-    user_answer = parts[2]
     await query.answer()
 
-    session = get_session()
-    try:
-        q = session.query(Question).get(question_id)
+    async with get_async_session() as session:
+        q = question_bank.get(question_id)
         is_correct = user_answer == q.correct_answer
+        answer_events.record(query.from_user.id, question_id, "mistake", user_answer, is_correct, review.get("shown_at"))
 
         if is_correct:
             review["corrected"] += 1
             # Xatoni "reviewed" deb belgilash
             idx = review["question_ids"].index(question_id)
             wrong_id = review["wrong_ids"][idx]
-            wrong = session.query(WrongAnswer).get(wrong_id)
+            wrong = await session.get(WrongAnswer, wrong_id)
             if wrong:
                 wrong.reviewed = True
-                session.commit()
+                await session.commit()
 
         review["current_index"] += 1
+        next_r = _next_render(review)
 
-        if review["current_index"] < review["total"]:
+        if next_r is not None:
             correct_text = q.get_options()[q.correct_answer]
             if is_correct:
                 result = "✅ <b>To'g'ri!</b> Xatoni tuzatdingiz! 🎉"
             else:
                 result = f"❌ <b>Yana noto'g'ri!</b>\n✅ To'g'ri javob: {q.correct_answer.upper()}) {correct_text}"
 
-            next_qid = review["question_ids"][review["current_index"]]
-            next_q = session.query(Question).get(next_qid)
-            s = session.query(Subject).get(next_q.subject_id)
-            next_opts = next_q.get_options()
-
-            text = (
-                f"{result}\n\n{'─' * 25}\n\n"
-                f"🔄 <b>Xato #{review['current_index'] + 1}/{review['total']}</b>\n"
-                f"Bo'lim: {s.emoji} {s.name}\n\n"
-                f"❓ {next_q.text}\n\n"
-                f"🅰️ <b>A)</b> {next_opts['a']}\n"
-                f"🅱️ <b>B)</b> {next_opts['b']}\n"
-                f"🅲 <b>C)</b> {next_opts['c']}\n"
-                f"🅳 <b>D)</b> {next_opts['d']}"
-            )
-            kb = answer_keyboard(next_q.id)
-            await query.edit_message_text(text, parse_mode="HTML", reply_markup=kb)
+            text = f"{result}\n\n{'─' * 25}\n\n" + next_r.text(review["current_index"] + 1, review["total"])
+            await query.edit_message_text(text, parse_mode="HTML", reply_markup=next_r.markup)
+            review["shown_at"] = time.time()
         else:
             corrected = review["corrected"]
             total = review["total"]
@@ -182,8 +169,6 @@ async def mistake_answer_callback(update: Update, context: ContextTypes.DEFAULT_
             context.user_data.pop("mistake_review", None)
 
         return True
-    finally:
-        session.close()
 
 
 async def clear_mistakes_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -192,10 +177,10 @@ async def clear_mistakes_callback(update: Update, context: ContextTypes.DEFAULT_
     await query.answer("🗑️ Xatolar tozalandi!")
     user_id = query.from_user.id
 
-    session = get_session()
-    try:
-        session.query(WrongAnswer).filter_by(user_id=user_id).update({"reviewed": True})
-        session.commit()
-        await query.edit_message_text("🗑️ Barcha xatolar tozalandi!\n\nYangi test yechishni boshlang 💪")
-    finally:
-        session.close()
+    await write_behind.flush()
+    async with get_async_session() as session:
+        await session.execute(
+            sql_update(WrongAnswer).where(WrongAnswer.user_id == user_id).values(reviewed=True)
+        )
+        await session.commit()
+    await query.edit_message_text("🗑️ Barcha xatolar tozalandi!\n\nYangi test yechishni boshlang 💪")
@@ -3,9 +3,11 @@ from datetime import datetime, timedelta
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from sqlalchemy import select, func
 
 from config import ADMIN_IDS, PREMIUM_PLANS
-from database import get_session, UserSettings, PremiumSubscription, check_premium, User
+from database import get_async_session, UserSettings, PremiumSubscription, check_premium_async, invalidate_premium, User
+from utils.rate_limiter import BULK
 
 
 PREMIUM_FEATURES = (
@@ -39,14 +41,16 @@ PAYMENT_INFO = (
 async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/premium buyrug'i — obuna holati va sotib olish"""
     user_id = update.effective_user.id
-    is_prem = check_premium(user_id)
+    is_prem = await check_premium_async(user_id)
 
     if is_prem:
-        session = get_session()
-        try:
-            sub = session.query(PremiumSubscription).filter_by(
-                user_id=user_id, is_active=True
-            ).order_by(PremiumSubscription.end_date.desc()).first()
+        async with get_async_session() as session:
+            sub = await session.scalar(
+                select(PremiumSubscription)
+                .filter_by(user_id=user_id, is_active=True)
+                .order_by(PremiumSubscription.end_date.desc())
+                .limit(1)
+            )
 
             if sub:
                 days_left = (sub.end_date - datetime.utcnow()).days
@@ -65,8 +69,6 @@ async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "🎉 Premium obunangiz faol!"
             )
             keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
-        finally:
-            session.close()
     else:
         text = (
             "👑 <b>Premium Obuna</b>\n\n"
@@ -153,7 +155,10 @@ async def handle_premium_receipt(update: Update, context: ContextTypes.DEFAULT_T
     for admin_id in ADMIN_IDS:
         try:
             # Chek rasmini adminlarga forward
-            await update.message.forward(chat_id=admin_id)
+            await context.bot.forward_message(
+                chat_id=admin_id, from_chat_id=update.message.chat_id,
+                message_id=update.message.message_id, rate_limit_args=BULK,
+            )
 
             # Tasdiqlash tugmalari bilan ma'lumot
             keyboard = [
@@ -182,7 +187,8 @@ async def handle_premium_receipt(update: Update, context: ContextTypes.DEFAULT_T
                     "Tasdiqlaysizmi?"
                 ),
                 parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                rate_limit_args=BULK,
             )
         except Exception as e:
             print(f"Admin {admin_id} ga xabar yuborishda xato: {e}")
@@ -212,7 +218,7 @@ async def admin_approve_callback(update: Update, context: ContextTypes.DEFAULT_T
         await query.answer("❌ Reja topilmadi!", show_alert=True)
         return
 
-    session = get_session()
+    session = get_async_session()
     try:
         now = datetime.utcnow()
         end_date = now + timedelta(days=plan["duration"])
@@ -231,12 +237,13 @@ async def admin_approve_callback(update: Update, context: ContextTypes.DEFAULT_T
         session.add(subscription)
 
         # UserSettings yangilash
-        settings = session.query(UserSettings).filter_by(user_id=user_id).first()
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user_id).limit(1))
         if not settings:
             settings = UserSettings(user_id=user_id)
             session.add(settings)
         settings.is_premium = True
-        session.commit()
+        await session.commit()
+        invalidate_premium(user_id)
 
         # Admin xabarini yangilash
         await query.edit_message_text(
@@ -269,13 +276,13 @@ async def admin_approve_callback(update: Update, context: ContextTypes.DEFAULT_T
         await query.answer("✅ Premium tasdiqlandi!", show_alert=True)
 
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         import traceback
         err_tb = traceback.format_exc()
         print(f"Approval error: {e}\n{err_tb}")
         await query.answer(f"❌ Xato: {str(e)[:100]}", show_alert=True)
     finally:
-        session.close()
+        await session.close()
 
 
 async def admin_reject_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -323,6 +330,19 @@ async def admin_reject_callback(update: Update, context: ContextTypes.DEFAULT_TY
 #  ADMIN PANEL
 # ==========================================
 
+async def _admin_panel_counts():
+    """Admin panel uchun umumiy sonlar"""
+    async with get_async_session() as session:
+        total_users = await session.scalar(select(func.count(User.id)))
+        premium_users = await session.scalar(
+            select(func.count(UserSettings.id)).where(UserSettings.is_premium.is_(True))
+        )
+        active_subs = await session.scalar(
+            select(func.count(PremiumSubscription.id)).where(PremiumSubscription.is_active.is_(True))
+        )
+    return total_users, premium_users, active_subs
+
+
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/admin buyrug'i — admin panel"""
     user_id = update.effective_user.id
@@ -330,13 +350,7 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Siz admin emassiz!")
         return
 
-    session = get_session()
-    try:
-        total_users = session.query(User).count()
-        premium_users = session.query(UserSettings).filter_by(is_premium=True).count()
-        active_subs = session.query(PremiumSubscription).filter_by(is_active=True).count()
-    finally:
-        session.close()
+    total_users, premium_users, active_subs = await _admin_panel_counts()
 
     keyboard = [
         [InlineKeyboardButton("👥 Foydalanuvchilar (Barcha)", callback_data="adm_users")],
@@ -368,25 +382,23 @@ async def admin_users_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     await query.answer()
 
-    session = get_session()
-    try:
-        # Oxirgi 50 ta foydalanuvchi
-        users = session.query(User).order_by(User.id.desc()).limit(50).all()
-        
+    async with get_async_session() as session:
+        # Oxirgi 50 ta foydalanuvchi (premium holati bilan bitta so'rovda)
+        users = (await session.execute(
+            select(User, UserSettings.is_premium)
+            .outerjoin(UserSettings, UserSettings.user_id == User.user_id)
+            .order_by(User.id.desc())
+            .limit(50)
+        )).all()
+
         text = "👥 <b>Foydalanuvchilar (Oxirgi 50 ta):</b>\n\n"
-        for u in users:
-            # Premium holatini UserSettings dan olish kerak
-            from database import UserSettings
-            settings = session.query(UserSettings).filter_by(user_id=u.user_id).first()
-            status = "👑" if settings and settings.is_premium else "👤"
+        for u, is_premium in users:
+            status = "👑" if is_premium else "👤"
             username = f" (@{u.username})" if u.username else ""
             text += f"{status} <code>{u.user_id}</code> - {u.full_name}{username}\n"
-        
+
         if not users:
             text += "Foydalanuvchilar topilmadi."
-            
-    finally:
-        session.close()
 
     keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="adm_back")]]
     await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -400,19 +412,18 @@ async def admin_quiz_users_callback(update: Update, context: ContextTypes.DEFAUL
         return
     await query.answer()
 
-    from database import UserResult, User
-    from sqlalchemy import func
+    from database import UserResult
 
-    session = get_session()
-    try:
+    async with get_async_session() as session:
         # UserResult bor userlarni yig'ish (user_id bo'yicha guruhlab)
         # Oxirgi 50 ta faol user (oxirgi marta test yechganiga ko'ra)
-        quiz_users = session.query(
-            User.user_id, User.full_name, User.username, func.count(UserResult.id).label('test_count')
-        ).join(UserResult, User.user_id == UserResult.user_id)\
-         .group_by(User.user_id, User.full_name, User.username)\
-         .order_by(func.max(UserResult.completed_at).desc())\
-         .limit(50).all()
+        quiz_users = (await session.execute(
+            select(User.user_id, User.full_name, User.username, func.count(UserResult.id).label('test_count'))
+            .join(UserResult, User.user_id == UserResult.user_id)
+            .group_by(User.user_id, User.full_name, User.username)
+            .order_by(func.max(UserResult.completed_at).desc())
+            .limit(50)
+        )).all()
 
         text = "📝 <b>Imtihon topshirganlar (Oxirgi 50 ta):</b>\n\n"
         for u_id, name, username, count in quiz_users:
@@ -422,9 +433,6 @@ async def admin_quiz_users_callback(update: Update, context: ContextTypes.DEFAUL
         if not quiz_users:
             text += "Hozircha hech kim imtihon topshirmadi."
 
-    finally:
-        session.close()
-
     keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="adm_back")]]
     await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -438,18 +446,22 @@ async def admin_full_stats_callback(update: Update, context: ContextTypes.DEFAUL
     await query.answer()
 
     from database import Subject, Question, UserResult
-    from sqlalchemy import func
 
-    session = get_session()
-    try:
-        total_q = session.query(func.count(Question.id)).scalar()
-        total_r = session.query(func.count(UserResult.id)).scalar()
-        
-        subjects = session.query(Subject).all()
+    async with get_async_session() as session:
+        total_q = await session.scalar(select(func.count(Question.id)))
+        total_r = await session.scalar(select(func.count(UserResult.id)))
+
+        q_counts = dict((await session.execute(
+            select(Question.subject_id, func.count(Question.id)).group_by(Question.subject_id)
+        )).all())
+        r_counts = dict((await session.execute(
+            select(UserResult.subject_id, func.count(UserResult.id)).group_by(UserResult.subject_id)
+        )).all())
+        subjects = (await session.scalars(select(Subject))).all()
         sub_text = ""
         for s in subjects:
-            q_count = session.query(func.count(Question.id)).filter_by(subject_id=s.id).scalar()
-            r_count = session.query(func.count(UserResult.id)).filter_by(subject_id=s.id).scalar()
+            q_count = q_counts.get(s.id, 0)
+            r_count = r_counts.get(s.id, 0)
             sub_text += f"{s.emoji} {s.name}: <b>{q_count} savol</b> ({r_count} marta yechilgan)\n"
 
         text = (
@@ -458,8 +470,6 @@ async def admin_full_stats_callback(update: Update, context: ContextTypes.DEFAUL
             f"📝 Jami yechilgan testlar: <b>{total_r}</b>\n\n"
             f"📚 <b>Bo'limlar bo'yicha:</b>\n{sub_text}"
         )
-    finally:
-        session.close()
 
     keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="adm_back")]]
     await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -473,13 +483,7 @@ async def admin_back_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     await query.answer()
 
-    session = get_session()
-    try:
-        total_users = session.query(User).count()
-        premium_users = session.query(UserSettings).filter_by(is_premium=True).count()
-        active_subs = session.query(PremiumSubscription).filter_by(is_active=True).count()
-    finally:
-        session.close()
+    total_users, premium_users, active_subs = await _admin_panel_counts()
 
     keyboard = [
         [InlineKeyboardButton("👥 Foydalanuvchilar (Barcha)", callback_data="adm_users")],
@@ -585,18 +589,19 @@ async def handle_admin_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         context.user_data.pop("admin_action", None)
 
-        session = get_session()
+        session = get_async_session()
         try:
-            settings = session.query(UserSettings).filter_by(user_id=target_id).first()
+            settings = await session.scalar(select(UserSettings).filter_by(user_id=target_id).limit(1))
             if settings:
                 settings.is_premium = False
             # Faol obunalarni bekor qilish
-            subs = session.query(PremiumSubscription).filter_by(
-                user_id=target_id, is_active=True
-            ).all()
+            subs = (await session.scalars(
+                select(PremiumSubscription).filter_by(user_id=target_id, is_active=True)
+            )).all()
             for sub in subs:
                 sub.is_active = False
-            session.commit()
+            await session.commit()
+            invalidate_premium(target_id)
 
             await update.message.reply_text(
                 f"🚫 <b>Premium olib tashlandi!</b>\n\n"
@@ -604,10 +609,10 @@ async def handle_admin_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 parse_mode="HTML"
             )
         except Exception as e:
-            session.rollback()
+            await session.rollback()
             await update.message.reply_text(f"❌ Xato: {e}")
         finally:
-            session.close()
+            await session.close()
         return True
 
     return False
@@ -630,7 +635,7 @@ async def admin_set_premium_callback(update: Update, context: ContextTypes.DEFAU
         await query.answer("❌ Reja topilmadi!", show_alert=True)
         return
 
-    session = get_session()
+    session = get_async_session()
     try:
         now = datetime.utcnow()
         end_date = now + timedelta(days=plan["duration"])
@@ -647,12 +652,13 @@ async def admin_set_premium_callback(update: Update, context: ContextTypes.DEFAU
         )
         session.add(subscription)
 
-        settings = session.query(UserSettings).filter_by(user_id=target_id).first()
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=target_id).limit(1))
         if not settings:
             settings = UserSettings(user_id=target_id)
             session.add(settings)
         settings.is_premium = True
-        session.commit()
+        await session.commit()
+        invalidate_premium(target_id)
 
         await query.edit_message_text(
             f"✅ <b>Premium berildi!</b>\n\n"
@@ -680,16 +686,16 @@ async def admin_set_premium_callback(update: Update, context: ContextTypes.DEFAU
 
         await query.answer("✅ Premium berildi!", show_alert=True)
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         await query.answer(f"❌ Xato: {e}", show_alert=True)
     finally:
-        session.close()
+        await session.close()
 
 
 async def require_premium(update: Update, feature_name: str = "") -> bool:
     """Premium tekshirish — False qaytarsa, handler to'xtashi kerak"""
     user_id = update.effective_user.id
-    if check_premium(user_id):
+    if await check_premium_async(user_id):
         return True
 
     keyboard = [[InlineKeyboardButton("👑 Premium olish", callback_data="go_premium")]]
@@ -1,13 +1,31 @@
 """Quiz handler — difficulty, timer, mock test + spaced/speed intercept"""
-import random
+import functools
+import logging
+import time
 from datetime import datetime
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from sqlalchemy import select
 
-from config import QUESTIONS_PER_QUIZ
-from database import get_session, Subject, Question, UserResult, WrongAnswer
-from keyboards.inline import answer_keyboard, quiz_complete_keyboard, back_to_subjects_keyboard
+from config import QUESTIONS_PER_QUIZ, TIME_PER_QUESTION, TIME_PER_QUESTION_MOCK
+from database import get_async_session, UserResult, WrongAnswer, UserSettings
+from keyboards.inline import quiz_complete_keyboard, back_to_subjects_keyboard, parse_answer
+from handlers.achievements import apply_streak, check_and_award_achievements
+from utils.question_bank import question_bank
+from utils.seen import seen_questions, RECENT
+from utils.render_cache import render_cache
+from utils.deadlines import deadlines
+from utils.adaptive import adaptive, band_percentage
+from utils.answer_events import answer_events
+from utils.leaderboard import leaderboard
+from utils.post_process import post_process
+from utils.user_stats import record_result_async
+from utils.write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+DIFF_LABELS = {"easy": "🟢 Easy", "medium": "🟡 Medium", "hard": "🔴 Hard", "all": "🎯 Barcha", "adaptive": "🧠 Adaptiv"}
 
 
 async def subject_selected_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -21,31 +39,28 @@ async def subject_selected_callback(update: Update, context: ContextTypes.DEFAUL
         [InlineKeyboardButton("🟡 Medium", callback_data=f"diff_{subject_id}_medium")],
         [InlineKeyboardButton("🔴 Hard", callback_data=f"diff_{subject_id}_hard")],
         [InlineKeyboardButton("🎯 Barcha", callback_data=f"diff_{subject_id}_all")],
+        [InlineKeyboardButton("🧠 Adaptiv (darajangizga moslashadi)", callback_data=f"diff_{subject_id}_adaptive")],
         [InlineKeyboardButton("📋 Mock Test (40 savol)", callback_data=f"mock_{subject_id}")],
         [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
     ]
 
-    session = get_session()
-    try:
-        subject = session.query(Subject).get(subject_id)
-        if not subject:
-            await query.edit_message_text("❌ Bo'lim topilmadi!")
-            return
+    subject = question_bank.subject(subject_id)
+    if not subject:
+        await query.edit_message_text("❌ Bo'lim topilmadi!")
+        return
 
-        easy = session.query(Question).filter_by(subject_id=subject_id, difficulty=1).count()
-        medium = session.query(Question).filter_by(subject_id=subject_id, difficulty=2).count()
-        hard = session.query(Question).filter_by(subject_id=subject_id, difficulty=3).count()
-        total = easy + medium + hard
+    easy = question_bank.count(subject_id, 1)
+    medium = question_bank.count(subject_id, 2)
+    hard = question_bank.count(subject_id, 3)
+    total = easy + medium + hard
 
-        text = (
-            f"{subject.emoji} <b>{subject.name}</b>\n\n"
-            f"📊 Savollar: {total} ta\n"
-            f"🟢 {easy} | 🟡 {medium} | 🔴 {hard}\n\n"
-            f"Qiyinlikni tanlang:"
-        )
-        await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    text = (
+        f"{subject.emoji} <b>{subject.name}</b>\n\n"
+        f"📊 Savollar: {total} ta\n"
+        f"🟢 {easy} | 🟡 {medium} | 🔴 {hard}\n\n"
+        f"Qiyinlikni tanlang:"
+    )
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def difficulty_selected_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -65,57 +80,129 @@ async def mock_test_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def _start_quiz(query, context, subject_id, difficulty, is_mock=False):
-    session = get_session()
-    try:
-        subject = session.query(Subject).get(subject_id)
-        if not subject:
-            await query.edit_message_text("❌ Bo'lim topilmadi!")
-            return
-
-        q_query = session.query(Question).filter_by(subject_id=subject_id)
-        if difficulty != "all":
-            diff_map = {"easy": 1, "medium": 2, "hard": 3}
-            q_query = q_query.filter_by(difficulty=diff_map.get(difficulty, 1))
-
-        questions = q_query.all()
-        if not questions:
-            await query.edit_message_text(
-                f"😔 Savollar topilmadi.",
-                reply_markup=back_to_subjects_keyboard(),
-            )
-            return
+    subject = question_bank.subject(subject_id)
+    if not subject:
+        await query.edit_message_text("❌ Bo'lim topilmadi!")
+        return
 
-        count = min(40 if is_mock else QUESTIONS_PER_QUIZ, len(questions))
-        selected = random.sample(questions, count)
-
-        context.user_data["quiz"] = {
-            "subject_id": subject_id,
-            "subject_name": subject.name,
-            "subject_emoji": subject.emoji,
-            "questions": [q.id for q in selected],
-            "current_index": 0,
-            "score": 0,
-            "total": count,
-            "answers": [],
-            "difficulty": difficulty,
-            "is_mock": is_mock,
-        }
-
-        test_type = "📋 MOCK TEST" if is_mock else "📝 Test"
-        diff_labels = {"easy": "🟢 Easy", "medium": "🟡 Medium", "hard": "🔴 Hard", "all": "🎯 Barcha"}
+    if difficulty == "adaptive":
+        selected, count = await _adaptive_start(query.from_user.id, subject_id)
+    else:
+        diff_map = {"easy": 1, "medium": 2, "hard": 3}
+        diff_level = None if difficulty == "all" else diff_map.get(difficulty, 1)
 
+        # Avval foydalanuvchi ko'rmagan savollar (utils/seen.py)
+        selected = await seen_questions.sample(
+            query.from_user.id, 40 if is_mock else QUESTIONS_PER_QUIZ, subject_id, diff_level
+        )
+        count = len(selected)
+
+    # Bankda yo'q id lar (bank qayta yuklangan, eski bitset) — tashlab, selected bilan moslab
+    records = [q for q in map(question_bank.get, selected) if q is not None]
+    if len(records) != len(selected):
+        logger.warning(f"Test boshida {len(selected) - len(records)} ta savol bankda topilmadi")
+        selected = [q.id for q in records]
+        if difficulty != "adaptive":
+            count = len(selected)
+    if not selected:
         await query.edit_message_text(
-            f"{test_type} boshlanmoqda!\n\n"
-            f"Bo'lim: {subject.emoji} <b>{subject.name}</b>\n"
-            f"Daraja: <b>{diff_labels.get(difficulty, difficulty)}</b>\n"
-            f"Savollar: <b>{count}</b>\n"
-            f"⏱️ Har bir savol: <b>30 soniya</b>",
-            parse_mode="HTML",
+            f"😔 Savollar topilmadi.",
+            reply_markup=back_to_subjects_keyboard(),
         )
+        return
+
+    # Tarjima rejimi testning boshida bir marta o'qiladi; javob berish va keyingi
+    # savolga o'tish DB ga murojaat qilmaydi (matn — render_cache, kalit — state)
+    async with get_async_session() as session:
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=query.from_user.id).limit(1))
+
+    context.user_data["quiz"] = {
+        "subject_id": subject_id,
+        "subject_name": subject.name,
+        "subject_emoji": subject.emoji,
+        "questions": selected,
+        "current_index": 0,
+        "score": 0,
+        "total": count,
+        "answers": [],
+        "difficulty": difficulty,
+        "is_mock": is_mock,
+        "translation": bool(settings and settings.translation_mode),
+        # (to'g'ri javob, uning matni) — savollar tartibida
+        "key": [(q.correct_answer, q.get_options()[q.correct_answer]) for q in records],
+        # Vaqt tugab test yakunlanganda (update siz) natija yozish uchun
+        "user_name": (query.from_user.username or "", query.from_user.full_name or ""),
+    }
+    if difficulty == "adaptive":
+        context.user_data["quiz"]["rating_start"] = adaptive.rating(query.from_user.id, subject_id)
+
+    test_type = "📋 MOCK TEST" if is_mock else "📝 Test"
+
+    await query.edit_message_text(
+        f"{test_type} boshlanmoqda!\n\n"
+        f"Bo'lim: {subject.emoji} <b>{subject.name}</b>\n"
+        f"Daraja: <b>{DIFF_LABELS.get(difficulty, difficulty)}</b>\n"
+        f"Savollar: <b>{count}</b>\n"
+        f"⏱️ Har bir savol: <b>{_time_limit(context.user_data['quiz'])} soniya</b>",
+        parse_mode="HTML",
+    )
+
+    await _send_quiz_question(query, context)
+
+
+async def _adaptive_start(user_id, subject_id):
+    """Adaptiv test: reytinglarni yuklab, birinchi savolni tanlash -> ([id], savollar soni)"""
+    await adaptive.prepare(user_id, subject_id)
+    seen = await seen_questions.get(user_id)
+    first = adaptive.pick(user_id, subject_id, prefer=lambda q: seen.tier(q) != RECENT)
+    if first is None:
+        return [], 0
+    seen_questions.mark(user_id, [first])
+    return [first], min(QUESTIONS_PER_QUIZ, question_bank.count(subject_id))
+
+
+async def _adaptive_next(quiz, user_id):
+    """Oxirgi javob bo'yicha reytinglarni yangilab, keyingi savolni qo'shish.
+
+    Odatda DB siz; restart dan keyin tiklangan testda (yoki LRU dan chiqqan
+    foydalanuvchida) prepare() saqlangan reytinglarni avval yuklaydi."""
+    await adaptive.prepare(user_id, quiz["subject_id"])
+    last = quiz["answers"][-1]
+    adaptive.observe(user_id, quiz["subject_id"], last["question_id"], last["is_correct"])
+    if len(quiz["questions"]) >= quiz["total"]:
+        return
+    seen = seen_questions.peek(user_id)
+    prefer = (lambda q: seen.tier(q) != RECENT) if seen else None
+    qid = adaptive.pick(user_id, quiz["subject_id"], exclude=set(quiz["questions"]), prefer=prefer)
+    if qid is None:
+        quiz["total"] = len(quiz["questions"])
+        return
+    q = question_bank.get(qid)
+    quiz["questions"].append(qid)
+    quiz["key"].append((q.correct_answer, q.get_options()[q.correct_answer]))
+    seen_questions.mark(user_id, [qid])
 
-        await _send_quiz_question(query, context)
-    finally:
-        session.close()
+
+def _time_limit(quiz):
+    return TIME_PER_QUESTION_MOCK if quiz.get("is_mock") else TIME_PER_QUESTION
+
+
+def _render_mode(quiz):
+    return "mock" if quiz.get("is_mock") else "quiz"
+
+
+def _arm_timer(quiz, user_id, chat_id, message_id):
+    """Joriy savolga muddat qo'yish (utils/deadlines.py); holat bilan persist qilinadi"""
+    data = {"chat_id": chat_id, "message_id": message_id, "index": quiz["current_index"]}
+    quiz["deadline"] = deadlines.arm("quiz", user_id, _time_limit(quiz), data)
+    quiz["deadline_data"] = data
+    quiz["shown_at"] = time.time()
+
+
+def _disarm_timer(quiz, user_id):
+    deadlines.cancel("quiz", user_id)
+    quiz.pop("deadline", None)
+    quiz.pop("deadline_data", None)
 
 
 async def _send_quiz_question(query, context):
@@ -126,68 +213,95 @@ async def _send_quiz_question(query, context):
     idx = quiz["current_index"]
     qid = quiz["questions"][idx]
 
-    session = get_session()
-    try:
-        q = session.query(Question).get(qid)
-        if not q:
-            logger.error(f"Savol #{qid} topilmadi!")
-            await query.message.reply_text("❌ Xatolik: Savol topilmadi. Test to'xtatildi.")
-            context.user_data.pop("quiz", None)
-            return
+    # Tayyor matn va klaviatura (utils/render_cache.py)
+    r = render_cache.get(qid, _render_mode(quiz), quiz.get("translation", False))
+    if not r:
+        logger.error(f"Savol #{qid} topilmadi!")
+        await query.message.reply_text("❌ Xatolik: Savol topilmadi. Test to'xtatildi.")
+        context.user_data.pop("quiz", None)
+        return
 
-        options = q.get_options()
-        diff_emoji = {1: "🟢", 2: "🟡", 3: "🔴"}.get(q.difficulty, "⭐")
+    msg = await query.message.reply_text(r.text(idx + 1, quiz["total"]), parse_mode="HTML", reply_markup=r.markup)
+    _arm_timer(quiz, query.from_user.id, query.message.chat_id, getattr(msg, "message_id", None))
+
+
+def _next_render(quiz):
+    """Joriy savolning tayyor render i. Holatdagi id bankda bo'lmasa (persistence
+    yoki deadline dan tiklangan test, savol DB dan o'chirilib bank qayta
+    yuklangan) u testdan chiqariladi. Savol qolmasa None (test yakunlanadi)."""
+    while quiz["current_index"] < min(quiz["total"], len(quiz["questions"])):
+        idx = quiz["current_index"]
+        r = render_cache.get(quiz["questions"][idx], _render_mode(quiz), quiz.get("translation", False))
+        if r:
+            return r
+        logger.warning(f"Savol #{quiz['questions'][idx]} topilmadi — o'tkazib yuborildi")
+        del quiz["questions"][idx]
+        del quiz["key"][idx]
+        quiz["total"] -= 1
+    quiz["total"] = quiz["current_index"]
+    return None
+
+
+async def _advance(context, quiz, user_id, result_text, edit, chat_id, message_id):
+    """Natija sarlavhasi bilan keyingi savolni ko'rsatish yoki testni yakunlash"""
+    if quiz.get("difficulty") == "adaptive":
+        await _adaptive_next(quiz, user_id)
+    quiz["current_index"] += 1
+    next_r = _next_render(quiz)
+
+    if next_r is not None:
+        progress = _progress_bar(quiz["current_index"], quiz["total"])
 
         text = (
-            f"📌 <b>Savol {idx + 1}/{quiz['total']}</b> {diff_emoji}\n"
-            f"⏱️ 30 soniya\n\n"
-            f"❓ {q.text}\n\n"
-            f"🅰️ <b>A)</b> {options['a']}\n"
-            f"🅱️ <b>B)</b> {options['b']}\n"
-            f"🅲 <b>C)</b> {options['c']}\n"
-            f"🅳 <b>D)</b> {options['d']}"
-        )
+            f"{result_text}\n"
+            f"📊 {quiz['score']}/{quiz['current_index']} to'g'ri  {progress}\n"
+            f"{'─' * 25}\n\n"
+        ) + next_r.text(quiz["current_index"] + 1, quiz["total"])
+        _arm_timer(quiz, user_id, chat_id, message_id)
+        await edit(text, parse_mode="HTML", reply_markup=next_r.markup)
+    else:
+        await _finish_quiz(context, user_id, edit)
 
-        # Tarjima rejimi
-        from database import UserSettings
-        user_id = query.from_user.id if hasattr(query, 'from_user') else 0
-        settings = session.query(UserSettings).filter_by(user_id=user_id).first()
-        if settings and settings.translation_mode and q.text_uz:
-            text += f"\n\n🌐 <i>{q.text_uz}</i>"
-
-        kb = answer_keyboard(q.id)
-        await query.message.reply_text(text, parse_mode="HTML", reply_markup=kb)
-
-        # Timer
-        if context.job_queue:
-            jobs = context.job_queue.get_jobs_by_name(f"timer_{user_id}")
-            for job in jobs:
-                job.schedule_removal()
-            context.job_queue.run_once(
-                _timer_expired, 30,
-                data={"user_id": user_id, "question_id": qid, "chat_id": query.message.chat_id, "message_id": None},
-                name=f"timer_{user_id}",
-            )
-    finally:
-        session.close()
-
-
-async def _timer_expired(context: ContextTypes.DEFAULT_TYPE):
-    try:
-        data = context.job.data
-        if data.get("chat_id"):
-            await context.bot.send_message(
-                chat_id=data["chat_id"],
-                text="⏱️ <b>Vaqt tugadi!</b> Keyingi savolga o'ting.",
-                parse_mode="HTML",
-            )
-    except Exception:
-        pass
+
+async def quiz_deadline_expired(context, user_id, data):
+    """Savol vaqti tugadi: javobsiz deb yozib, keyingi savolga o'tish"""
+    quiz = context.user_data.get("quiz")
+    # Eski (javob berilgan yoki qayta boshlangan) taymer — e'tiborsiz
+    if not quiz or quiz.get("deadline_data") != data or not data.get("message_id"):
+        return
+    quiz.pop("deadline", None)
+
+    idx = quiz["current_index"]
+    question_id = quiz["questions"][idx]
+    correct, correct_text = quiz["key"][idx]
+    write_behind.add(WrongAnswer, {
+        "user_id": user_id,
+        "question_id": question_id,
+        "user_answer": "-",
+        "correct_answer": correct,
+        "answered_at": datetime.utcnow(),
+    })
+    answer_events.record(user_id, question_id, _render_mode(quiz), None, False, quiz.get("shown_at"))
+    quiz["answers"].append({
+        "question_id": question_id,
+        "user_answer": None,
+        "correct_answer": correct,
+        "is_correct": False,
+    })
+
+    result_text = f"⏱️ <b>Vaqt tugadi!</b>\n✅ To'g'ri: {correct.upper()}) {correct_text}"
+    edit = functools.partial(
+        context.bot.edit_message_text, chat_id=data["chat_id"], message_id=data["message_id"],
+    )
+    await _advance(context, quiz, user_id, result_text, edit, data["chat_id"], data["message_id"])
 
 
 async def answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
+    """Eski `answer_<id>_<harf>` tugmalari — rejim holatlari ketma-ket tekshiriladi.
 
+    Yangi tugmalar `ans_<rejim>_...` ko'rinishida va to'g'ridan-to'g'ri rejim
+    handleriga yo'naltiriladi (bot.py, utils/router.py).
+    """
     # Spaced repetition tekshirish
     if context.user_data.get("spaced"):
         from handlers.spaced import spaced_answer_callback
@@ -209,102 +323,85 @@ async def answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if handled:
             return
 
+    await quiz_answer_callback(update, context)
+
+
+def mode_answer_callback(handler):
+    """`ans_<rejim>_` tugmalari uchun: rejim holati bo'lmasa (handler False) ogohlantirish"""
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await handler(update, context):
+            await update.callback_query.answer(
+                "⚠️ Aktiv mashg'ulot topilmadi. /start ni bosing.", show_alert=True,
+            )
+    return callback
+
+
+async def quiz_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Oddiy va mock test javobi (`ans_quiz_<id>_<harf>`)"""
+    query = update.callback_query
     quiz = context.user_data.get("quiz")
     if not quiz:
         await query.answer("⚠️ Aktiv test topilmadi. /start ni bosing.", show_alert=True)
         return
 
-    parts = query.data.split("_")
-    question_id = int(parts[1])
-    user_answer = parts[2]
+    question_id, user_answer = parse_answer(query.data)
 
     if any(a["question_id"] == question_id for a in quiz.get("answers", [])):
         await query.answer("⚠️ Bu savolga allaqachon javob berdingiz!", show_alert=True)
         return
 
     # Timer bekor
-    if context.job_queue:
-        user_id = query.from_user.id
-        jobs = context.job_queue.get_jobs_by_name(f"timer_{user_id}")
-        for job in jobs:
-            job.schedule_removal()
-
-    session = get_session()
-    try:
-        q = session.query(Question).get(question_id)
+    _disarm_timer(quiz, query.from_user.id)
+
+    if "key" in quiz and question_id in quiz["questions"]:
+        correct, correct_text = quiz["key"][quiz["questions"].index(question_id)]
+    else:
+        # Kalitsiz (eski) test holati yoki boshqa testning tugmasi
+        q = question_bank.get(question_id)
         if not q:
             await query.answer("❌ Savol topilmadi!")
             return
+        correct, correct_text = q.correct_answer, q.get_options()[q.correct_answer]
 
-        is_correct = user_answer == q.correct_answer
-        correct_text = q.get_options()[q.correct_answer]
-
-        if is_correct:
-            quiz["score"] += 1
-        else:
-            wrong = WrongAnswer(
-                user_id=query.from_user.id,
-                question_id=question_id,
-                user_answer=user_answer,
-                correct_answer=q.correct_answer,
-            )
-            session.add(wrong)
-            session.commit()
+    is_correct = user_answer == correct
+    answer_events.record(
+        query.from_user.id, question_id, _render_mode(quiz), user_answer, is_correct, quiz.get("shown_at"),
+    )
 
-        quiz["answers"].append({
+    if is_correct:
+        quiz["score"] += 1
+    else:
+        # Commit kutilmaydi — utils/write_behind.py partiyalab yozadi
+        write_behind.add(WrongAnswer, {
+            "user_id": query.from_user.id,
             "question_id": question_id,
             "user_answer": user_answer,
-            "correct_answer": q.correct_answer,
-            "is_correct": is_correct,
+            "correct_answer": correct,
+            "answered_at": datetime.utcnow(),
         })
 
-        await query.answer("✅ To'g'ri!" if is_correct else "❌ Noto'g'ri!")
-
-        if is_correct:
-            result_text = "✅ <b>To'g'ri!</b> 🎉"
-        else:
-            result_text = f"❌ <b>Noto'g'ri!</b>\n✅ To'g'ri: {q.correct_answer.upper()}) {correct_text}"
-
-        quiz["current_index"] += 1
-
-        if quiz["current_index"] < quiz["total"]:
-            next_qid = quiz["questions"][quiz["current_index"]]
-            next_q = session.query(Question).get(next_qid)
-            next_opts = next_q.get_options()
-            diff_emoji = {1: "🟢", 2: "🟡", 3: "🔴"}.get(next_q.difficulty, "⭐")
-
-            progress = _progress_bar(quiz["current_index"], quiz["total"])
-
-            text = (
-                f"{result_text}\n"
-                f"📊 {quiz['score']}/{quiz['current_index']} to'g'ri  {progress}\n"
-                f"{'─' * 25}\n\n"
-                f"📌 <b>Savol {quiz['current_index'] + 1}/{quiz['total']}</b> {diff_emoji}\n"
-                f"⏱️ 30 soniya\n\n"
-                f"❓ {next_q.text}\n\n"
-                f"🅰️ <b>A)</b> {next_opts['a']}\n"
-                f"🅱️ <b>B)</b> {next_opts['b']}\n"
-                f"🅲 <b>C)</b> {next_opts['c']}\n"
-                f"🅳 <b>D)</b> {next_opts['d']}"
-            )
+    quiz["answers"].append({
+        "question_id": question_id,
+        "user_answer": user_answer,
+        "correct_answer": correct,
+        "is_correct": is_correct,
+    })
 
-            kb = answer_keyboard(next_q.id)
-            await query.edit_message_text(text, parse_mode="HTML", reply_markup=kb)
+    await query.answer("✅ To'g'ri!" if is_correct else "❌ Noto'g'ri!")
+
+    if is_correct:
+        result_text = "✅ <b>To'g'ri!</b> 🎉"
+    else:
+        result_text = f"❌ <b>Noto'g'ri!</b>\n✅ To'g'ri: {correct.upper()}) {correct_text}"
 
-            # Timer
-            if context.job_queue:
-                context.job_queue.run_once(
-                    _timer_expired, 30,
-                    data={"user_id": query.from_user.id, "question_id": next_q.id, "chat_id": query.message.chat_id},
-                    name=f"timer_{query.from_user.id}",
-                )
-        else:
-            await _finish_quiz(query, context, session)
-    finally:
-        session.close()
+    await _advance(
+        context, quiz, query.from_user.id, result_text, query.edit_message_text,
+        query.message.chat_id, getattr(query.message, "message_id", None),
+    )
 
 
-async def _finish_quiz(query, context, session):
+async def _finish_quiz(context, user_id, edit):
+    """Natijani yozish va yakuniy xabar; `edit` — xabarni tahrirlash funksiyasi"""
     quiz = context.user_data.get("quiz")
     if not quiz:
         return
@@ -313,51 +410,69 @@ async def _finish_quiz(query, context, session):
     total = quiz["total"]
     percentage = (score / total * 100) if total > 0 else 0
 
-    user = query.from_user
+    username, full_name = quiz.get("user_name", ("", ""))
     result = UserResult(
-        user_id=user.id, username=user.username or "", full_name=user.full_name or "",
+        user_id=user_id, username=username, full_name=full_name,
         subject_id=quiz["subject_id"], score=score, total=total, percentage=percentage,
         difficulty_level=quiz.get("difficulty", "all"), is_mock=quiz.get("is_mock", False),
     )
-    session.add(result)
-    session.commit()
-
-    from handlers.achievements import update_streak, check_and_award_achievements
-    update_streak(user.id)
-    await check_and_award_achievements(user.id, context)
+    # Natija, stats va streak — bitta tranzaksiya; achievementlar fonda
+    async with get_async_session() as session:
+        session.add(result)
+        stats = await record_result_async(session, result)
+        streak = await apply_streak(session, user_id)
+        await session.commit()
+    leaderboard.apply(result)
+    post_process.submit(
+        "achievements", check_and_award_achievements, user_id, context, stats, streak.current_streak,
+    )
 
-    if percentage >= 90:
-        grade_emoji, band, grade_text = "🏆", "8.0-9.0", "Mukammal daraja!"
-    elif percentage >= 75:
-        grade_emoji, band, grade_text = "🥇", "6.5-7.5", "Yaxshi daraja!"
-    elif percentage >= 60:
-        grade_emoji, band, grade_text = "🥈", "5.5-6.0", "O'rtacha daraja"
-    elif percentage >= 40:
-        grade_emoji, band, grade_text = "🥉", "4.5-5.0", "Ko'proq mashq qiling!"
+    # Adaptiv testda savollar darajaga moslashgani uchun band reytingdan olinadi
+    rating_line = ""
+    if quiz.get("difficulty") == "adaptive":
+        rating = adaptive.rating(user_id, quiz["subject_id"])
+        grade_emoji, band, grade_text = _grade(band_percentage(rating))
+        rating_line = f"🧠 Reyting: {quiz.get('rating_start', rating):.0f} → <b>{rating:.0f}</b>\n"
     else:
-        grade_emoji, band, grade_text = "📖", "3.0-4.0", "Tayyorlanish kerak!"
+        grade_emoji, band, grade_text = _grade(percentage)
 
     progress = _progress_bar(score, total)
     test_type = "📋 MOCK TEST" if quiz.get("is_mock") else "📝 Test"
-    diff_labels = {"easy": "🟢 Easy", "medium": "🟡 Medium", "hard": "🔴 Hard", "all": "🎯 Barcha"}
 
     text = (
         f"🏁 <b>{test_type} tugadi!</b>\n\n"
         f"Bo'lim: {quiz['subject_emoji']} <b>{quiz['subject_name']}</b>\n"
-        f"Daraja: {diff_labels.get(quiz.get('difficulty', 'all'), 'all')}\n\n"
+        f"Daraja: {DIFF_LABELS.get(quiz.get('difficulty', 'all'), 'all')}\n\n"
         f"{grade_emoji} <b>Band {band} — {grade_text}</b>\n\n"
+        f"{rating_line}"
         f"📊 <b>Natija:</b> {score}/{total} ({percentage:.0f}%)\n"
         f"{progress}\n\n"
         f"✅ To'g'ri: {score} | ❌ Noto'g'ri: {total - score}\n\n"
         f"📊 Sertifikat olish: /sertifikat"
     )
 
-    await query.edit_message_text(text, parse_mode="HTML", reply_markup=quiz_complete_keyboard())
+    await edit(text, parse_mode="HTML", reply_markup=quiz_complete_keyboard())
     context.user_data.pop("quiz", None)
 
 
+def _grade(percentage):
+    """(emoji, band, izoh)"""
+    if percentage >= 90:
+        return "🏆", "8.0-9.0", "Mukammal daraja!"
+    if percentage >= 75:
+        return "🥇", "6.5-7.5", "Yaxshi daraja!"
+    if percentage >= 60:
+        return "🥈", "5.5-6.0", "O'rtacha daraja"
+    if percentage >= 40:
+        return "🥉", "4.5-5.0", "Ko'proq mashq qiling!"
+    return "📖", "3.0-4.0", "Tayyorlanish kerak!"
+
+
 def _progress_bar(current, total, length=10):
     if total == 0:
         return ""
     filled = round(length * current / total)
     return f"[{'🟩' * filled}{'⬜' * (length - filled)}] {current}/{total}"
+
+
+deadlines.register("quiz", quiz_deadline_expired)
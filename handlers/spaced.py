@@ -1,11 +1,17 @@
 """Spaced Repetition — SM-2 algoritmi bilan takrorlash"""
+import time
 from datetime import date, timedelta
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from sqlalchemy import select, func
 
-from database import get_session, SpacedRepetition, Question, Subject, WrongAnswer
-from keyboards.inline import answer_keyboard
+from database import get_async_session, SpacedRepetition, WrongAnswer
+from keyboards.inline import parse_answer
+from utils.answer_events import answer_events
+from utils.render_cache import render_cache
+from utils.question_bank import question_bank
+from utils.write_behind import write_behind
 
 
 def _sm2_update(card, quality):
@@ -23,8 +29,8 @@ def _sm2_update(card, quality):
         card.interval = 1
 
     card.easiness_factor = max(1.3, card.easiness_factor + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
-    card.last_reviewed = date.today().isoformat()
-    card.next_review = (date.today() + timedelta(days=card.interval)).isoformat()
+    card.last_reviewed = date.today()
+    card.next_review = date.today() + timedelta(days=card.interval)
 
 
 async def spaced_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -33,21 +39,23 @@ async def spaced_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_premium(update, "🧠 Spaced Repetition"):
         return
     user_id = update.effective_user.id
-    session = get_session()
-    try:
-        today = date.today().isoformat()
+    await write_behind.flush()
+    async with get_async_session() as session:
+        today = date.today()
 
         # Bugun takrorlanishi kerak bo'lgan kartalar
-        due_cards = (
-            session.query(SpacedRepetition)
+        due_query = (
+            select(SpacedRepetition)
             .filter_by(user_id=user_id)
-            .filter(SpacedRepetition.next_review <= today)
-            .all()
+            .where(SpacedRepetition.next_review <= today)
         )
+        due_cards = (await session.scalars(due_query)).all()
 
         # Yangi xatolarni qo'shish (hali takrorlash tizimida bo'lmagan)
-        wrongs = session.query(WrongAnswer).filter_by(user_id=user_id, reviewed=False).all()
-        existing_qids = {c.question_id for c in session.query(SpacedRepetition).filter_by(user_id=user_id).all()}
+        wrongs = (await session.scalars(select(WrongAnswer).filter_by(user_id=user_id, reviewed=False))).all()
+        existing_qids = set((await session.scalars(
+            select(SpacedRepetition.question_id).filter_by(user_id=user_id)
+        )).all())
 
         new_added = 0
         for w in wrongs:
@@ -56,32 +64,28 @@ async def spaced_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     user_id=user_id,
                     question_id=w.question_id,
                     next_review=today,
-                    last_reviewed="",
                 )
                 session.add(sr)
                 existing_qids.add(w.question_id)
                 new_added += 1
-        session.commit()
+        await session.commit()
 
         if new_added > 0:
-            due_cards = (
-                session.query(SpacedRepetition)
-                .filter_by(user_id=user_id)
-                .filter(SpacedRepetition.next_review <= today)
-                .all()
-            )
+            due_cards = (await session.scalars(due_query)).all()
 
-        total_cards = session.query(SpacedRepetition).filter_by(user_id=user_id).count()
+        total_cards = await session.scalar(
+            select(func.count(SpacedRepetition.id)).where(SpacedRepetition.user_id == user_id)
+        )
 
         if not due_cards:
-            next_card = (
-                session.query(SpacedRepetition)
+            next_card = await session.scalar(
+                select(SpacedRepetition)
                 .filter_by(user_id=user_id)
-                .filter(SpacedRepetition.next_review > today)
+                .where(SpacedRepetition.next_review > today)
                 .order_by(SpacedRepetition.next_review)
-                .first()
+                .limit(1)
             )
-            next_date = next_card.next_review if next_card else "—"
+            next_date = next_card.next_review.isoformat() if next_card else "—"
 
             await update.message.reply_text(
                 f"🧠 <b>Spaced Repetition</b>\n\n"
@@ -110,36 +114,22 @@ async def spaced_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         await update.message.reply_text(text, parse_mode="HTML")
-        await _send_spaced_question(update, context, session)
-    finally:
-        session.close()
+        await _send_spaced_question(update, context)
 
 
-async def _send_spaced_question(update_or_query, context, session):
+async def _send_spaced_question(update_or_query, context):
     spaced = context.user_data.get("spaced")
     if not spaced:
         return
 
     idx = spaced["current_index"]
     qid = spaced["question_ids"][idx]
-    q = session.query(Question).get(qid)
-    if not q:
+    r = render_cache.get(qid, "spaced")
+    if not r:
         return
 
-    s = session.query(Subject).get(q.subject_id)
-    options = q.get_options()
-
-    text = (
-        f"🧠 <b>Takrorlash {idx + 1}/{spaced['total']}</b>\n"
-        f"Bo'lim: {s.emoji} {s.name}\n\n"
-        f"❓ {q.text}\n\n"
-        f"🅰️ <b>A)</b> {options['a']}\n"
-        f"🅱️ <b>B)</b> {options['b']}\n"
-        f"🅲 <b>C)</b> {options['c']}\n"
-        f"🅳 <b>D)</b> {options['d']}"
-    )
-
-    kb = answer_keyboard(q.id)
+    text, kb = r.text(idx + 1, spaced["total"]), r.markup
+    spaced["shown_at"] = time.time()
     if hasattr(update_or_query, 'message') and update_or_query.message:
         await update_or_query.message.reply_text(text, parse_mode="HTML", reply_markup=kb)
     else:
@@ -153,21 +143,19 @@ async def spaced_answer_callback(update: Update, context: ContextTypes.DEFAULT_T
     if not spaced:
         return False
 
-    parts = query.data.split("_")
-    question_id = int(parts[1])
+    question_id, user_answer = parse_answer(query.data)
     if question_id not in spaced["question_ids"]:
         return False
 
-    user_answer = parts[2]
     await query.answer()
 
-    session = get_session()
-    try:
-        q = session.query(Question).get(question_id)
+    async with get_async_session() as session:
+        q = question_bank.get(question_id)
         is_correct = user_answer == q.correct_answer
+        answer_events.record(query.from_user.id, question_id, "spaced", user_answer, is_correct, spaced.get("shown_at"))
         idx = spaced["question_ids"].index(question_id)
         card_id = spaced["card_ids"][idx]
-        card = session.query(SpacedRepetition).get(card_id)
+        card = await session.get(SpacedRepetition, card_id)
 
         if is_correct:
             spaced["correct"] += 1
@@ -177,7 +165,7 @@ async def spaced_answer_callback(update: Update, context: ContextTypes.DEFAULT_T
 
         if card:
             _sm2_update(card, quality)
-            session.commit()
+            await session.commit()
 
         spaced["current_index"] += 1
 
@@ -192,7 +180,7 @@ async def spaced_answer_callback(update: Update, context: ContextTypes.DEFAULT_T
                 f"{result}\n\n⏳ Keyingi savol...",
                 parse_mode="HTML",
             )
-            await _send_spaced_question(query, context, session)
+            await _send_spaced_question(query, context)
         else:
             correct = spaced["correct"]
             total = spaced["total"]
@@ -207,5 +195,3 @@ async def spaced_answer_callback(update: Update, context: ContextTypes.DEFAULT_T
             context.user_data.pop("spaced", None)
 
         return True
-    finally:
-        session.close()
@@ -1,7 +1,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
+from sqlalchemy import select
 
-from database import get_session, Subject, User
+from database import get_async_session, User
 from keyboards.inline import subjects_keyboard
 from keyboards.reply import main_menu_keyboard
 
@@ -72,26 +73,24 @@ NO_SUBJECTS_TEXT = "\n😔 Hozircha bo'limlar qo'shilmagan."
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    session = get_session()
     try:
-        # Userni ro'yxatga olish (agar bo'lmasa)
-        existing_user = session.query(User).filter_by(user_id=user.id).first()
-        if not existing_user:
-            new_user = User(
-                user_id=user.id,
-                username=user.username or "",
-                full_name=user.full_name or ""
-            )
-            session.add(new_user)
-            session.commit()
-            print(f"🆕 Yangi foydalanuvchi ro'yxatga olindi: {user.full_name} ({user.id})")
+        async with get_async_session() as session:
+            # Userni ro'yxatga olish (agar bo'lmasa)
+            existing_user = await session.scalar(select(User).filter_by(user_id=user.id).limit(1))
+            if not existing_user:
+                new_user = User(
+                    user_id=user.id,
+                    username=user.username or "",
+                    full_name=user.full_name or ""
+                )
+                session.add(new_user)
+                await session.commit()
+                print(f"🆕 Yangi foydalanuvchi ro'yxatga olindi: {user.full_name} ({user.id})")
     except Exception as e:
         print(f"❌ User registration error: {e}")
-    finally:
-        session.close()
 
     await update.message.reply_text("⌨️ Menyu tayyor!", reply_markup=main_menu_keyboard())
-    kb = subjects_keyboard()
+    kb = await subjects_keyboard()
     if kb:
         await update.message.reply_text(WELCOME_TEXT, parse_mode="HTML", reply_markup=kb)
     else:
@@ -103,7 +102,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def subjects_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    kb = subjects_keyboard()
+    kb = await subjects_keyboard()
     if kb:
         await update.message.reply_text(
             "📚 <b>IELTS bo'limlari:</b>\n\nBo'limni tanlang va testni boshlang! 👇",
@@ -117,7 +116,7 @@ async def back_to_subjects_callback(update: Update, context: ContextTypes.DEFAUL
     query = update.callback_query
     await query.answer()
     context.user_data.clear()
-    kb = subjects_keyboard()
+    kb = await subjects_keyboard()
     if kb:
         await query.edit_message_text(
             "📚 <b>IELTS bo'limlari:</b>\n\nBo'limni tanlang va testni boshlang! 👇",
@@ -1,9 +1,13 @@
 """Stats va Band Score Tracker"""
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from sqlalchemy import func, desc
+from sqlalchemy import select, desc
 
-from database import get_session, UserResult, Subject, DailyStreak
+from database import get_async_session, UserResult, DailyStreak
+from utils.leaderboard import leaderboard, WINDOWS, WINDOW_LABELS
+from utils.question_bank import question_bank
+from utils.user_stats import get_user_stats, subject_rows
 
 
 async def my_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -31,66 +35,43 @@ async def my_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def _build_stats_text(user_id):
-    session = get_session()
-    try:
-        results = session.query(UserResult).filter_by(user_id=user_id).all()
-        if not results:
+    async with get_async_session() as session:
+        stats = await get_user_stats(session, user_id)
+        if not stats or not stats.total_tests:
             return "📊 <b>Natijalarim</b>\n\nSiz hali test yechmadingiz. /bolimlar ni bosing!"
 
-        total_tests = len(results)
-        avg_pct = sum(r.percentage for r in results) / total_tests
-        best = max(results, key=lambda r: r.percentage)
-        mock_count = sum(1 for r in results if r.is_mock)
+        avg_pct = stats.avg_pct
 
         # Band score
         band = _percentage_to_band(avg_pct)
 
         # Streak
-        streak = session.query(DailyStreak).filter_by(user_id=user_id).first()
+        streak = await session.scalar(select(DailyStreak).filter_by(user_id=user_id).limit(1))
         streak_text = f"🔥 {streak.current_streak} kun" if streak else "0 kun"
         longest = f"⭐ {streak.longest_streak} kun" if streak else "0 kun"
 
-        # Bo'limlarni bir marta yuklash (N+1 muammosini hal qilish)
-        all_subjects = {s.id: s for s in session.query(Subject).all()}
-
-        text = (
-            f"📊 <b>Mening natijalarim</b>\n\n"
-            f"🎯 O'rtacha: <b>{avg_pct:.1f}%</b> (Band {band})\n"
-            f"📝 Jami testlar: <b>{total_tests}</b>\n"
-            f"📋 Mock testlar: <b>{mock_count}</b>\n"
-            f"🏆 Eng yaxshi: <b>{best.percentage:.0f}%</b>\n\n"
-            f"🔥 Joriy streak: {streak_text}\n"
-            f"⭐ Eng uzun: {longest}\n"
-            f"\n{'─' * 25}\n"
-            f"📚 <b>Bo'limlar bo'yicha:</b>\n\n"
+    text = (
+        f"📊 <b>Mening natijalarim</b>\n\n"
+        f"🎯 O'rtacha: <b>{avg_pct:.1f}%</b> (Band {band})\n"
+        f"📝 Jami testlar: <b>{stats.total_tests}</b>\n"
+        f"📋 Mock testlar: <b>{stats.mock_count}</b>\n"
+        f"🏆 Eng yaxshi: <b>{stats.best_pct:.0f}%</b>\n\n"
+        f"🔥 Joriy streak: {streak_text}\n"
+        f"⭐ Eng uzun: {longest}\n"
+        f"\n{'─' * 25}\n"
+        f"📚 <b>Bo'limlar bo'yicha:</b>\n\n"
+    )
+
+    # Bo'limlar bo'yicha tahlil (user_stats.subjects dan)
+    for sid, tests, avg, best in subject_rows(stats):
+        s = question_bank.subject(sid)
+        name = f"{s.emoji} {s.name}" if s else "?"
+        text += (
+            f"  {name}\n"
+            f"    Tests: {tests} | O'rtacha: {avg:.0f}% | Eng yaxshi: {best:.0f}%\n\n"
         )
 
-        # Bo'limlar bo'yicha tahlil
-        subject_stats = {}
-        for r in results:
-            sid = r.subject_id
-            if sid not in subject_stats:
-                s = all_subjects.get(sid)
-                subject_stats[sid] = {
-                    "name": f"{s.emoji} {s.name}" if s else "?",
-                    "tests": 0,
-                    "total_pct": 0,
-                    "best": 0,
-                }
-            subject_stats[sid]["tests"] += 1
-            subject_stats[sid]["total_pct"] += r.percentage
-            subject_stats[sid]["best"] = max(subject_stats[sid]["best"], r.percentage)
-
-        for sid, info in sorted(subject_stats.items()):
-            avg = info["total_pct"] / info["tests"]
-            text += (
-                f"  {info['name']}\n"
-                f"    Tests: {info['tests']} | O'rtacha: {avg:.0f}% | Eng yaxshi: {info['best']:.0f}%\n\n"
-            )
-
-        return text
-    finally:
-        session.close()
+    return text
 
 
 async def band_history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -99,104 +80,119 @@ async def band_history_callback(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
     user_id = query.from_user.id
 
-    session = get_session()
-    try:
-        results = (
-            session.query(UserResult)
+    async with get_async_session() as session:
+        results = (await session.scalars(
+            select(UserResult)
             .filter_by(user_id=user_id)
             .order_by(desc(UserResult.completed_at))
             .limit(15)
-            .all()
-        )
+        )).all()
+
+    if not results:
+        await query.edit_message_text("📈 Hali natijalar yo'q!")
+        return
+
+    text = "📈 <b>Band Score tarix</b>\n\n"
+
+    for i, r in enumerate(results, 1):
+        # Fan emojisi — savollar bankidan (har qator uchun DB so'rovi yo'q)
+        s = question_bank.subject(r.subject_id)
+        s_name = f"{s.emoji}" if s else "?"
+        band = _percentage_to_band(r.percentage)
+        bar = _mini_bar(r.percentage)
+        mock_tag = " 📋" if r.is_mock else ""
+        diff_tag = {"easy": "🟢", "medium": "🟡", "hard": "🔴", "adaptive": "🧠"}.get(r.difficulty_level, "")
+        date_str = r.completed_at.strftime("%d.%m %H:%M") if r.completed_at else ""
+
+        text += f"{i}. {s_name} {diff_tag} {bar} {r.percentage:.0f}% (Band {band}){mock_tag} — {date_str}\n"
+
+    # Trend hisoblash
+    if len(results) >= 2:
+        recent_avg = sum(r.percentage for r in results[:5]) / min(5, len(results))
+        older_idx = min(5, len(results))
+        older = results[older_idx:]
+        if older:
+            older_avg = sum(r.percentage for r in older) / len(older)
+            diff = recent_avg - older_avg
+            if diff > 0:
+                text += f"\n📈 Trend: <b>+{diff:.1f}%</b> ↗️ Yaxshilanmoqda!"
+            elif diff < -2:
+                text += f"\n📉 Trend: <b>{diff:.1f}%</b> ↘️ Ko'proq mashq qiling!"
+            else:
+                text += f"\n➡️ Trend: Barqaror"
 
-        if not results:
-            await query.edit_message_text("📈 Hali natijalar yo'q!")
-            return
-
-        text = "📈 <b>Band Score tarix</b>\n\n"
-
-        for i, r in enumerate(results, 1):
-            s = session.query(Subject).get(r.subject_id)
-            s_name = f"{s.emoji}" if s else "?"
-            band = _percentage_to_band(r.percentage)
-            bar = _mini_bar(r.percentage)
-            mock_tag = " 📋" if r.is_mock else ""
-            diff_tag = {"easy": "🟢", "medium": "🟡", "hard": "🔴"}.get(r.difficulty_level, "")
-            date_str = r.completed_at.strftime("%d.%m %H:%M") if r.completed_at else ""
-
-            text += f"{i}. {s_name} {diff_tag} {bar} {r.percentage:.0f}% (Band {band}){mock_tag} — {date_str}\n"
-
-        # Trend hisoblash
-        if len(results) >= 2:
-            recent_avg = sum(r.percentage for r in results[:5]) / min(5, len(results))
-            older_idx = min(5, len(results))
-            older = results[older_idx:]
-            if older:
-                older_avg = sum(r.percentage for r in older) / len(older)
-                diff = recent_avg - older_avg
-                if diff > 0:
-                    text += f"\n📈 Trend: <b>+{diff:.1f}%</b> ↗️ Yaxshilanmoqda!"
-                elif diff < -2:
-                    text += f"\n📉 Trend: <b>{diff:.1f}%</b> ↘️ Ko'proq mashq qiling!"
-                else:
-                    text += f"\n➡️ Trend: Barqaror"
-
-        keyboard = [
-            [InlineKeyboardButton("📊 Umumiy natijalar", callback_data="my_stats")],
-            [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
-        ]
-        await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        session.close()
+    keyboard = [
+        [InlineKeyboardButton("📊 Umumiy natijalar", callback_data="my_stats")],
+        [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
+    ]
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/reyting buyrug'i"""
-    text = _build_leaderboard()
-    keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
-    await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+    text, keyboard = await _build_leaderboard(update.effective_user.id)
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=keyboard)
 
 
 async def leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Reyting callback"""
+    """Reyting callback: leaderboard yoki lb_<window>_<subject_id>"""
     query = update.callback_query
     await query.answer()
-    text = _build_leaderboard()
-    keyboard = [[InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")]]
-    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+    window, subject_id = "all", None
+    if query.data.startswith("lb_"):
+        _, window, sid = query.data.split("_")
+        subject_id = int(sid) or None
+    text, keyboard = await _build_leaderboard(query.from_user.id, window, subject_id)
+    try:
+        await query.edit_message_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except BadRequest:
+        pass  # Xuddi shu tugma qayta bosildi — matn o'zgarmagan
 
 
-def _build_leaderboard():
-    session = get_session()
-    try:
-        leaderboard = (
-            session.query(
-                UserResult.user_id,
-                func.max(UserResult.full_name).label("full_name"),
-                func.avg(UserResult.percentage).label("avg_pct"),
-                func.count(UserResult.id).label("test_count"),
-            )
-            .group_by(UserResult.user_id)
-            .order_by(desc("avg_pct"))
-            .limit(10)
-            .all()
-        )
+async def _build_leaderboard(user_id, window="all", subject_id=None):
+    await leaderboard.ensure_fresh_async()
 
-        if not leaderboard:
-            return "🏆 <b>Reyting</b>\n\nHali hech kim test yechmagan!"
+    subject = question_bank.subject(subject_id) if subject_id else None
+    title = WINDOW_LABELS.get(window, "Umumiy")
+    if subject:
+        title += f" — {subject.emoji} {subject.name}"
 
+    top = leaderboard.top(10, window, subject_id)
+    if not top:
+        text = f"🏆 <b>Reyting ({title})</b>\n\nHali hech kim test yechmagan!"
+    else:
         medals = ["🥇", "🥈", "🥉"]
-        text = "🏆 <b>IELTS Reyting — Top 10</b>\n\n"
-
-        for i, row in enumerate(leaderboard):
+        text = f"🏆 <b>IELTS Reyting — Top 10</b>\n<i>{title}</i>\n\n"
+        for i, (uid, name, avg_pct, tests) in enumerate(top):
             medal = medals[i] if i < 3 else f"{i + 1}."
-            band = _percentage_to_band(row.avg_pct)
-            name = row.full_name or "Foydalanuvchi"
-            text += f"{medal} <b>{name}</b> — {row.avg_pct:.0f}% (Band {band}) [{row.test_count} test]\n"
+            band = _percentage_to_band(avg_pct)
+            text += f"{medal} <b>{name or 'Foydalanuvchi'}</b> — {avg_pct:.0f}% (Band {band}) [{tests} test]\n"
 
-        return text
-    finally:
-        session.close()
+        pos = leaderboard.position(user_id, window, subject_id)
+        if pos:
+            rank, total, percentile, avg_pct = pos
+            text += (
+                f"\n{'─' * 25}\n"
+                f"📍 Sizning o'rningiz: <b>#{rank}</b> / {total} — {avg_pct:.0f}%\n"
+                f"📊 Siz {percentile:.0f}% foydalanuvchidan yuqoridasiz"
+            )
+        else:
+            text += f"\n{'─' * 25}\n📍 Siz bu reytingda hali yo'qsiz"
+
+    sid = subject_id or 0
+    keyboard = [
+        [
+            InlineKeyboardButton(("✅ " if w == window else "") + WINDOW_LABELS[w], callback_data=f"lb_{w}_{sid}")
+            for w in WINDOWS
+        ],
+        [
+            InlineKeyboardButton(("✅ " if s.id == subject_id else "") + s.emoji, callback_data=f"lb_{window}_{s.id}")
+            for s in question_bank.subjects()[:6]
+        ],
+        [InlineKeyboardButton("🌍 Barcha bo'limlar", callback_data=f"lb_{window}_0")] if subject_id else [],
+        [InlineKeyboardButton("🔙 Orqaga", callback_data="back_subjects")],
+    ]
+    return text, InlineKeyboardMarkup([row for row in keyboard if row])
 
 
 def _percentage_to_band(pct):
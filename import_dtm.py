@@ -11,6 +11,9 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from sqlalchemy import func
 from database import init_db, get_session, Subject, Question
+from utils.question_bank import question_bank
+from utils.render_cache import render_cache
+from utils.response_cache import bump_content_version
 
 SUBJECT_EMOJIS = {
     "Adabiyot": "📖",
@@ -86,7 +89,14 @@ def import_dtm(filepath):
             # Fan bo'yicha hisob
             subject_counts[subject_name] = subject_counts.get(subject_name, 0) + 1
 
+        # Webapp keshlari va bot banki (content_refresh_job) yangi savollarni ko'radi
+        bump_content_version(session)
         session.commit()
+        # Shu jarayonda bank yuklangan bo'lsa (bot ichidan chaqirilganda) — darhol
+        if question_bank.loaded:
+            question_bank.load()
+            render_cache.invalidate()
+            render_cache.warm()
 
         print(f"\n✅ Jami qo'shildi: {added} ta savol")
         if skipped:
@@ -1,12 +1,12 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from database import get_session, Subject
+from sqlalchemy import select
+from database import get_async_session, Subject
 
 
-def subjects_keyboard():
+async def subjects_keyboard():
     """Fanlar ro'yxati uchun inline keyboard"""
-    session = get_session()
-    try:
-        subjects = session.query(Subject).order_by(Subject.name).all()
+    async with get_async_session() as session:
+        subjects = (await session.scalars(select(Subject).order_by(Subject.name))).all()
         keyboard = []
         row = []
         for i, subj in enumerate(subjects):
@@ -19,21 +19,31 @@ def subjects_keyboard():
                 keyboard.append(row)
                 row = []
         return InlineKeyboardMarkup(keyboard) if keyboard else None
-    finally:
-        session.close()
 
 
-def answer_keyboard(question_id):
-    """A/B/C/D javob tugmalari — faqat harf ko'rsatiladi"""
+def answer_keyboard(question_id, mode=None):
+    """A/B/C/D javob tugmalari — faqat harf ko'rsatiladi.
+
+    `mode` berilsa callback `ans_<mode>_<id>_<harf>` ko'rinishida bo'ladi va
+    to'g'ridan-to'g'ri o'sha rejim handleriga yo'naltiriladi (utils/router.py);
+    aks holda eski `answer_<id>_<harf>`.
+    """
+    prefix = f"ans_{mode}_" if mode else "answer_"
     keyboard = [[
-        InlineKeyboardButton("🅰️ A", callback_data=f"answer_{question_id}_a"),
-        InlineKeyboardButton("🅱️ B", callback_data=f"answer_{question_id}_b"),
-        InlineKeyboardButton("🅲 C", callback_data=f"answer_{question_id}_c"),
-        InlineKeyboardButton("🅳 D", callback_data=f"answer_{question_id}_d"),
+        InlineKeyboardButton("🅰️ A", callback_data=f"{prefix}{question_id}_a"),
+        InlineKeyboardButton("🅱️ B", callback_data=f"{prefix}{question_id}_b"),
+        InlineKeyboardButton("🅲 C", callback_data=f"{prefix}{question_id}_c"),
+        InlineKeyboardButton("🅳 D", callback_data=f"{prefix}{question_id}_d"),
     ]]
     return InlineKeyboardMarkup(keyboard)
 
 
+def parse_answer(data):
+    """`answer_<id>_<harf>` yoki `ans_<mode>_<id>_<harf>` -> (question_id, harf)"""
+    question_id, letter = data.rsplit("_", 2)[-2:]
+    return int(question_id), letter
+
+
 def back_to_subjects_keyboard():
     """Orqaga qaytish tugmasi"""
     keyboard = [[
@@ -7,7 +7,12 @@ echo "🚀 Starting services on port $PORT..."
 # Use gunicorn to run the web server in the background
 # We don't use --daemon here to let the shell manage it 
 # but we append & to put it in background
-gunicorn webapp_server:app --bind 0.0.0.0:$PORT &
+# WEBAPP_SERVER=asgi — bitta jarayon, event loop va umumiy async DB pool (webapp_asgi.py)
+if [ "$WEBAPP_SERVER" = "asgi" ]; then
+    uvicorn webapp_asgi:app --host 0.0.0.0 --port $PORT &
+else
+    gunicorn webapp_server:app --bind 0.0.0.0:$PORT &
+fi
 
 # Wait a bit for the port to bind
 sleep 5
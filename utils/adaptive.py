@@ -0,0 +1,279 @@
+"""Adaptiv test — Elo reytinglari bo'yicha savol tanlash.
+
+Har bir foydalanuvchining fan bo'yicha qobiliyat reytingi va har bir
+savolning qiyinlik reytingi saqlanadi. Javobdan keyin ikkalasi ham onlayn
+yangilanadi (Elo / Rasch modeli):
+
+    E = 1 / (1 + 10 ** ((savol - foydalanuvchi) / 400))
+    foydalanuvchi += K_u * (natija - E);  savol -= K_q * (natija - E)
+
+K_u yangi foydalanuvchida katta va javoblar ko'paygan sari kichrayadi —
+10 savollik testning o'zida baho tez barqarorlashadi. Keyingi savol
+foydalanuvchi reytingiga eng yaqin (E ~ 0.5, eng ko'p ma'lumot beradigan)
+savol: har bir fan uchun savollar `BUCKET` kenglikdagi reyting
+bo'laklariga bo'lingan, bo'lak kalitlari tartiblangan ro'yxatda — qidiruv
+`bisect` bilan O(log n), keyin qo'shni bo'laklarga qarab kengayadi.
+Yaqinda ko'rilgan savollar (utils/seen.py) iloji boricha chetlab o'tiladi.
+
+Savolning boshlang'ich reytingi uning qiyinligidan olinadi (`DIFF_RATING`).
+Reytinglar xotirada; o'zgarganlari `RATINGS_FLUSH_INTERVAL` da
+`user_ratings` / `question_ratings` jadvallariga upsert qilinadi. Shu
+sababli `observe` / `pick` faqat `prepare()` DB dan yuklagan fan va
+foydalanuvchi bilan ishlaydi — aks holda standart qiymatlar saqlangan
+reytinglar ustidan yozilardi.
+"""
+import logging
+import random
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from config import DB_URL, SEEN_CACHE_SIZE
+from database import QuestionRating, UserRating, get_async_session
+from utils.question_bank import question_bank
+
+logger = logging.getLogger(__name__)
+
+BASE_RATING = 1500.0
+DIFF_RATING = {1: 1300.0, 2: 1500.0, 3: 1700.0}
+
+# Foydalanuvchi K: yangida K_USER_NEW, tajribalida K_USER ga yaqinlashadi
+K_USER, K_USER_NEW = 32.0, 160.0
+# Savol K: ko'p javob olgan savol reytingi sekinroq o'zgaradi
+K_QUESTION, K_QUESTION_MIN = 16.0, 4.0
+
+# Reyting bo'lagi kengligi va yangi savol izlashda ko'riladigan bo'laklar soni
+BUCKET = 25
+FRESH_SPAN = 8
+
+
+def expected(user_rating, question_rating):
+    """Foydalanuvchi savolga to'g'ri javob berish ehtimoli"""
+    return 1.0 / (1.0 + 10 ** ((question_rating - user_rating) / 400.0))
+
+
+def band_percentage(rating):
+    """O'rta (Medium) savollarda kutiladigan natija, % — band jadvali uchun"""
+    return expected(rating, DIFF_RATING[2]) * 100
+
+
+class RatingIndex:
+    """Bitta fan savollari: reyting bo'laklari va ularning tartiblangan kalitlari"""
+
+    def __init__(self):
+        self._bucket_of = {}   # question_id -> bo'lak kaliti
+        self._buckets = {}     # kalit -> [question_id]
+        self._keys = []        # tartiblangan kalitlar
+
+    def __len__(self):
+        return len(self._bucket_of)
+
+    def place(self, qid, rating):
+        key = int(rating // BUCKET)
+        old = self._bucket_of.get(qid)
+        if old == key:
+            return
+        if old is not None:
+            bucket = self._buckets[old]
+            bucket.remove(qid)
+            if not bucket:
+                del self._buckets[old]
+                del self._keys[bisect_left(self._keys, old)]
+        if key not in self._buckets:
+            self._buckets[key] = []
+            insort(self._keys, key)
+        self._buckets[key].append(qid)
+        self._bucket_of[qid] = key
+
+    def _outward(self, target):
+        """Bo'laklar — `target` ga yaqinlik tartibida"""
+        keys = self._keys
+        key = int(target // BUCKET)
+        hi = bisect_left(keys, key)
+        lo = hi - 1
+        while lo >= 0 or hi < len(keys):
+            if hi >= len(keys) or (lo >= 0 and key - keys[lo] <= keys[hi] - key):
+                yield self._buckets[keys[lo]]
+                lo -= 1
+            else:
+                yield self._buckets[keys[hi]]
+                hi += 1
+
+    def nearest(self, target, exclude=(), prefer=None):
+        """`target` reytingiga eng yaqin savol; avval `prefer(qid)` True bo'lganlari
+        (`FRESH_SPAN` bo'lakgacha), keyin `exclude` da bo'lmagan istalgani."""
+        if prefer is not None:
+            for span, bucket in enumerate(self._outward(target)):
+                if span >= FRESH_SPAN:
+                    break
+                picks = [q for q in bucket if q not in exclude and prefer(q)]
+                if picks:
+                    return random.choice(picks)
+        for bucket in self._outward(target):
+            picks = [q for q in bucket if q not in exclude]
+            if picks:
+                return random.choice(picks)
+        return None
+
+
+class AdaptiveEngine:
+    def __init__(self, max_users=SEEN_CACHE_SIZE):
+        self.max_users = max_users
+        self._questions = {}          # question_id -> [rating, answers]
+        self._users = OrderedDict()   # (user_id, subject_id) -> [rating, answers] (LRU)
+        self._index = {}              # subject_id -> RatingIndex
+        self._loaded_subjects = set()
+        self._bank_version = None
+        self._dirty_q = set()
+        self._dirty_u = set()
+        if "postgresql" in DB_URL:
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        self._insert = insert
+
+    # === Yuklash ===
+
+    async def prepare(self, user_id, subject_id):
+        """Test boshida: fan indeksi va foydalanuvchi reytingi xotirada bo'lishi (2 ta SELECT gacha)"""
+        if self._bank_version != question_bank.version:
+            # Savollar qayta yuklangan — bo'laklar qaytadan quriladi
+            self._index, self._bank_version = {}, question_bank.version
+        if subject_id not in self._loaded_subjects:
+            ids = list(question_bank.ids(subject_id))
+            async with get_async_session() as session:
+                rows = (await session.execute(
+                    select(QuestionRating.question_id, QuestionRating.rating, QuestionRating.answers)
+                    .where(QuestionRating.question_id.in_(ids))
+                )).all() if ids else []
+            for qid, rating, answers in rows:
+                # Yozilmagan o'zgarish bo'lmasa DB qiymati ustun
+                if qid not in self._dirty_q:
+                    self._questions[qid] = [rating, answers]
+            self._loaded_subjects.add(subject_id)
+        if subject_id not in self._index:
+            self._index[subject_id] = self._build_index(subject_id)
+
+        key = (user_id, subject_id)
+        if key not in self._users:
+            async with get_async_session() as session:
+                row = await session.scalar(select(UserRating).filter_by(user_id=user_id, subject_id=subject_id).limit(1))
+            if key not in self._users:
+                self._users[key] = [row.rating, row.answers] if row else [BASE_RATING, 0]
+                self._evict()
+        self._users.move_to_end(key)
+        return self._users[key][0]
+
+    def _build_index(self, subject_id):
+        index = RatingIndex()
+        for qid in question_bank.ids(subject_id):
+            index.place(qid, self._question_rating(qid))
+        return index
+
+    def _question_rating(self, qid):
+        entry = self._questions.get(qid)
+        if entry is None:
+            q = question_bank.get(qid)
+            entry = self._questions[qid] = [DIFF_RATING.get(q.difficulty if q else 2, BASE_RATING), 0]
+        return entry[0]
+
+    def _evict(self):
+        for key in list(self._users):
+            if len(self._users) <= self.max_users:
+                break
+            if key not in self._dirty_u:
+                del self._users[key]
+
+    # === Tanlash va yangilash (DB siz) ===
+
+    def rating(self, user_id, subject_id):
+        entry = self._users.get((user_id, subject_id))
+        return entry[0] if entry else BASE_RATING
+
+    def _prepared(self, user_id, subject_id):
+        return (
+            subject_id in self._loaded_subjects
+            and subject_id in self._index
+            and (user_id, subject_id) in self._users
+        )
+
+    def pick(self, user_id, subject_id, exclude=(), prefer=None):
+        """Foydalanuvchi reytingiga eng mos savol id si (prepare() dan keyin; aks holda None)"""
+        if not self._prepared(user_id, subject_id):
+            logger.warning(f"adaptive.pick: ({user_id}, {subject_id}) uchun prepare() chaqirilmagan")
+            return None
+        return self._index[subject_id].nearest(self.rating(user_id, subject_id), exclude, prefer)
+
+    def observe(self, user_id, subject_id, qid, correct):
+        """Javob bo'yicha ikkala reytingni yangilash; yangi foydalanuvchi reytingini qaytaradi.
+        prepare() qilinmagan bo'lsa hech narsa o'zgarmaydi (yuklanmagan qator yozilmaydi)."""
+        if not self._prepared(user_id, subject_id):
+            logger.warning(f"adaptive.observe: ({user_id}, {subject_id}) uchun prepare() chaqirilmagan")
+            return self.rating(user_id, subject_id)
+        user = self._users[(user_id, subject_id)]
+        self._users.move_to_end((user_id, subject_id))
+        q_rating = self._question_rating(qid)
+        question = self._questions[qid]
+        surprise = (1.0 if correct else 0.0) - expected(user[0], q_rating)
+
+        user[0] += (K_USER + (K_USER_NEW - K_USER) / (1 + user[1] / 10)) * surprise
+        user[1] += 1
+        question[0] -= max(K_QUESTION_MIN, K_QUESTION / (1 + question[1] / 50)) * surprise
+        question[1] += 1
+
+        self._index[subject_id].place(qid, question[0])
+        self._dirty_u.add((user_id, subject_id))
+        self._dirty_q.add(qid)
+        return user[0]
+
+    # === DB ga yozish ===
+
+    async def flush(self):
+        """O'zgargan reytinglarni bitta tranzaksiyada upsert qilish"""
+        if not self._dirty_u and not self._dirty_q:
+            return 0
+        dirty_u, self._dirty_u = self._dirty_u, set()
+        dirty_q, self._dirty_q = self._dirty_q, set()
+        users = [
+            {"user_id": uid, "subject_id": sid, "rating": e[0], "answers": e[1]}
+            for uid, sid in dirty_u if (e := self._users.get((uid, sid))) is not None
+        ]
+        questions = [
+            {"question_id": qid, "rating": e[0], "answers": e[1]}
+            for qid in dirty_q if (e := self._questions.get(qid)) is not None
+        ]
+        try:
+            async with get_async_session() as session:
+                if users:
+                    await session.execute(self._upsert(UserRating, ["user_id", "subject_id"]), users)
+                if questions:
+                    await session.execute(self._upsert(QuestionRating, ["question_id"]), questions)
+                await session.commit()
+        except Exception:
+            self._dirty_u |= dirty_u
+            self._dirty_q |= dirty_q
+            raise
+        return len(users) + len(questions)
+
+    def _upsert(self, model, keys):
+        stmt = self._insert(model)
+        return stmt.on_conflict_do_update(
+            index_elements=[getattr(model, k) for k in keys],
+            set_={
+                "rating": stmt.excluded.rating,
+                "answers": stmt.excluded.answers,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+
+
+adaptive = AdaptiveEngine()
+
+
+async def ratings_flush_job(context):
+    """JobQueue: o'zgargan reytinglarni yozish"""
+    try:
+        await adaptive.flush()
+    except Exception as e:
+        logger.error(f"Reytinglar flush xatosi: {e}")
@@ -0,0 +1,193 @@
+"""Javob hodisalari — har bir baholangan javob uchun bitta ixcham qator.
+
+UserResult faqat test yig'indisini, WrongAnswer esa faqat xatolarni
+saqlaydi. Savol darajasidagi tahlil (qiyinlik, javob vaqti, chalg'ituvchi
+variantlar) uchun test, speed, takrorlash, xatolar va audio rejimlaridagi
+har bir javob shu yerga yoziladi:
+
+    answer_events.record(user_id, question_id, "quiz", "b", True, shown_at)
+
+Qatorlar `write_behind` orqali partiyalab qo'shiladi. Jadvallar oyma-oy
+alohida (`answer_events_202610`): asosiy jadvallar o'smaydi, eski oylarni
+esa `DROP TABLE` bilan arzon o'chirish mumkin (`ANSWER_EVENTS_RETENTION_MONTHS`).
+Ixcham sxema: surrogat id yo'q, rejim va variant — kichik butun sonlar.
+
+Joriy va keyingi oy jadvallari init_db da yaratiladi, davriy
+`answer_events_rollover_job` keyingi oyni oldindan tayyorlaydi. Jadvali
+hali tayyor bo'lmagan oyning qatorlari jadval yaratilguncha kutib turadi —
+aks holda write-behind partiyasidagi boshqa qatorlar ham yiqilardi.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, DateTime, Index, Integer, MetaData, SmallInteger, Table,
+    inspect, select, text, union_all,
+)
+
+from config import ANSWER_EVENTS_RETENTION_MONTHS
+from utils.write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+TABLE_PREFIX = "answer_events_"
+
+# Rejim kodlari — qiymatlar DB da saqlanadi, o'zgartirmang (faqat qo'shing)
+MODES = {"quiz": 1, "mock": 2, "speed": 3, "spaced": 4, "mistake": 5, "audio": 6}
+MODE_NAMES = {code: name for name, code in MODES.items()}
+
+# Tanlangan variant: 0-3 (a-d), vaqt tugasa -1
+CHOICES = {"a": 0, "b": 1, "c": 2, "d": 3}
+TIMEOUT = -1
+
+metadata = MetaData()
+
+
+def month_key(day=None):
+    """YYYYMM (UTC) — answered_at ham UTC da yoziladi"""
+    day = day or datetime.utcnow().date()
+    return day.year * 100 + day.month
+
+
+def shift_month(month, delta):
+    year, m = divmod(month // 100 * 12 + month % 100 - 1 + delta, 12)
+    return year * 100 + m + 1
+
+
+def events_table(month):
+    """`month` (YYYYMM) oyining jadvali"""
+    name = f"{TABLE_PREFIX}{month}"
+    table = metadata.tables.get(name)
+    if table is None:
+        table = Table(
+            name, metadata,
+            Column("user_id", BigInteger, nullable=False),
+            Column("question_id", Integer, nullable=False),
+            Column("mode", SmallInteger, nullable=False),
+            Column("choice", SmallInteger, nullable=False),
+            Column("correct", Boolean, nullable=False),
+            Column("latency_ms", Integer),
+            Column("answered_at", DateTime, nullable=False),
+            Index(f"ix_{name}_question", "question_id"),
+            Index(f"ix_{name}_user", "user_id"),
+        )
+    return table
+
+
+def existing_months(conn):
+    """DB dagi oylik jadvallar (YYYYMM), o'sish tartibida"""
+    months = []
+    for name in inspect(conn).get_table_names():
+        suffix = name[len(TABLE_PREFIX):]
+        if name.startswith(TABLE_PREFIX) and suffix.isdigit():
+            months.append(int(suffix))
+    return sorted(months)
+
+
+def select_events(months, *columns):
+    """Berilgan oylar jadvallari ustidan UNION ALL (tahlil so'rovlari uchun)"""
+    selects = []
+    for month in months:
+        table = events_table(month)
+        selects.append(select(*(table.c[c] for c in columns)) if columns else select(table))
+    return union_all(*selects) if len(selects) > 1 else selects[0]
+
+
+def _create(conn, months):
+    for month in months:
+        events_table(month).create(conn, checkfirst=True)
+
+
+def _drop_expired(conn, keep_from):
+    dropped = []
+    for month in existing_months(conn):
+        if month < keep_from:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE_PREFIX}{month}"))
+            metadata.remove(events_table(month))
+            dropped.append(month)
+    return dropped
+
+
+class AnswerEventLog:
+    def __init__(self):
+        self._ready = set()       # jadvali mavjud oylar
+        self._waiting = {}        # oy -> jadval yaratilishini kutayotgan qatorlar
+        self._creating = {}       # oy -> yaratish vazifasi
+
+    def ensure_tables(self, engine):
+        """Sync engine (init_db): joriy va keyingi oy jadvallarini yaratish"""
+        current = month_key()
+        months = (current, shift_month(current, 1))
+        with engine.begin() as conn:
+            _create(conn, months)
+        self._ready.update(months)
+
+    def record(self, user_id, question_id, mode, user_answer, is_correct, shown_at=None):
+        """Bitta javob; `user_answer` — "a".."d" yoki None (vaqt tugadi),
+        `shown_at` — savol ko'rsatilgan vaqt (time.time()), bo'lmasa latency NULL.
+        """
+        now = time.time()
+        answered_at = datetime.utcnow()
+        row = {
+            "user_id": user_id,
+            "question_id": question_id,
+            "mode": MODES[mode],
+            "choice": CHOICES.get(user_answer, TIMEOUT),
+            "correct": bool(is_correct),
+            "latency_ms": max(0, int((now - shown_at) * 1000)) if shown_at else None,
+            "answered_at": answered_at,
+        }
+        month = month_key(answered_at.date())
+        if month in self._ready:
+            write_behind.add(events_table(month), row)
+            return
+        self._waiting.setdefault(month, []).append(row)
+        if month not in self._creating:
+            try:
+                task = asyncio.get_running_loop().create_task(self._create_async(month))
+            except RuntimeError:
+                return  # Event loop yo'q — keyingi record() yoki rollover yaratadi
+            self._creating[month] = task
+
+    async def _create_async(self, month):
+        from database import async_engine
+
+        try:
+            async with async_engine.begin() as conn:
+                await conn.run_sync(_create, (month,))
+        except Exception as e:
+            logger.error(f"answer_events_{month} jadvalini yaratib bo'lmadi: {e}")
+            return
+        finally:
+            self._creating.pop(month, None)
+        self._ready.add(month)
+        for row in self._waiting.pop(month, []):
+            write_behind.add(events_table(month), row)
+
+    async def rollover(self, retention=ANSWER_EVENTS_RETENTION_MONTHS):
+        """Joriy va keyingi oy jadvallarini tayyorlash, muddati o'tganlarini o'chirish"""
+        from database import async_engine
+
+        current = month_key()
+        months = (current, shift_month(current, 1))
+        async with async_engine.begin() as conn:
+            await conn.run_sync(_create, months)
+            dropped = await conn.run_sync(_drop_expired, shift_month(current, -retention + 1)) if retention > 0 else []
+        self._ready.update(months)
+        self._ready.difference_update(dropped)
+        return dropped
+
+
+answer_events = AnswerEventLog()
+
+
+async def answer_events_rollover_job(context):
+    """JobQueue (har 6 soatda): oylik jadvallarni almashtirish"""
+    try:
+        dropped = await answer_events.rollover()
+        if dropped:
+            logger.info(f"answer_events: eski oylar o'chirildi: {dropped}")
+    except Exception as e:
+        logger.error(f"answer_events rollover xatosi: {e}")
@@ -0,0 +1,163 @@
+"""Savol vaqt chegaralari — bitta asyncio vazifasi boshqaradigan taymer g'ildiragi.
+
+Har bir savol uchun alohida `job_queue.run_once` job i yaratish va javobda
+`get_jobs_by_name` bilan qidirib bekor qilish o'rniga:
+
+* `deadlines.arm(kind, user_id, seconds, data)` — (kind, user_id) kalitiga
+  muddat qo'yadi (avvalgisini almashtiradi), muddat vaqtini (epoch) qaytaradi;
+* `deadlines.cancel(kind, user_id)` — yozuv lug'atdan va o'z bo'lagidan olinadi;
+* muddat o'tganda `register(kind, callback)` bilan ulangan
+  `callback(context, user_id, data)` chaqiriladi (context — shu foydalanuvchi
+  uchun CallbackContext) — foydalanuvchi qulfi ostida, ya'ni uning
+  update lari bilan bir vaqtda emas (utils/update_processor.py).
+
+Muddatlar `TICK` soniyalik bo'laklarga (tick raqami -> kalitlar) joylanadi:
+arm, qayta arm va cancel — O(1) lug'at amallari, eskirgan yozuv qolmaydi.
+Vazifa muddat bor paytda har tick da uyg'onib, o'tgan bo'laklarni
+bo'shatadi; callback muddatdan ko'pi bilan bir tick kech ishlaydi, hech
+qachon erta emas.
+
+Muddat handler holatida (`user_data[kind]["deadline"]`) saqlanadi, shuning
+uchun bot qayta ishga tushganda `restore()` persistence dan yuklangan
+holatlar bo'yicha taymerlarni tiklaydi (o'tib ketganlari darhol ishlaydi).
+Callback dan keyin foydalanuvchi holati persistence ga yozish uchun
+belgilanadi (`mark_data_for_update_persistence`).
+"""
+import asyncio
+import logging
+import math
+import time
+
+from telegram.ext import CallbackContext
+
+from utils.update_processor import user_locks
+
+logger = logging.getLogger(__name__)
+
+# G'ildirak bo'lagi (soniya) — callback kechikishining yuqori chegarasi
+TICK = 0.25
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        self._slots = {}       # tick -> {key: None} (kelish tartibida)
+        self._entries = {}     # key -> (when, tick, data)
+        self._callbacks = {}   # kind -> async callback(context, user_id, data)
+        self._cursor = int(time.time() // TICK)   # keyingi ko'riladigan bo'lak
+        self._wakeup = None
+        self._task = None
+        self._running = set()
+        self.app = None
+
+    def register(self, kind, callback):
+        self._callbacks[kind] = callback
+
+    def __len__(self):
+        return len(self._entries)
+
+    # === Boshqarish ===
+
+    def arm(self, kind, user_id, seconds, data=None, when=None):
+        """Muddat qo'yish; epoch vaqtini qaytaradi (holatda saqlash uchun)"""
+        if when is None:
+            when = time.time() + seconds
+        key = (kind, user_id)
+        self._unslot(key)
+        if not self._entries:
+            # Bo'sh turgan g'ildirak — kursor hozirga suriladi (bo'sh bo'laklarni aylanmaslik uchun)
+            self._cursor = max(self._cursor, int(time.time() // TICK))
+        # O'tib ketgan muddat — keyingi ko'riladigan bo'lakka
+        tick = max(math.ceil(when / TICK), self._cursor)
+        self._entries[key] = (when, tick, data)
+        self._slots.setdefault(tick, {})[key] = None
+        self._ensure_task()
+        if self._wakeup:
+            self._wakeup.set()
+        return when
+
+    def cancel(self, kind, user_id):
+        return self._unslot((kind, user_id))
+
+    def _unslot(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        slot = self._slots.get(entry[1])
+        if slot is not None:
+            slot.pop(key, None)
+            if not slot:
+                del self._slots[entry[1]]
+        return True
+
+    def _ensure_task(self):
+        if self._task and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Event loop yo'q — start() ishga tushiradi
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run(), name="deadlines")
+
+    async def _run(self):
+        while True:
+            if not self._entries:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            current = int(time.time() // TICK)
+            while self._cursor <= current:
+                for key in self._slots.pop(self._cursor, ()):
+                    _, _, data = self._entries.pop(key)
+                    task = asyncio.create_task(self._fire(key, data))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                self._cursor += 1
+            await asyncio.sleep(max(0.0, self._cursor * TICK - time.time()))
+
+    async def _fire(self, key, data):
+        kind, user_id = key
+        callback = self._callbacks.get(kind)
+        if callback is None or self.app is None:
+            return
+        context = CallbackContext(self.app, chat_id=(data or {}).get("chat_id"), user_id=user_id)
+        try:
+            # Shu foydalanuvchining update lari bilan navbatda (parallel javob bilan poyga yo'q)
+            async with user_locks(user_id):
+                await callback(context, user_id, data)
+        except Exception as e:
+            logger.error(f"Deadline ({kind}, {user_id}) xatosi: {e}")
+        finally:
+            # Callback user_data ni update siz o'zgartirdi — PTB uni o'zi yozmaydi;
+            # aks holda restart dan keyin restore() eski muddatni qayta ishga tushiradi
+            self.app.mark_data_for_update_persistence(user_ids=user_id)
+
+    # === Ilova bilan bog'lash ===
+
+    def start(self, app):
+        """post_init: ilovani bog'lash va persistence dagi muddatlarni tiklash"""
+        self.app = app
+        self._ensure_task()
+        return self.restore(app.user_data)
+
+    def restore(self, user_data):
+        restored = 0
+        for user_id, data in user_data.items():
+            for kind in self._callbacks:
+                state = data.get(kind)
+                if isinstance(state, dict) and state.get("deadline"):
+                    self.arm(kind, user_id, 0, state.get("deadline_data"), when=state["deadline"])
+                    restored += 1
+        return restored
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+deadlines = DeadlineScheduler()
@@ -1,6 +1,9 @@
 import json
 from sqlalchemy import func
 from database import get_session, Subject, Question
+from utils.question_bank import question_bank
+from utils.render_cache import render_cache
+from utils.response_cache import bump_content_version
 
 
 def import_from_json(json_data):
@@ -96,7 +99,14 @@ def import_from_json(json_data):
             except Exception as e:
                 errors.append(f"Savol #{i}: {str(e)}")
 
+        subject_id = subject.id
+        # Webapp keshlari (fanlar/savollar javoblari) yangi versiyani ko'radi
+        bump_content_version(session)
         session.commit()
+        # Xotiradagi savollar bankini shu fan bo'yicha yangilash
+        question_bank.reload_subject(subject_id)
+        render_cache.invalidate(subject_id)
+        render_cache.warm(subject_id)
 
         error_msg = ""
         if errors:
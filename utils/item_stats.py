@@ -0,0 +1,184 @@
+"""Savol statistikasi — answer_events dan kunlik hisoblanadigan ko'rsatkichlar.
+
+Import paytida qo'lda qo'yilgan `Question.difficulty` (1/2/3) haqiqiy
+natijalar bilan tekshirilmas edi. Bu job oxirgi `ITEM_STATS_MONTHS` oylik
+javoblarni ustunlar bo'yicha NumPy massivlariga yuklaydi va har bir savol
+uchun guruhlangan yig'indilar (`np.bincount`) orqali hisoblaydi:
+
+* p-value — to'g'ri javoblar ulushi;
+* discrimination — javob to'g'riligi bilan foydalanuvchining shu savolsiz
+  (rest-score) natijasi orasidagi point-biserial korrelyatsiya;
+* o'rtacha javob vaqti (ms) va A/B/C/D hamda vaqt tugashi ulushlari.
+
+Python da javoblar bo'yicha sikl yo'q — millionlab qator bir necha soniyada.
+Takrorlash va xatolar rejimlari olinmaydi: ular oldin xato qilingan
+savollarni qaytadan beradi va p-value ni pasaytirib yuboradi.
+
+Natija `question_stats` jadvaliga yoziladi. Javoblari
+`ITEM_STATS_MIN_ANSWERS` dan ko'p savollarga p-value bo'yicha kalibrlangan
+qiyinlik beriladi; savollar banki (utils/question_bank.py) test tanlashda
+shu qiyinlikni ishlatadi. Qo'lda:
+
+    python -m utils.item_stats
+"""
+import asyncio
+import logging
+from datetime import datetime, time
+
+import numpy as np
+from sqlalchemy import cast, delete, func, insert, select, Integer
+
+from config import ITEM_STATS_MONTHS, ITEM_STATS_MIN_ANSWERS
+from database import QuestionStats, engine, session_scope
+from utils.answer_events import MODES, events_table, existing_months, month_key, shift_month
+
+logger = logging.getLogger(__name__)
+
+# Statistikaga kiradigan rejimlar (savol tasodifiy tanlanadiganlari)
+SAMPLED_MODES = tuple(MODES[m] for m in ("quiz", "mock", "speed", "audio"))
+
+# p-value chegaralari: >= EASY_P — oson (1), >= MEDIUM_P — o'rta (2), aks holda qiyin (3)
+EASY_P, MEDIUM_P = 0.75, 0.45
+
+# Bir partiyada o'qiladigan qatorlar
+CHUNK = 200_000
+
+
+def _load(conn, months):
+    """[user_id, question_id, choice, correct, latency_ms] ustunlari — int64 massivlar"""
+    chunks = []
+    for month in months:
+        t = events_table(month)
+        stmt = select(
+            t.c.user_id, t.c.question_id, t.c.choice, cast(t.c.correct, Integer),
+            func.coalesce(t.c.latency_ms, -1),
+        ).where(t.c.mode.in_(SAMPLED_MODES))
+        # DBAPI kursori oddiy tuple qaytaradi — Row obyektlarisiz np.array
+        # bir necha barobar tez quriladi
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(str(stmt.compile(conn, compile_kwargs={"literal_binds": True})))
+            while part := cursor.fetchmany(CHUNK):
+                chunks.append(np.array(part, dtype=np.int64))
+        finally:
+            cursor.close()
+    if not chunks:
+        return np.empty((0, 5), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def compute(data, min_answers=ITEM_STATS_MIN_ANSWERS):
+    """`_load` massividan savol statistikasi; dict lar ro'yxati (question_stats qatorlari)"""
+    if not len(data):
+        return []
+    users, qids, choice, correct, latency = data.T
+    correct = correct.astype(np.float64)
+
+    # Foydalanuvchi natijasi shu javobsiz (rest-score)
+    _, u = np.unique(users, return_inverse=True)
+    u_n = np.bincount(u).astype(np.float64)
+    u_correct = np.bincount(u, weights=correct)
+    others = u_n[u] - 1
+    has_rest = others > 0
+    rest = np.divide(u_correct[u] - correct, others, out=np.zeros_like(correct), where=has_rest)
+
+    question_ids, q = np.unique(qids, return_inverse=True)
+    n_q = len(question_ids)
+    n = np.bincount(q, minlength=n_q).astype(np.float64)
+    p_value = np.bincount(q, weights=correct, minlength=n_q) / n
+
+    # Point-biserial: rest-score ga ega javoblar bo'yicha Pearson r
+    w = has_rest.astype(np.float64)
+    m = np.bincount(q, weights=w, minlength=n_q)
+    sx = np.bincount(q, weights=correct * w, minlength=n_q)
+    sy = np.bincount(q, weights=rest * w, minlength=n_q)
+    sxy = np.bincount(q, weights=correct * rest * w, minlength=n_q)
+    syy = np.bincount(q, weights=rest * rest * w, minlength=n_q)
+    cov = m * sxy - sx * sy
+    var = (m * sx - sx * sx) * (m * syy - sy * sy)  # correct^2 == correct
+    valid = var > 0
+    discrimination = np.divide(cov, np.sqrt(np.where(valid, var, 1.0)), out=np.zeros(n_q), where=valid)
+
+    timed = latency >= 0
+    lat_n = np.bincount(q, weights=timed, minlength=n_q)
+    lat_sum = np.bincount(q, weights=np.where(timed, latency, 0), minlength=n_q)
+    mean_latency = np.divide(lat_sum, lat_n, out=np.zeros(n_q), where=lat_n > 0)
+
+    # Variantlar: choice -1 (vaqt tugadi), 0-3 (a-d) -> 0..4 ustunlar
+    picks = np.bincount(q * 5 + (choice + 1), minlength=n_q * 5).reshape(n_q, 5) / n[:, None]
+
+    difficulty = np.where(p_value >= EASY_P, 1, np.where(p_value >= MEDIUM_P, 2, 3))
+    calibrated = n >= min_answers
+
+    now = datetime.utcnow()
+    return [
+        {
+            "question_id": qid, "answers": cnt, "p_value": p,
+            "discrimination": d if ok else None,
+            "mean_latency_ms": lat if ln else None,
+            "timeout_rate": row[0], "pick_a": row[1], "pick_b": row[2], "pick_c": row[3], "pick_d": row[4],
+            "difficulty": diff if cal else None,
+            "updated_at": now,
+        }
+        for qid, cnt, p, d, ok, lat, ln, row, diff, cal in zip(
+            question_ids.tolist(), n.astype(int).tolist(), p_value.tolist(), discrimination.tolist(),
+            valid.tolist(), mean_latency.tolist(), (lat_n > 0).tolist(), picks.tolist(),
+            difficulty.tolist(), calibrated.tolist(),
+        )
+    ]
+
+
+def refresh(months=ITEM_STATS_MONTHS):
+    """Statistikani qayta hisoblab `question_stats` ni almashtirish (sync, alohida thread da)"""
+    with engine.connect() as conn:
+        current = month_key()
+        window = [m for m in existing_months(conn) if m >= shift_month(current, -months + 1)]
+        data = _load(conn, window)
+    rows = compute(data)
+    with engine.begin() as conn:
+        conn.execute(delete(QuestionStats))
+        if rows:
+            conn.execute(insert(QuestionStats), rows)
+    return len(data), rows
+
+
+def _bump_content_version():
+    from utils.response_cache import bump_content_version
+
+    with session_scope() as session:
+        bump_content_version(session)
+
+
+async def item_stats_job(context):
+    """JobQueue (kunlik): statistika va savollar banki qiyinliklarini yangilash"""
+    from utils.question_bank import question_bank
+    from utils.render_cache import render_cache
+
+    try:
+        answers, rows = await asyncio.to_thread(refresh)
+    except Exception as e:
+        logger.error(f"Savol statistikasi xatosi: {e}")
+        return
+    calibrated = {r["question_id"]: r["difficulty"] for r in rows if r["difficulty"]}
+    if question_bank.apply_calibration(calibrated):
+        render_cache.invalidate()
+        render_cache.warm()
+        # Webapp /api/questions qiyinliklari ham yangilanishi uchun
+        try:
+            await asyncio.to_thread(_bump_content_version)
+        except Exception as e:
+            logger.error(f"Kontent versiyasini oshirib bo'lmadi: {e}")
+    logger.info(f"📐 Savol statistikasi: {answers} ta javob, {len(rows)} ta savol, {len(calibrated)} ta kalibrlandi")
+
+
+def setup_item_stats_job(job_queue):
+    # UTC 22:30 = UZT 03:30 — eng kam faollik payti
+    job_queue.run_daily(item_stats_job, time=time(hour=22, minute=30), name="item_stats")
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    started = perf_counter()
+    answers, rows = refresh()
+    print(f"{answers} ta javob, {len(rows)} ta savol — {perf_counter() - started:.2f} s")
@@ -0,0 +1,403 @@
+"""Reyting — xotirada tartiblangan, natijalar bilan oshib boruvchi leaderboard.
+
+Har bir jarayon (bot, webapp worker) o'z nusxasini saqlaydi:
+
+* ishga tushganda `leaderboard_snapshots` + `app_state` dagi watermark dan
+  yuklanadi (snapshot bo'lmasa user_results dan bir marta quriladi);
+* bot tugagan testni `apply()` bilan darhol qo'shadi;
+* boshqa jarayon yozgan natijalar `catch_up()` orqali user_results.id
+  bo'yicha tail qilinadi (PK indeksi — arzon so'rov);
+* bot vaqti-vaqti bilan va to'xtashda `snapshot()` yozadi.
+
+Reytinglar: umumiy, fan bo'yicha, shu hafta va shu oy (fan bo'yicha ham).
+Tartib: o'rtacha foiz (kamayish), keyin testlar soni.
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import select, delete
+
+from database import (
+    UserResult, LeaderboardSnapshot, get_session, get_async_session, get_state, set_state,
+)
+
+WINDOWS = ("all", "week", "month")
+WINDOW_LABELS = {"all": "Umumiy", "week": "Shu hafta", "month": "Shu oy"}
+
+WATERMARK_KEY = "leaderboard_watermark"
+# Postgres da id lar commit tartibida kelmasligi mumkin — tail shuncha orqadan boshlanadi
+LOOKBACK = 200
+WEBAPP_NAME = "WebApp User"
+# load() tayyor holatni shu atributlar bilan almashtiradi
+_STATE = (
+    "_boards", "_periods", "names", "watermark", "_floor",
+    "_applied", "_applied_order", "loaded", "dirty", "_last_catch_up",
+)
+
+
+def _period(window, when):
+    if window == "week":
+        year, week, _ = when.isocalendar()
+        return f"{year}-W{week:02d}"
+    if window == "month":
+        return when.strftime("%Y-%m")
+    return ""
+
+
+def _board_key(window, period, subject_id):
+    parts = [window] + ([period] if period else []) + ([str(subject_id)] if subject_id else [])
+    return ":".join(parts)
+
+
+class SortedKeys:
+    """Tartiblangan kalitlar — `BUCKET` gacha bo'lgan bo'laklar ro'yxati.
+
+    Bitta oddiy ro'yxatda insort/del har yangilashda O(n) element suradi.
+    Bu yerda kalit bo'lagi `maxes` bo'yicha bisect bilan topiladi va faqat shu
+    bo'lak (≤ 2*BUCKET element) o'zgaradi; bo'laklar uzunliklari Fenwick
+    daraxtida, shuning uchun o'rin (index) O(log n). Bo'lak bo'linganda yoki
+    bo'shaganda daraxt qayta quriladi (bo'laklar soni bo'yicha, kam bo'ladi).
+    """
+    BUCKET = 256
+
+    def __init__(self):
+        self._lists = []
+        self._maxes = []
+        self._tree = []    # Fenwick: bo'lak uzunliklari
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def _rebuild(self):
+        tree = [len(sub) for sub in self._lists]
+        for i in range(1, len(tree) + 1):
+            j = i + (i & -i)
+            if j <= len(tree):
+                tree[j - 1] += tree[i - 1]
+        self._tree = tree
+
+    def _tree_add(self, pos, delta):
+        i = pos + 1
+        while i <= len(self._tree):
+            self._tree[i - 1] += delta
+            i += i & -i
+
+    def _prefix(self, pos):
+        """`pos` dan oldingi bo'laklardagi elementlar soni"""
+        total, i = 0, pos
+        while i > 0:
+            total += self._tree[i - 1]
+            i -= i & -i
+        return total
+
+    def add(self, key):
+        self._len += 1
+        if not self._maxes:
+            self._lists, self._maxes = [[key]], [key]
+            self._rebuild()
+            return
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._lists[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            insort(self._lists[pos], key)
+        sub = self._lists[pos]
+        if len(sub) > 2 * self.BUCKET:
+            half = sub[self.BUCKET:]
+            del sub[self.BUCKET:]
+            self._maxes[pos] = sub[-1]
+            self._lists.insert(pos + 1, half)
+            self._maxes.insert(pos + 1, half[-1])
+            self._rebuild()
+        else:
+            self._tree_add(pos, 1)
+
+    def remove(self, key):
+        pos = bisect_left(self._maxes, key)
+        sub = self._lists[pos]
+        del sub[bisect_left(sub, key)]
+        self._len -= 1
+        if sub:
+            self._maxes[pos] = sub[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._lists[pos], self._maxes[pos]
+            self._rebuild()
+
+    def index(self, key):
+        """`key` dan kichik elementlar soni (bisect_left)"""
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        return self._prefix(pos) + bisect_left(self._lists[pos], key)
+
+    def head(self, n):
+        result = []
+        for sub in self._lists:
+            if len(result) >= n:
+                break
+            result.extend(sub[:n - len(result)])
+        return result
+
+
+class Board:
+    """Bitta reyting: user_id -> (tests, sum_pct) va tartiblangan kalitlar.
+
+    Yangilash (kalitni chiqarib-qo'yish) va rank — O(log n), top(n) — O(n) emas,
+    faqat birinchi bo'laklar (SortedKeys).
+    """
+
+    def __init__(self):
+        self.totals = {}   # user_id -> [tests, sum_pct]
+        self._keys = SortedKeys()    # (-avg, -tests, user_id), o'sish tartibida
+
+    @staticmethod
+    def _key(user_id, tests, sum_pct):
+        return (-(sum_pct / tests), -tests, user_id)
+
+    def add(self, user_id, tests, sum_pct):
+        old = self.totals.get(user_id)
+        if old:
+            self._keys.remove(self._key(user_id, *old))
+            tests += old[0]
+            sum_pct += old[1]
+        self.totals[user_id] = [tests, sum_pct]
+        self._keys.add(self._key(user_id, tests, sum_pct))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def top(self, n=10):
+        """[(user_id, avg_pct, tests)]"""
+        return [(uid, -neg_avg, -neg_tests) for neg_avg, neg_tests, uid in self._keys.head(n)]
+
+    def rank(self, user_id):
+        """1 dan boshlanadigan o'rin yoki None"""
+        totals = self.totals.get(user_id)
+        if not totals:
+            return None
+        return self._keys.index(self._key(user_id, *totals)) + 1
+
+    def percentile(self, user_id):
+        """Foydalanuvchidan pastda turganlar ulushi (0-100)"""
+        r = self.rank(user_id)
+        if r is None:
+            return None
+        return (len(self._keys) - r) / len(self._keys) * 100
+
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._boards = {}      # board_key -> Board
+        self._periods = {}     # "week"/"month" -> joriy davr
+        self.names = {}        # user_id -> full_name
+        self.watermark = 0
+        self._floor = 0        # snapshotdan yuklanganda tail shu id dan pastga tushmaydi
+        self._applied = set()
+        self._applied_order = deque()
+        self.loaded = False
+        self.dirty = False
+        self._last_catch_up = 0.0
+        self._refresh = None   # ensure_fresh_async dagi umumiy vazifa
+
+    # === Hisoblash ===
+
+    def _roll(self, now):
+        for window in ("week", "month"):
+            period = _period(window, now)
+            if self._periods.get(window) != period:
+                prefix = f"{window}:"
+                self._boards = {k: b for k, b in self._boards.items() if not k.startswith(prefix)}
+                self._periods[window] = period
+
+    def _is_current(self, key):
+        window, *rest = key.split(":")
+        return window == "all" or (rest and rest[0] == self._periods.get(window))
+
+    def _board(self, key):
+        board = self._boards.get(key)
+        if board is None:
+            board = self._boards[key] = Board()
+        return board
+
+    def apply(self, result):
+        """Bitta UserResult (yoki shu atributli qator) ni barcha reytinglarga qo'shish"""
+        with self._lock:
+            self._apply(result)
+
+    def _apply(self, result):
+        if result.id in self._applied or result.id <= self._floor:
+            return
+        self._applied.add(result.id)
+        self._applied_order.append(result.id)
+        while len(self._applied_order) > LOOKBACK * 2:
+            self._applied.discard(self._applied_order.popleft())
+        self.watermark = max(self.watermark, result.id)
+
+        name = result.full_name or ""
+        if name and (name != WEBAPP_NAME or result.user_id not in self.names):
+            self.names[result.user_id] = name
+
+        completed = result.completed_at or datetime.utcnow()
+        self._roll(datetime.utcnow())
+        for window in WINDOWS:
+            period = _period(window, completed)
+            if window != "all" and period != self._periods[window]:
+                continue
+            for sid in (None, result.subject_id):
+                self._board(_board_key(window, period, sid)).add(result.user_id, 1, result.percentage)
+        self.dirty = True
+
+    # === O'qish ===
+
+    def board(self, window="all", subject_id=None):
+        with self._lock:
+            self._roll(datetime.utcnow())
+            key = _board_key(window, self._periods.get(window, ""), subject_id)
+            return self._boards.get(key) or Board()
+
+    def top(self, n=10, window="all", subject_id=None):
+        """[(user_id, name, avg_pct, tests)]"""
+        return [
+            (uid, self.names.get(uid, ""), avg, tests)
+            for uid, avg, tests in self.board(window, subject_id).top(n)
+        ]
+
+    def position(self, user_id, window="all", subject_id=None):
+        """(rank, total, percentile, avg_pct) yoki None"""
+        board = self.board(window, subject_id)
+        r = board.rank(user_id)
+        if r is None:
+            return None
+        tests, sum_pct = board.totals[user_id]
+        return r, len(board), board.percentile(user_id), sum_pct / tests
+
+    # === DB bilan sinxronlash (sync Session; async kodda session.run_sync) ===
+
+    def _result_rows(self, session, after):
+        return session.execute(
+            select(
+                UserResult.id, UserResult.user_id, UserResult.full_name, UserResult.subject_id,
+                UserResult.percentage, UserResult.completed_at,
+            ).where(UserResult.id > after).order_by(UserResult.id)
+        ).yield_per(1000)
+
+    def load(self, session):
+        """Snapshot dan yoki (bo'lmasa) butun user_results dan qurish.
+
+        DB o'qiladi va reytinglar alohida obyektda quriladi; qulf faqat tayyor
+        holatni almashtirishda olinadi (catch_up kabi). run_sync ostida har bir
+        o'qish event loop ga qaytadi — qulf butun o'qish davomida ushlansa,
+        parallel so'rov shu oqimning o'zida qulfni kutib workerni to'xtatardi.
+        """
+        staging = Leaderboard()
+        staging._build(session)
+        with self._lock:
+            for attr in _STATE:
+                setattr(self, attr, getattr(staging, attr))
+
+    def _build(self, session):
+        self._roll(datetime.utcnow())
+        watermark = int(get_state(session, WATERMARK_KEY, "0") or 0)
+        rows = session.scalars(select(LeaderboardSnapshot)).all() if watermark else []
+        if rows:
+            for r in rows:
+                # O'tgan hafta/oy snapshotlari tashlab yuboriladi
+                if not self._is_current(r.board):
+                    continue
+                self._board(r.board).add(r.user_id, r.tests, r.sum_pct)
+                if r.full_name:
+                    self.names.setdefault(r.user_id, r.full_name)
+            self.watermark = self._floor = watermark
+            after = watermark
+        else:
+            self.watermark = self._floor = 0
+            after = 0
+        for row in self._result_rows(session, after):
+            self._apply(row)
+        self.loaded = True
+        self.dirty = not rows
+        self._last_catch_up = time.monotonic()
+
+    def catch_up(self, session):
+        """Boshqa jarayon yozgan yangi natijalarni qo'shish"""
+        if not self.loaded:
+            self.load(session)
+            return
+        after = max(self.watermark - LOOKBACK, self._floor)
+        rows = self._result_rows(session, after).all()
+        with self._lock:
+            for row in rows:
+                self._apply(row)
+        self._last_catch_up = time.monotonic()
+
+    def snapshot(self, session):
+        """Barcha reytinglarni va watermark ni DB ga yozish (commit shu yerda)"""
+        with self._lock:
+            if not self.loaded or not self.dirty:
+                return False
+            rows = [
+                {
+                    "board": key, "user_id": uid, "tests": tests, "sum_pct": sum_pct,
+                    "full_name": self.names.get(uid, "") if key == "all" else "",
+                }
+                for key, board in self._boards.items()
+                for uid, (tests, sum_pct) in board.totals.items()
+            ]
+            watermark = self.watermark
+            self.dirty = False
+        session.execute(delete(LeaderboardSnapshot))
+        if rows:
+            session.execute(LeaderboardSnapshot.__table__.insert(), rows)
+        set_state(session, WATERMARK_KEY, watermark)
+        session.commit()
+        return True
+
+    # === Qulay wrapperlar ===
+
+    def ensure_fresh(self, max_age=5.0):
+        """Webapp: kerak bo'lsa yuklash va tail (max_age soniyada bir marta)"""
+        if self.loaded and time.monotonic() - self._last_catch_up < max_age:
+            return
+        session = get_session()
+        try:
+            self.catch_up(session)
+        finally:
+            session.close()
+
+    async def ensure_fresh_async(self, max_age=5.0):
+        if self.loaded and time.monotonic() - self._last_catch_up < max_age:
+            return
+        # Parallel so'rovlar bitta yuklash/tail ni kutadi (ResponseCache.ensure_fresh_async kabi)
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._refresh_async())
+        try:
+            await asyncio.shield(self._refresh)
+        finally:
+            if self._refresh is not None and self._refresh.done():
+                self._refresh = None
+
+    async def _refresh_async(self):
+        async with get_async_session() as session:
+            await session.run_sync(self.catch_up)
+
+    async def snapshot_async(self):
+        async with get_async_session() as session:
+            return await session.run_sync(self.snapshot)
+
+
+leaderboard = Leaderboard()
+
+
+async def leaderboard_snapshot_job(context):
+    """JobQueue: webapp natijalarini qo'shib, snapshot yozish"""
+    await leaderboard.ensure_fresh_async(max_age=0)
+    await leaderboard.snapshot_async()
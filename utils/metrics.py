@@ -0,0 +1,258 @@
+"""DB pool va so'rovlar metrikalari.
+
+* `timed_pool(QueuePool, "sync")` — connect() (navbatda kutish + pre_ping)
+  vaqtini, timeoutlarni va overflow ishlatilishini yozadigan pool klassi;
+* `instrument_engine(engine, name)` — before/after_cursor_execute orqali har
+  bir so'rov vaqtini normallashtirilgan SQL bo'yicha gistogrammaga yozadi.
+
+Har bir jarayon (bot, har bir gunicorn worker) o'z metrikalarini saqlaydi:
+webapp `/metrics` (Prometheus matn formati), bot esa `/admin_metrics`.
+"""
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import event, exc
+
+logger = logging.getLogger(__name__)
+
+# Gistogramma chegaralari (soniya)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_STATEMENTS = 300
+SLOW_QUERY_SECONDS = 0.5
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Bucket yuqori chegarasi bo'yicha taxminiy kvantil"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+
+class PoolStats:
+    def __init__(self):
+        self.wait = Histogram()
+        self.timeouts = 0
+        self.max_overflow_seen = 0
+        self.pool = None
+
+
+_lock = threading.Lock()
+pools = {}        # name -> PoolStats
+statements = {}   # normallashtirilgan SQL -> Histogram
+errors = {}       # normallashtirilgan SQL -> xatolar soni
+
+
+# === SQL normallashtirish ===
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|(?<!:):\w+|\$\d+|%s")
+_RE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_VALUES = re.compile(r"(VALUES\s*\([^)]*\))(?:\s*,\s*\([^)]*\))+", re.IGNORECASE)
+_RE_SPACE = re.compile(r"\s+")
+_RE_SELECT_LIST = re.compile(r"^SELECT (.{80,}?) FROM ", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Literal va parametrlarni `?` ga, IN/VALUES ro'yxatlarini bittaga qisqartirish"""
+    sql = _RE_STRING.sub("?", sql)
+    sql = _RE_PARAM.sub("?", sql)
+    sql = _RE_NUMBER.sub("?", sql)
+    sql = _RE_IN_LIST.sub("(?)", sql)
+    sql = _RE_VALUES.sub(r"\1, ...", sql)
+    sql = _RE_SPACE.sub(" ", sql).strip()
+    # ORM ning uzun ustunlar ro'yxati kalitni o'qib bo'lmaydigan qiladi
+    sql = _RE_SELECT_LIST.sub("SELECT … FROM ", sql, count=1)
+    return sql[:300]
+
+
+def _statement_hist(key):
+    hist = statements.get(key)
+    if hist is None:
+        if len(statements) >= MAX_STATEMENTS:
+            key = "<boshqa>"
+            hist = statements.get(key)
+        if hist is None:
+            hist = statements[key] = Histogram()
+    return hist
+
+
+# === Pool ===
+
+def timed_pool(base, name):
+    """`base` pool klassidan connect() vaqtini o'lchaydigan subklass yasash"""
+    stats = pools.setdefault(name, PoolStats())
+
+    class TimedPool(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            stats.pool = self
+
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                conn = super().connect()
+            except exc.TimeoutError:
+                with _lock:
+                    stats.timeouts += 1
+                raise
+            elapsed = time.perf_counter() - start
+            with _lock:
+                stats.wait.observe(elapsed)
+                stats.max_overflow_seen = max(stats.max_overflow_seen, _overflow(self))
+            return conn
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def _overflow(pool):
+    # QueuePool.overflow() pool to'lmaguncha manfiy (-pool_size dan boshlanadi)
+    return max(0, pool.overflow()) if hasattr(pool, "overflow") else 0
+
+
+# === So'rovlar ===
+
+def instrument_engine(engine, name=""):
+    """Sync Engine (yoki async_engine.sync_engine) ga so'rov vaqti hooklarini ulash"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        key = normalize_sql(statement)
+        with _lock:
+            _statement_hist(key).observe(elapsed)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            logger.warning(f"🐢 Sekin so'rov ({name}, {elapsed * 1000:.0f} ms): {key[:200]}")
+
+    @event.listens_for(engine, "handle_error")
+    def _error(ctx):
+        if ctx.statement:
+            key = normalize_sql(ctx.statement)
+            with _lock:
+                errors[key] = errors.get(key, 0) + 1
+
+
+# === Ko'rsatish ===
+
+def pool_summary():
+    out = {}
+    with _lock:
+        for name, st in pools.items():
+            p = st.pool
+            out[name] = {
+                "size": p.size() if p is not None and hasattr(p, "size") else 0,
+                "checked_out": p.checkedout() if p is not None and hasattr(p, "checkedout") else 0,
+                "overflow": _overflow(p) if p is not None else 0,
+                "max_overflow_seen": st.max_overflow_seen,
+                "checkouts": st.wait.count,
+                "timeouts": st.timeouts,
+                "wait_p50_ms": st.wait.quantile(0.5) * 1000,
+                "wait_p99_ms": st.wait.quantile(0.99) * 1000,
+                "wait_max_ms": st.wait.max * 1000,
+            }
+    return out
+
+
+def top_statements(n=10, by="total"):
+    """Eng ko'p vaqt olgan (by="total") yoki eng sekin (by="p95") so'rovlar"""
+    with _lock:
+        rows = [
+            {
+                "sql": sql, "count": h.count, "total_ms": h.total * 1000,
+                "avg_ms": h.total / h.count * 1000 if h.count else 0.0,
+                "p95_ms": h.quantile(0.95) * 1000, "max_ms": h.max * 1000,
+                "errors": errors.get(sql, 0),
+            }
+            for sql, h in statements.items()
+        ]
+    key = "total_ms" if by == "total" else "p95_ms"
+    return sorted(rows, key=lambda r: r[key], reverse=True)[:n]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _histogram_lines(metric, labels, hist):
+    lines = []
+    cumulative = 0
+    for bound, c in zip(BUCKETS, hist.counts):
+        cumulative += c
+        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {hist.count}')
+    lines.append(f"{metric}_sum{{{labels}}} {hist.total:.6f}")
+    lines.append(f"{metric}_count{{{labels}}} {hist.count}")
+    return lines
+
+
+def render_prometheus(extra_gauges=None):
+    """Prometheus matn formati (text/plain; version=0.0.4)"""
+    lines = [
+        "# HELP exambot_pool_checkout_seconds Pooldan ulanish olish vaqti",
+        "# TYPE exambot_pool_checkout_seconds histogram",
+    ]
+    summary = pool_summary()
+    with _lock:
+        for name, st in pools.items():
+            lines += _histogram_lines("exambot_pool_checkout_seconds", f'pool="{_label(name)}"', st.wait)
+    for metric, field, kind in (
+        ("exambot_pool_size", "size", "gauge"),
+        ("exambot_pool_checked_out", "checked_out", "gauge"),
+        ("exambot_pool_overflow", "overflow", "gauge"),
+        ("exambot_pool_overflow_max", "max_overflow_seen", "gauge"),
+        ("exambot_pool_timeouts_total", "timeouts", "counter"),
+    ):
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, info in summary.items():
+            lines.append(f'{metric}{{pool="{_label(name)}"}} {info[field]}')
+
+    lines += [
+        "# HELP exambot_query_seconds So'rov vaqti (normallashtirilgan SQL bo'yicha)",
+        "# TYPE exambot_query_seconds histogram",
+    ]
+    with _lock:
+        for sql, hist in statements.items():
+            lines += _histogram_lines("exambot_query_seconds", f'sql="{_label(sql)}"', hist)
+        lines.append("# TYPE exambot_query_errors_total counter")
+        for sql, count in errors.items():
+            lines.append(f'exambot_query_errors_total{{sql="{_label(sql)}"}} {count}')
+
+    for metric, value in (extra_gauges or {}).items():
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
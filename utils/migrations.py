@@ -0,0 +1,236 @@
+"""Versiyalangan sxema migratsiyalari.
+
+`Base.metadata.create_all` faqat yo'q jadvallarni yaratadi — mavjud jadvalga
+indeks qo'shmaydi va ustun turini o'zgartirmaydi. Shu sababli har bir sxema
+o'zgarishi bu yerda (version, name, up, down) ko'rinishida yoziladi va
+`schema_migrations` jadvalida qaysilari qo'llangani saqlanadi.
+
+init_db() har ishga tushishda `migrate()` ni chaqiradi. Qo'lda:
+
+    python -m utils.migrations            # oxirgi versiyagacha
+    python -m utils.migrations down 1     # 1-versiyagacha orqaga
+    python -m utils.migrations status
+"""
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+Migration = namedtuple("Migration", "version name up down")
+
+
+def _is_postgres(conn):
+    return conn.dialect.name == "postgresql"
+
+
+def _column_type(conn, table, column):
+    for col in inspect(conn).get_columns(table):
+        if col["name"] == column:
+            return str(col["type"]).upper()
+    return None
+
+
+# === 1: hot-path indekslar ===
+
+# (nom, jadval, ustunlar) — modellardagi __table_args__ bilan bir xil bo'lishi shart
+HOT_PATH_INDEXES = [
+    ("ix_user_results_user_completed", "user_results", "user_id, completed_at"),
+    ("ix_spaced_repetition_user_next_review", "spaced_repetition", "user_id, next_review"),
+    ("ix_wrong_answers_user_reviewed", "wrong_answers", "user_id, reviewed"),
+    ("ix_questions_subject_difficulty", "questions", "subject_id, difficulty"),
+    ("ix_flashcards_user_mastered", "flashcards", "user_id, mastered"),
+    ("ix_premium_subscriptions_user_active_end", "premium_subscriptions", "user_id, is_active, end_date"),
+]
+
+
+def _indexes_up(conn):
+    for name, table, columns in HOT_PATH_INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def _indexes_down(conn):
+    for name, _, _ in HOT_PATH_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+# === 2: spaced_repetition sanalari String(10) -> Date ===
+# SQLite da ustun turi faqat "affinity" — Date qiymatlari baribir 'YYYY-MM-DD'
+# matn sifatida saqlanadi, shuning uchun jadvalni qayta qurish shart emas;
+# faqat bo'sh satrlar NULL ga o'tkaziladi (aks holda Date o'qishda yiqiladi).
+
+_SR_DATE_COLUMNS = ("next_review", "last_reviewed")
+
+
+def _sr_dates_up(conn):
+    for column in _SR_DATE_COLUMNS:
+        if _is_postgres(conn):
+            if _column_type(conn, "spaced_repetition", column) == "DATE":
+                continue
+            conn.execute(text(
+                f"ALTER TABLE spaced_repetition ALTER COLUMN {column} TYPE DATE "
+                f"USING NULLIF({column}, '')::date"
+            ))
+        else:
+            conn.execute(text(f"UPDATE spaced_repetition SET {column} = NULL WHERE {column} = ''"))
+
+
+def _sr_dates_down(conn):
+    for column in _SR_DATE_COLUMNS:
+        if _is_postgres(conn):
+            if _column_type(conn, "spaced_repetition", column) != "DATE":
+                continue
+            conn.execute(text(
+                f"ALTER TABLE spaced_repetition ALTER COLUMN {column} TYPE VARCHAR(10) "
+                f"USING COALESCE(to_char({column}, 'YYYY-MM-DD'), '')"
+            ))
+        else:
+            conn.execute(text(f"UPDATE spaced_repetition SET {column} = '' WHERE {column} IS NULL"))
+
+
+# === 3: user_stats yig'indisini user_results dan to'ldirish ===
+
+def _user_stats_up(conn):
+    from sqlalchemy import case, func, select
+    from database import UserResult, UserStats
+
+    table = UserStats.__table__
+    table.create(conn, checkfirst=True)
+    existing = set(conn.execute(select(table.c.user_id)).scalars())
+
+    is_mock = case((UserResult.is_mock.is_(True), 1), else_=0)
+    mock_pct = case((UserResult.is_mock.is_(True), UserResult.percentage), else_=0.0)
+    rows = conn.execute(
+        select(
+            UserResult.user_id, UserResult.subject_id,
+            func.count(UserResult.id), func.sum(UserResult.percentage), func.max(UserResult.percentage),
+            func.sum(is_mock), func.max(mock_pct),
+        ).group_by(UserResult.user_id, UserResult.subject_id)
+    ).all()
+
+    users = {}
+    for user_id, subject_id, tests, total_pct, best, mocks, best_mock in rows:
+        if user_id in existing:
+            continue
+        u = users.setdefault(user_id, {
+            "user_id": user_id, "total_tests": 0, "sum_pct": 0.0, "mock_count": 0,
+            "best_pct": 0.0, "best_mock_pct": 0.0, "subjects": {}, "updated_at": datetime.utcnow(),
+        })
+        u["total_tests"] += tests
+        u["sum_pct"] += total_pct or 0.0
+        u["mock_count"] += mocks or 0
+        u["best_pct"] = max(u["best_pct"], best or 0.0)
+        u["best_mock_pct"] = max(u["best_mock_pct"], best_mock or 0.0)
+        u["subjects"][str(subject_id)] = [tests, total_pct or 0.0, best or 0.0]
+
+    if users:
+        conn.execute(table.insert(), list(users.values()))
+
+
+def _user_stats_down(conn):
+    conn.execute(text("DROP TABLE IF EXISTS user_stats"))
+
+
+# === 4: user_stats.version (webapp /api/stats ETag) ===
+
+def _user_stats_version_up(conn):
+    if _column_type(conn, "user_stats", "version") is None:
+        conn.execute(text("ALTER TABLE user_stats ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+    # Mavjud qatorlar: testlar soni — boshlang'ich versiya sifatida yetarli
+    conn.execute(text("UPDATE user_stats SET version = total_tests WHERE version = 0"))
+
+
+def _user_stats_version_down(conn):
+    if _column_type(conn, "user_stats", "version") is not None:
+        conn.execute(text("ALTER TABLE user_stats DROP COLUMN version"))
+
+
+# === 5: user_achievements (user_id, achievement_key) unique ===
+
+def _achievements_unique_up(conn):
+    # Avval poyga natijasida paydo bo'lgan dublikatlar (eng birinchisi qoladi)
+    conn.execute(text(
+        "DELETE FROM user_achievements WHERE id NOT IN ("
+        "SELECT MIN(id) FROM user_achievements GROUP BY user_id, achievement_key)"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_achievements_user_key "
+        "ON user_achievements (user_id, achievement_key)"
+    ))
+
+
+def _achievements_unique_down(conn):
+    conn.execute(text("DROP INDEX IF EXISTS uq_user_achievements_user_key"))
+
+
+MIGRATIONS = [
+    Migration(1, "hot_path_indexes", _indexes_up, _indexes_down),
+    Migration(2, "spaced_repetition_dates", _sr_dates_up, _sr_dates_down),
+    Migration(3, "user_stats_backfill", _user_stats_up, _user_stats_down),
+    Migration(4, "user_stats_version", _user_stats_version_up, _user_stats_version_down),
+    Migration(5, "user_achievements_unique", _achievements_unique_up, _achievements_unique_down),
+]
+
+
+# === Runner ===
+
+def _ensure_history(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(100) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(conn):
+    _ensure_history(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def migrate(engine, target=None):
+    """Sxemani `target` versiyaga keltirish (None — oxirgisi).
+
+    Har bir migratsiya alohida tranzaksiyada bajariladi; xato bo'lsa o'sha
+    qadam orqaga qaytariladi va istisno yuqoriga chiqadi.
+    """
+    if target is None:
+        target = MIGRATIONS[-1].version if MIGRATIONS else 0
+
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for m in MIGRATIONS:
+        if m.version <= target and m.version not in done:
+            with engine.begin() as conn:
+                m.up(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                    {"v": m.version, "n": m.name, "t": datetime.utcnow()},
+                )
+            applied.append(f"+{m.version} {m.name}")
+
+    for m in reversed(MIGRATIONS):
+        if m.version > target and m.version in done:
+            with engine.begin() as conn:
+                m.down(conn)
+                conn.execute(text("DELETE FROM schema_migrations WHERE version = :v"), {"v": m.version})
+            applied.append(f"-{m.version} {m.name}")
+
+    return applied
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    args = sys.argv[1:]
+    if args and args[0] == "status":
+        with engine.begin() as conn:
+            done = applied_versions(conn)
+        for m in MIGRATIONS:
+            print(f"{'✅' if m.version in done else '⬜'} {m.version:>3}  {m.name}")
+    else:
+        target = int(args[1]) if len(args) > 1 and args[0] == "down" else None
+        for step in migrate(engine, target) or ["Sxema allaqachon yangilangan"]:
+            print(step)
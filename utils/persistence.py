@@ -0,0 +1,355 @@
+"""Bot holati uchun PTB persistence — faqat o'zgargan foydalanuvchilar yoziladi.
+
+PicklePersistence har flush da hamma foydalanuvchining user_data sini bitta
+faylga qayta yozardi. `StatePersistence` esa har bir user/chat holatini
+alohida kalit sifatida saqlaydi:
+
+* `SQLStateStore` — `bot_state` jadvali (SQLite yoki Postgres, upsert);
+* `RedisStateStore` — RESP protokoli orqali HSET/HGETALL (Redis yoki unga
+  mos har qanday lokal server).
+
+Qaysi biri ishlatilishi `PERSISTENCE_URL` bilan tanlanadi (config.py).
+
+Bir nechta bot worker (`shared=True`): har bir update oldidan foydalanuvchi
+holati store dan qayta o'qiladi (`refresh_user_data`) va update dan keyin
+darhol yoziladi (`write_through`, PerUserUpdateProcessor.after_update) —
+aks holda worker boshqasining eski holatini o'qib, keyin uning quiz
+jarayonini ustidan yozardi. Bitta foydalanuvchining update lari bir vaqtda
+ikki workerga tushmasligi kerak (webhook da user bo'yicha yo'naltirish).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+from urllib.parse import urlparse
+
+from sqlalchemy import select, delete
+from telegram.ext import BasePersistence, PersistenceInput, PicklePersistence
+
+from config import DB_URL
+from database import BotState, get_async_session
+
+logger = logging.getLogger(__name__)
+
+LEGACY_PICKLE = "persistence.pickle"
+
+
+# === Saqlash backendlari ===
+
+class SQLStateStore:
+    """bot_state jadvali: (namespace, key) -> pickle bytes"""
+
+    def __init__(self):
+        if "postgresql" in DB_URL:
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        self._insert = insert
+
+    async def load(self, namespace):
+        async with get_async_session() as session:
+            rows = await session.execute(
+                select(BotState.key, BotState.value).where(BotState.namespace == namespace)
+            )
+            return {key: value for key, value in rows}
+
+    async def load_one(self, namespace, key):
+        async with get_async_session() as session:
+            return await session.scalar(
+                select(BotState.value).where(BotState.namespace == namespace, BotState.key == key)
+            )
+
+    async def save_many(self, items):
+        """items: {(namespace, key): bytes} — bitta tranzaksiyada upsert"""
+        if not items:
+            return
+        rows = [{"namespace": ns, "key": key, "value": value} for (ns, key), value in items.items()]
+        stmt = self._insert(BotState)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BotState.namespace, BotState.key],
+            set_={"value": stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+        )
+        async with get_async_session() as session:
+            await session.execute(stmt, rows)
+            await session.commit()
+
+    async def delete(self, namespace, key):
+        async with get_async_session() as session:
+            await session.execute(
+                delete(BotState).where(BotState.namespace == namespace, BotState.key == key)
+            )
+            await session.commit()
+
+    async def close(self):
+        pass
+
+
+class RedisStateStore:
+    """Minimal RESP mijoz: har bir namespace — bitta hash"""
+
+    def __init__(self, url, prefix="exambot:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ssl = parsed.scheme == "rediss"
+        self.prefix = prefix
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port, ssl=True if self.ssl else None
+        )
+        if self.password:
+            await self._roundtrip([["AUTH", self.password]])
+        if self.db:
+            await self._roundtrip([["SELECT", str(self.db)]])
+
+    @staticmethod
+    def _encode(args):
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis ulanishi uzildi")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = await self._reader.readexactly(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [await self._read_reply() for _ in range(size)]
+        raise RuntimeError(f"Noma'lum RESP javobi: {line!r}")
+
+    async def _roundtrip(self, commands):
+        self._writer.write(b"".join(self._encode(c) for c in commands))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    async def execute(self, *commands):
+        """Buyruqlarni pipeline qilib yuborish; javoblar ro'yxati qaytadi"""
+        async with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._roundtrip(commands)
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    await self._drop()
+                    if attempt == 2:
+                        raise
+
+    async def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def load(self, namespace):
+        (flat,) = await self.execute(["HGETALL", self.prefix + namespace])
+        flat = flat or []
+        return {flat[i].decode(): flat[i + 1] for i in range(0, len(flat), 2)}
+
+    async def load_one(self, namespace, key):
+        (value,) = await self.execute(["HGET", self.prefix + namespace, key])
+        return value
+
+    async def save_many(self, items):
+        by_ns = {}
+        for (ns, key), value in items.items():
+            by_ns.setdefault(ns, []).extend([key, value])
+        if by_ns:
+            await self.execute(*[["HSET", self.prefix + ns, *pairs] for ns, pairs in by_ns.items()])
+
+    async def delete(self, namespace, key):
+        await self.execute(["HDEL", self.prefix + namespace, key])
+
+    async def close(self):
+        async with self._lock:
+            await self._drop()
+
+
+# === PTB persistence ===
+
+class StatePersistence(BasePersistence):
+    """Kalit bo'yicha yoziladigan persistence.
+
+    PTB update_interval da faqat shu oraliqda update olgan foydalanuvchilar
+    uchun update_user_data chaqiradi; bu yerda esa pickle natijasi oxirgi
+    yozilgandan farq qilmasa, yozish ham o'tkazib yuboriladi. Bir vaqtda
+    kelgan chaqiruvlar bitta tranzaksiya/pipeline ga yig'iladi.
+    """
+
+    def __init__(self, store, shared=False, update_interval=60, legacy_pickle=LEGACY_PICKLE):
+        super().__init__(
+            store_data=PersistenceInput(callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.shared = shared
+        self.legacy_pickle = legacy_pickle
+        self._digests = {}     # (namespace, key) -> oxirgi yozilgan pickle hash
+        self._pending = {}
+        self._write_lock = asyncio.Lock()
+        self._migrated = False
+
+    # --- ichki ---
+
+    @staticmethod
+    def _dumps(obj):
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    async def _write(self, namespace, key, obj):
+        value = self._dumps(obj)
+        digest = hashlib.blake2b(value, digest_size=16).digest()
+        if self._digests.get((namespace, key)) == digest:
+            return
+        self._pending[(namespace, key)] = (value, digest)
+        async with self._write_lock:
+            if not self._pending:
+                return  # Boshqa chaqiruv allaqachon yozdi
+            batch, self._pending = self._pending, {}
+            try:
+                await self.store.save_many({k: v for k, (v, _) in batch.items()})
+            except Exception:
+                # Keyingi yozishda qayta urinish (yangiroq qiymat bo'lsa — o'sha qoladi)
+                self._pending = {**batch, **self._pending}
+                raise
+            for k, (_, d) in batch.items():
+                self._digests[k] = d
+
+    async def _load(self, namespace, key_type=int):
+        await self._migrate_legacy()
+        data = {}
+        for key, value in (await self.store.load(namespace)).items():
+            data[key_type(key)] = pickle.loads(value)
+            self._digests[(namespace, key)] = hashlib.blake2b(value, digest_size=16).digest()
+        return data
+
+    async def _migrate_legacy(self):
+        """Eski persistence.pickle bo'lsa — bir marta ko'chirib, faylni qayta nomlash"""
+        if self._migrated:
+            return
+        self._migrated = True
+        if not self.legacy_pickle or not os.path.exists(self.legacy_pickle):
+            return
+        if await self.store.load("user"):
+            return
+        with open(self.legacy_pickle, "rb") as f:
+            legacy = pickle.load(f)
+        items = {}
+        for uid, data in (legacy.get("user_data") or {}).items():
+            items[("user", str(uid))] = self._dumps(data)
+        for cid, data in (legacy.get("chat_data") or {}).items():
+            items[("chat", str(cid))] = self._dumps(data)
+        if legacy.get("bot_data"):
+            items[("bot", "")] = self._dumps(legacy["bot_data"])
+        for name, conv in (legacy.get("conversations") or {}).items():
+            for key, state in conv.items():
+                items[(f"conv:{name}", json.dumps(list(key)))] = self._dumps(state)
+        await self.store.save_many(items)
+        os.replace(self.legacy_pickle, self.legacy_pickle + ".migrated")
+        logger.info(f"♻️ {self.legacy_pickle} dan {len(items)} ta holat ko'chirildi")
+
+    # --- user / chat / bot ---
+
+    async def get_user_data(self):
+        return await self._load("user")
+
+    async def get_chat_data(self):
+        return await self._load("chat")
+
+    async def get_bot_data(self):
+        value = await self.store.load_one("bot", "")
+        return pickle.loads(value) if value else {}
+
+    async def update_user_data(self, user_id, data):
+        await self._write("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._write("chat", str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        await self._write("bot", "", data)
+
+    async def drop_user_data(self, user_id):
+        self._digests.pop(("user", str(user_id)), None)
+        await self.store.delete("user", str(user_id))
+
+    async def drop_chat_data(self, chat_id):
+        self._digests.pop(("chat", str(chat_id)), None)
+        await self.store.delete("chat", str(chat_id))
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Bir nechta worker rejimida boshqa worker yozgan holatni olish
+        if not self.shared:
+            return
+        value = await self.store.load_one("user", str(user_id))
+        if value is not None:
+            user_data.clear()
+            user_data.update(pickle.loads(value))
+            self._digests[("user", str(user_id))] = hashlib.blake2b(value, digest_size=16).digest()
+
+    async def write_through(self, user_id, user_data):
+        """shared rejim: update dan keyin holatni interval kutmasdan yozish"""
+        if self.shared:
+            await self._write("user", str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- conversations / callback data ---
+
+    async def get_conversations(self, name):
+        raw = await self.store.load(f"conv:{name}")
+        return {tuple(json.loads(k)): pickle.loads(v) for k, v in raw.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        ns, k = f"conv:{name}", json.dumps(list(key))
+        if new_state is None:
+            self._digests.pop((ns, k), None)
+            await self.store.delete(ns, k)
+        else:
+            await self._write(ns, k, new_state)
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        await self.store.close()
+
+
+def build_persistence(url, shared=False, update_interval=60):
+    """PERSISTENCE_URL bo'yicha persistence obyektini yaratish"""
+    if url == "pickle":
+        return PicklePersistence(filepath=LEGACY_PICKLE, update_interval=update_interval)
+    if url.startswith(("redis://", "rediss://")):
+        store = RedisStateStore(url)
+    else:
+        store = SQLStateStore()
+    return StatePersistence(store, shared=shared, update_interval=update_interval)
@@ -0,0 +1,110 @@
+"""Fon ishlari navbati — foydalanuvchi javobini kutdirmaydigan ishlar uchun.
+
+Test yakunida natija, streak va stats bitta tranzaksiyada yoziladi va ball
+darhol ko'rsatiladi; achievementlarni tekshirish va xabarnomalar esa shu
+navbatga qo'yiladi:
+
+    post_process.submit("achievements", check_and_award_achievements, user_id, context, stats)
+
+`POST_PROCESS_WORKERS` ta worker vazifalarni navbat bilan bajaradi. Xato
+bo'lsa vazifa 1, 2, 4... soniyadan keyin qayta urinadi (`POST_PROCESS_RETRIES`
+marta), keyin log ga yoziladi va tashlanadi. Bot to'xtaganda `stop()`
+navbatdagilarni bajarib bo'lishni kutadi.
+"""
+import asyncio
+import logging
+
+from config import POST_PROCESS_RETRIES, POST_PROCESS_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Qayta urinishlar orasidagi boshlang'ich kutish (soniya), har safar 2 barobar
+RETRY_DELAY = 1.0
+
+
+class PostProcessQueue:
+    def __init__(self, workers=POST_PROCESS_WORKERS, retries=POST_PROCESS_RETRIES):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self._queue = None
+        self._tasks = []
+        self._pending = set()   # qayta urinishni kutayotgan vazifalar
+        self.done = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        """Navbatdagi va qayta urinishni kutayotgan vazifalar soni"""
+        return (self._queue.qsize() if self._queue else 0) + len(self._pending)
+
+    def submit(self, name, func, *args, **kwargs):
+        """`func(*args, **kwargs)` (async) ni fonda bajarish"""
+        if not self._ensure_workers():
+            logger.warning(f"Post-process: event loop yo'q, '{name}' bajarilmadi")
+            return
+        self._queue.put_nowait((name, func, args, kwargs, 0))
+
+    def _ensure_workers(self):
+        if self._tasks and not all(t.done() for t in self._tasks):
+            return True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [
+            loop.create_task(self._worker(), name=f"post_process_{i}")
+            for i in range(self.workers)
+        ]
+        return True
+
+    async def _worker(self):
+        while True:
+            name, func, args, kwargs, attempt = await self._queue.get()
+            try:
+                await func(*args, **kwargs)
+                self.done += 1
+            except Exception as e:
+                if attempt < self.retries:
+                    delay = RETRY_DELAY * 2 ** attempt
+                    logger.warning(f"Post-process '{name}' xatosi ({e}), {delay:.0f} s dan keyin qayta")
+                    self._retry_later(delay, (name, func, args, kwargs, attempt + 1))
+                else:
+                    self.failed += 1
+                    logger.error(f"Post-process '{name}' {attempt + 1} urinishdan keyin bajarilmadi: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _retry_later(self, delay, item):
+        async def requeue():
+            await asyncio.sleep(delay)
+            self._queue.put_nowait(item)
+
+        task = asyncio.get_running_loop().create_task(requeue())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def join(self):
+        """Navbat (qayta urinishlar bilan) bo'shaguncha kutish"""
+        if self._queue is None:
+            return
+        while True:
+            await self._queue.join()
+            if not self._pending:
+                return
+            await asyncio.wait(list(self._pending))
+
+    async def stop(self, timeout=10):
+        """post_shutdown: qolgan vazifalarni `timeout` soniyagacha kutib, workerlarni to'xtatish"""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Post-process: {self.depth} ta vazifa bajarilmay qoldi")
+        for task in self._tasks + list(self._pending):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._pending, return_exceptions=True)
+        self._tasks = []
+
+
+post_process = PostProcessQueue()
@@ -0,0 +1,193 @@
+"""Savollar banki — `questions` jadvalining xotiradagi nusxasi.
+
+Bot ishga tushganda bir marta yuklanadi. Har bir (subject_id, difficulty)
+uchun ixcham id massivlari va o'zgarmas savol yozuvlari saqlanadi, shuning
+uchun test/speed/audio/takrorlash handlerlari savol tanlash va o'qish uchun
+DB ga murojaat qilmaydi. Import (utils/importer.py) commit qilgandan keyin
+faqat o'sha fan qayta yuklanadi.
+
+Yozuvlardagi `difficulty` — `question_stats` dagi kalibrlangan qiyinlik
+(utils/item_stats.py), u bo'lmasa importdagi qo'lda qo'yilgan qiymat.
+"""
+import random
+import threading
+from array import array
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from database import get_session, get_async_session, Subject, Question, QuestionStats
+
+
+class QuestionRecord(namedtuple(
+    "QuestionRecord", "id subject_id text text_uz options correct_answer difficulty"
+)):
+    """O'zgarmas savol yozuvi (ORM Question bilan bir xil atributlar)"""
+    __slots__ = ()
+
+    def get_options(self):
+        return dict(zip("abcd", self.options))
+
+
+SubjectRecord = namedtuple("SubjectRecord", "id name emoji description")
+
+
+def _to_record(q):
+    return QuestionRecord(
+        id=q.id,
+        subject_id=q.subject_id,
+        text=q.text,
+        text_uz=q.text_uz or "",
+        options=(q.option_a, q.option_b, q.option_c, q.option_d),
+        correct_answer=q.correct_answer,
+        difficulty=q.difficulty or 1,
+    )
+
+
+class QuestionBank:
+    """Jarayon bo'yicha yagona savollar keshi.
+
+    Yozish (load/reload_subject) lock ostida yangi obyektlarni quradi va
+    tayyor bo'lgach almashtiradi — o'qiydigan handlerlar lock olmaydi.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._questions = {}   # id -> QuestionRecord
+        self._subjects = {}    # id -> SubjectRecord
+        self._ids = {}         # (subject_id | None, difficulty | None) -> array("l")
+        self._manual = {}      # id -> importdagi qiyinlik
+        self._calibrated = {}  # id -> question_stats qiyinligi
+        self.loaded = False
+        self.version = 0
+
+    # === Yuklash ===
+
+    def load(self):
+        """Butun bankni DB dan yuklash (startup)"""
+        session = get_session()
+        try:
+            self._load(session)
+        finally:
+            session.close()
+
+    async def load_async(self):
+        """load() — async engine orqali (webapp_asgi.py)"""
+        async with get_async_session() as session:
+            await session.run_sync(self._load)
+
+    def _load(self, session):
+        subjects = session.scalars(select(Subject)).all()
+        questions = session.scalars(select(Question).order_by(Question.id)).all()
+        calibrated = dict(session.execute(
+            select(QuestionStats.question_id, QuestionStats.difficulty)
+            .where(QuestionStats.difficulty.isnot(None))
+        ).all())
+        with self._lock:
+            self._subjects = {s.id: SubjectRecord(s.id, s.name, s.emoji, s.description or "") for s in subjects}
+            self._manual = {q.id: q.difficulty or 1 for q in questions}
+            self._calibrated = calibrated
+            self._questions = {q.id: self._calibrate(_to_record(q)) for q in questions}
+            self._rebuild_index()
+            self.loaded = True
+            self.version += 1
+
+    def reload_subject(self, subject_id):
+        """Bitta fanni qayta yuklash (import commit qilgandan keyin)"""
+        if not self.loaded:
+            return
+        session = get_session()
+        try:
+            subject = session.get(Subject, subject_id)
+            questions = session.scalars(
+                select(Question).where(Question.subject_id == subject_id).order_by(Question.id)
+            ).all()
+            with self._lock:
+                subjects = dict(self._subjects)
+                if subject:
+                    subjects[subject.id] = SubjectRecord(
+                        subject.id, subject.name, subject.emoji, subject.description or ""
+                    )
+                else:
+                    subjects.pop(subject_id, None)
+                records = {qid: r for qid, r in self._questions.items() if r.subject_id != subject_id}
+                records.update((q.id, self._calibrate(_to_record(q))) for q in questions)
+                self._manual.update((q.id, q.difficulty or 1) for q in questions)
+                self._subjects = subjects
+                self._questions = records
+                self._rebuild_index()
+                self.version += 1
+        finally:
+            session.close()
+
+    def _calibrate(self, record):
+        difficulty = self._calibrated.get(record.id)
+        return record._replace(difficulty=difficulty) if difficulty else record
+
+    def apply_calibration(self, calibrated):
+        """Kalibrlangan qiyinliklarni qo'llash {id: 1|2|3}; o'zgarish bo'lsa True"""
+        if not self.loaded:
+            return False
+        with self._lock:
+            self._calibrated = dict(calibrated)
+            records = {}
+            changed = False
+            for qid, r in self._questions.items():
+                difficulty = self._calibrated.get(qid) or self._manual.get(qid, r.difficulty)
+                if difficulty != r.difficulty:
+                    r = r._replace(difficulty=difficulty)
+                    changed = True
+                records[qid] = r
+            if changed:
+                self._questions = records
+                self._rebuild_index()
+                self.version += 1
+            return changed
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _rebuild_index(self):
+        buckets = {}
+        for qid, r in self._questions.items():
+            for key in ((r.subject_id, r.difficulty), (r.subject_id, None), (None, r.difficulty), (None, None)):
+                buckets.setdefault(key, array("l")).append(qid)
+        self._ids = buckets
+
+    # === O'qish ===
+
+    def get(self, question_id):
+        self.ensure_loaded()
+        return self._questions.get(question_id)
+
+    def subject(self, subject_id):
+        self.ensure_loaded()
+        return self._subjects.get(subject_id)
+
+    def subject_by_name(self, name):
+        self.ensure_loaded()
+        for s in self._subjects.values():
+            if s.name == name:
+                return s
+        return None
+
+    def subjects(self):
+        self.ensure_loaded()
+        return sorted(self._subjects.values(), key=lambda s: s.name)
+
+    def ids(self, subject_id=None, difficulty=None):
+        """(fan, qiyinlik) bo'yicha id massivi; None — filtrsiz"""
+        self.ensure_loaded()
+        return self._ids.get((subject_id, difficulty), array("l"))
+
+    def count(self, subject_id=None, difficulty=None):
+        return len(self.ids(subject_id, difficulty))
+
+    def sample(self, k, subject_id=None, difficulty=None):
+        """k ta tasodifiy savol id si (mavjudidan ko'p bo'lsa — hammasi)"""
+        pool = self.ids(subject_id, difficulty)
+        return random.sample(pool, min(k, len(pool)))
+
+
+question_bank = QuestionBank()
@@ -0,0 +1,228 @@
+"""Chiquvchi Telegram so'rovlari navbati — token bucket limitlar va ustuvorlik.
+
+Handlerlar `reply_text` / `edit_message_text` / `send_message` ni to'g'ridan-
+to'g'ri chaqiradi; eslatmalar va adminlarga xabarlar siklda yuborilganda
+Telegram 429 (RetryAfter) qaytarardi va xabar `except: pass` da yo'qolardi.
+`OutboundRateLimiter` PTB ning `BaseRateLimiter` i sifatida bot.py da ulanadi
+va xabar yuboradigan/tahrirlaydigan barcha so'rovlarni boshqaradi:
+
+* har bir chat uchun bucket: shaxsiy chat — `RATE_LIMIT_CHAT`/s (kichik
+  burst bilan), guruh — `RATE_LIMIT_GROUP_PER_MINUTE`/daqiqa; foydalanuvchi
+  tugmasiga javoban xabarni tahrirlash (INTERACTIVE edit*) bu bucketdan
+  ozod — quiz/speed javoblari bir-birini kutmasin;
+* umumiy bucket — `RATE_LIMIT_GLOBAL`/s; tokenlarni bitta "pump" vazifasi
+  ustuvorlik tartibida beradi: INTERACTIVE (foydalanuvchiga javob) doim
+  BULK (eslatmalar, admin xabarlari, achievementlar) dan oldin;
+* RetryAfter kelsa hamma yuborish shuncha vaqtga to'xtatiladi va so'rov
+  `MAX_RETRIES` martagacha qayta yuboriladi.
+
+Ommaviy xabarlar ustuvorlikni `rate_limit_args` bilan bildiradi:
+
+    await context.bot.send_message(chat_id, text, rate_limit_args=BULK)
+
+Metrikalar (kutish vaqti, yuborilganlar, RetryAfter lar) — `stats()`,
+/admin_metrics da ko'rsatiladi.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import RATE_LIMIT_GLOBAL, RATE_LIMIT_CHAT, RATE_LIMIT_GROUP_PER_MINUTE
+from utils.metrics import Histogram
+from utils.update_processor import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BULK = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Shaxsiy chatga ketma-ket (kutmasdan) yuborish mumkin bo'lgan xabarlar
+CHAT_BURST = 3
+MAX_RETRIES = 3
+# Bucketlar soni shundan oshsa to'lgan (bo'sh turgan) chat bucketlari o'chiriladi
+MAX_CHAT_BUCKETS = 10_000
+
+# Limitlanadigan so'rovlar: xabar yuborish va tahrirlash (answerCallbackQuery,
+# getFile va h.k. — limitsiz)
+LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+# Interaktiv tahrirlar faqat umumiy bucketdan o'tadi (chat bucketi — yangi xabarlar uchun)
+CHAT_EXEMPT_PREFIXES = ("edit",)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """Keyingi token uchun kutish (soniya); 0 — hozir bor"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+def _seconds(retry_after):
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    def __init__(
+        self, global_rate=RATE_LIMIT_GLOBAL, chat_rate=RATE_LIMIT_CHAT,
+        group_per_minute=RATE_LIMIT_GROUP_PER_MINUTE, max_retries=MAX_RETRIES,
+    ):
+        self.chat_rate = chat_rate
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}               # chat_id -> TokenBucket
+        self._chat_locks = KeyedLocks()
+        self._heap = []                # (priority, seq, future)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._pump = None
+        self._paused_until = 0.0
+        # Metrikalar
+        self.wait = {p: Histogram() for p in PRIORITY_NAMES}
+        self.sent = {p: 0 for p in PRIORITY_NAMES}
+        self.retry_after = 0
+        self.retry_after_seconds = 0.0
+        self.failed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._pump:
+            self._pump.cancel()
+            try:
+                await self._pump
+            except asyncio.CancelledError:
+                pass
+            self._pump = None
+
+    # === Bucketlar ===
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if not b.full(now)}
+            group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = TokenBucket(self.group_rate, 1) if group else TokenBucket(self.chat_rate, CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _take_chat(self, chat_id):
+        # Bitta chat ichida FIFO: qulf ostida token kutiladi
+        async with self._chat_locks(chat_id):
+            bucket = self._chat_bucket(chat_id)
+            while (delay := bucket.delay(time.monotonic())) > 0:
+                await asyncio.sleep(delay)
+            bucket.take()
+
+    async def _take_global(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.get_running_loop().create_task(self._run_pump(), name="rate_limiter")
+        else:
+            self._wakeup.set()
+        await future
+
+    async def _run_pump(self):
+        """Umumiy tokenlarni ustuvorlik (keyin kelish) tartibida tarqatish"""
+        while True:
+            while self._heap and self._heap[0][2].done():
+                heapq.heappop(self._heap)  # bekor qilingan so'rovlar
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            delay = max(self._paused_until - now, self._global.delay(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                self._global.take()
+                future.set_result(None)
+
+    # === BaseRateLimiter ===
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = BULK if rate_limit_args == BULK else INTERACTIVE
+        limited = endpoint.startswith(LIMITED_PREFIXES)
+        chat_id = data.get("chat_id")
+        per_chat = chat_id is not None and not (
+            priority == INTERACTIVE and endpoint.startswith(CHAT_EXEMPT_PREFIXES)
+        )
+
+        for attempt in range(self.max_retries + 1):
+            if limited:
+                started = time.monotonic()
+                if per_chat:
+                    await self._take_chat(chat_id)
+                await self._take_global(priority)
+                self.wait[priority].observe(time.monotonic() - started)
+            else:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                seconds = _seconds(e.retry_after)
+                self.retry_after += 1
+                self.retry_after_seconds += seconds
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                logger.warning(f"Telegram RetryAfter {seconds:.0f} s ({endpoint}, chat {chat_id}), qayta urinish")
+                continue
+            if limited:
+                self.sent[priority] += 1
+            return result
+
+    # === Metrikalar ===
+
+    def stats(self):
+        return {
+            "queued": sum(1 for _, _, f in self._heap if not f.done()),
+            "chat_buckets": len(self._chats),
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+            "retry_after": self.retry_after,
+            "retry_after_seconds": self.retry_after_seconds,
+            "failed": self.failed,
+            "priorities": {
+                name: {
+                    "sent": self.sent[p],
+                    "wait_p50_ms": self.wait[p].quantile(0.5) * 1000,
+                    "wait_p99_ms": self.wait[p].quantile(0.99) * 1000,
+                    "wait_max_ms": self.wait[p].max * 1000,
+                }
+                for p, name in PRIORITY_NAMES.items()
+            },
+        }
+
+
+rate_limiter = OutboundRateLimiter()
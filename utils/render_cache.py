@@ -0,0 +1,128 @@
+"""Savol xabarlari keshi — tayyor HTML matn va javob klaviaturasi.
+
+Test, speed, takrorlash va xatolar rejimlari bir xil savolni har safar
+qaytadan f-string bilan yig'ib, yangi InlineKeyboardMarkup yaratardi. Bu
+yerda (question_id, tarjima, rejim) bo'yicha savolning o'zgarmas qismi bir
+marta yig'iladi; handler faqat "3/10" hisoblagichini qo'shadi:
+
+    r = render_cache.get(qid, mode="quiz", translation=True)
+    text = header + r.text(idx + 1, total)
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=r.markup)
+
+Bot ishga tushganda `warm()` test rejimi uchun hamma savolni tayyorlaydi,
+qolgan rejimlar birinchi murojaatda to'ldiriladi. Import fan savollarini
+qayta yuklaganda `invalidate(subject_id)` o'sha fan yozuvlarini tashlaydi
+va `warm(subject_id)` qayta tayyorlaydi. Import `asyncio.to_thread` da
+ishlaydi, handlerlar esa event loop da `get()` qiladi — shuning uchun
+lug'atlar faqat qulf ostida o'zgartiriladi, yangi yozuvlar esa qulfdan
+tashqarida yig'ilib, keyin qo'shiladi.
+PTB TelegramObject lari o'zgarmas, shuning uchun bitta markup barcha
+foydalanuvchilar o'rtasida bo'lishiladi. Tugmalar callback_data si rejimni
+o'z ichiga oladi (`ans_<rejim>_<id>_<harf>`).
+"""
+import threading
+from collections import namedtuple
+
+from config import TIME_PER_QUESTION, TIME_PER_QUESTION_MOCK
+from keyboards.inline import answer_keyboard
+from utils.question_bank import question_bank
+
+DIFF_EMOJI = {1: "🟢", 2: "🟡", 3: "🔴"}
+MODES = ("quiz", "mock", "speed", "spaced", "mistake")
+
+
+class Rendered(namedtuple("Rendered", "head body markup subject_id")):
+    __slots__ = ()
+
+    def text(self, number, total):
+        """Tayyor matn: head + "number/total" + body"""
+        return f"{self.head}{number}/{total}{self.body}"
+
+
+def _options_block(q):
+    a, b, c, d = q.options
+    return (
+        f"❓ {q.text}\n\n"
+        f"🅰️ <b>A)</b> {a}\n"
+        f"🅱️ <b>B)</b> {b}\n"
+        f"🅲 <b>C)</b> {c}\n"
+        f"🅳 <b>D)</b> {d}"
+    )
+
+
+def _render(q, mode, translation):
+    block = _options_block(q)
+    if mode in ("quiz", "mock"):
+        seconds = TIME_PER_QUESTION_MOCK if mode == "mock" else TIME_PER_QUESTION
+        head = "📌 <b>Savol "
+        body = f"</b> {DIFF_EMOJI.get(q.difficulty, '⭐')}\n⏱️ {seconds} soniya\n\n{block}"
+        if translation and q.text_uz:
+            body += f"\n\n🌐 <i>{q.text_uz}</i>"
+    elif mode == "speed":
+        head = "⚡ <b>Speed #"
+        body = f"</b>\n\n{block}"
+    else:
+        s = question_bank.subject(q.subject_id)
+        subject_line = f"Bo'lim: {s.emoji} {s.name}" if s else "Bo'lim: —"
+        head = "🧠 <b>Takrorlash " if mode == "spaced" else "🔄 <b>Xato #"
+        body = f"</b>\n{subject_line}\n\n{block}"
+    return head, body
+
+
+class RenderCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # (question_id, translation, mode) -> Rendered
+        self._markups = {}   # (question_id, rejim) -> InlineKeyboardMarkup
+
+    def get(self, question_id, mode="quiz", translation=False):
+        """Rendered yoki savol topilmasa None"""
+        key = (question_id, bool(translation), mode)
+        entry = self._entries.get(key)
+        if entry is None:
+            q = question_bank.get(question_id)
+            if q is None:
+                return None
+            entry = self._build(q, mode, bool(translation))
+            with self._lock:
+                entry = self._entries.setdefault(key, entry)
+        return entry
+
+    def _build(self, q, mode, translation):
+        # Mock test ham oddiy test handleriga boradi
+        tag = "quiz" if mode == "mock" else mode
+        markup = self._markups.get((q.id, tag))
+        if markup is None:
+            markup = answer_keyboard(q.id, tag)
+            with self._lock:
+                markup = self._markups.setdefault((q.id, tag), markup)
+        head, body = _render(q, mode, translation)
+        return Rendered(head, body, markup, q.subject_id)
+
+    def warm(self, subject_id=None):
+        """Test rejimi (tarjimali va tarjimasiz) uchun savollarni tayyorlash"""
+        built = {}
+        for qid in question_bank.ids(subject_id):
+            q = question_bank.get(qid)
+            if q is None:
+                continue
+            for translation in (False, True):
+                built[(qid, translation, "quiz")] = self._build(q, "quiz", translation)
+        with self._lock:
+            self._entries = {**self._entries, **built}
+
+    def invalidate(self, subject_id=None):
+        """Fan (yoki hamma) yozuvlarini tashlash; o'chirilgan savollar ham ketadi"""
+        with self._lock:
+            if subject_id is None:
+                self._entries, self._markups = {}, {}
+                return
+            stale = {k[0] for k, e in self._entries.items() if e.subject_id == subject_id}
+            self._entries = {k: e for k, e in self._entries.items() if k[0] not in stale}
+            self._markups = {k: m for k, m in self._markups.items() if k[0] not in stale}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+render_cache = RenderCache()
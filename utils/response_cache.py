@@ -0,0 +1,172 @@
+"""Web API javoblari keshi — savollar banki versiyasi bo'yicha tayyor baytlar.
+
+`/api/subjects` har bir fan uchun COUNT, `/api/questions/<id>` esa har
+so'rovda barcha savollarni JSON ga aylantirardi, holbuki bu ma'lumot faqat
+admin import qilganda o'zgaradi. Endi javob bir marta yig'iladi va
+saqlanadi: JSON baytlari, gzip va (brotli o'rnatilgan bo'lsa) br variantlari
+hamda har biri uchun kuchli ETag.
+
+Kontent versiyasi `app_state` da (`CONTENT_VERSION_KEY`): import va savol
+statistikasi (kalibrlangan qiyinlik) uni o'z tranzaksiyasida oshiradi.
+Webapp jarayoni versiyani `API_CACHE_CHECK_INTERVAL` soniyada bir tekshiradi;
+o'zgargan bo'lsa savollar bankini qayta yuklaydi va keshni tozalaydi. Bot
+ham shu versiyani `content_refresh_job` bilan kuzatadi — boshqa jarayon
+(import_dtm.py, admin import) qo'shgan savollar bot bankiga ham tushadi.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from config import API_CACHE_CHECK_INTERVAL
+from database import get_async_session, get_session, get_state, set_state
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONTENT_VERSION_KEY = "content_version"
+
+# Bundan kichik javoblar siqilmaydi
+MIN_COMPRESS = 256
+
+
+def bump_content_version(session):
+    """Savollar/fanlar o'zgardi — versiyani oshirish (commit chaqiruvchida)"""
+    set_state(session, CONTENT_VERSION_KEY, int(get_state(session, CONTENT_VERSION_KEY, "0") or 0) + 1)
+
+
+class Entry(namedtuple("Entry", "version variants etags")):
+    """variants: kodlash ("identity" | "gzip" | "br") -> baytlar; etags: kodlash -> ETag"""
+    __slots__ = ()
+
+    def pick(self, accept_encoding):
+        """Mijoz qabul qiladigan eng ixcham variant: (kodlash, baytlar)"""
+        accepted = {part.split(";")[0].strip() for part in (accept_encoding or "").lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return "identity", self.variants["identity"]
+
+
+def _encode(version, data):
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    variants = {"identity": body}
+    if len(body) >= MIN_COMPRESS:
+        variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            variants["br"] = brotli.compress(body, quality=11)
+    digest = hashlib.sha1(body).hexdigest()[:16]
+    etags = {
+        encoding: f"{version}-{digest}" + ("" if encoding == "identity" else f"-{encoding}")
+        for encoding in variants
+    }
+    return Entry(version, variants, etags)
+
+
+class ResponseCache:
+    def __init__(self, check_interval=API_CACHE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.version = None
+        self._checked = 0.0
+        self._refresh = None
+        self.hits = 0
+        self.builds = 0
+
+    def _due(self):
+        return self.version is None or time.monotonic() - self._checked >= self.check_interval
+
+    def ensure_fresh(self):
+        """Kontent versiyasini tekshirish (interval da bir marta); o'zgargan bo'lsa
+        savollar banki qayta yuklanadi va kesh tozalanadi"""
+        from utils.question_bank import question_bank
+
+        if not self._due():
+            return
+        session = get_session()
+        try:
+            version = int(get_state(session, CONTENT_VERSION_KEY, "0") or 0)
+        finally:
+            session.close()
+        with self._lock:
+            self._checked = time.monotonic()
+            if version == self.version and question_bank.loaded:
+                return
+            question_bank.load()
+            self._apply(version)
+
+    async def ensure_fresh_async(self):
+        """ensure_fresh() — async engine orqali (webapp_asgi.py)"""
+        from utils.question_bank import question_bank
+
+        if not self._due():
+            return
+        # Parallel so'rovlar bitta tekshiruvni kutadi
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._refresh_async(question_bank))
+        try:
+            await asyncio.shield(self._refresh)
+        finally:
+            if self._refresh is not None and self._refresh.done():
+                self._refresh = None
+
+    async def _refresh_async(self, question_bank):
+        async with get_async_session() as session:
+            version = int(await session.run_sync(get_state, CONTENT_VERSION_KEY, "0") or 0)
+        self._checked = time.monotonic()
+        if version == self.version and question_bank.loaded:
+            return
+        await question_bank.load_async()
+        with self._lock:
+            self._apply(version)
+
+    def _apply(self, version):
+        self._entries = {}
+        self.version = version
+
+    def get(self, key, build):
+        """`key` uchun tayyor Entry; yo'q bo'lsa `build()` natijasidan quriladi
+        (oldin ensure_fresh / ensure_fresh_async chaqirilgan bo'lishi kerak)"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == self.version:
+            self.hits += 1
+            return entry
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != self.version:
+                entry = self._entries[key] = _encode(self.version, build())
+                self.builds += 1
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self.version = None
+
+
+response_cache = ResponseCache()
+
+
+async def content_refresh_job(context):
+    """JobQueue (bot): kontent versiyasi o'zgarsa — bank qayta yuklanadi, render keshi yangilanadi"""
+    from utils.render_cache import render_cache
+
+    before = response_cache.version
+    try:
+        await response_cache.ensure_fresh_async()
+    except Exception as e:
+        logger.error(f"Kontent versiyasini tekshirib bo'lmadi: {e}")
+        return
+    if response_cache.version != before:
+        render_cache.invalidate()
+        render_cache.warm()
+        logger.info(f"📚 Savollar banki yangilandi (kontent versiyasi {response_cache.version})")
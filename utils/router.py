@@ -0,0 +1,140 @@
+"""Callback va menyu tugmalari uchun yagona marshrutlash.
+
+Har bir tugma bosilishida PTB ~50 ta `CallbackQueryHandler(pattern=...)`
+regexini ketma-ket sinab chiqardi. Bu yerda esa:
+
+* aniq callback_data (`"back_subjects"`) — lug'atdan bitta qidiruv;
+* prefiksli callback_data (`"subject_"`, `"lb_"`) — belgilar trie si bo'ylab
+  bitta o'tish, eng uzun mos prefiks tanlanadi;
+* menyu tugmasi matni — lug'atdan bitta qidiruv.
+
+Prefiks marshrutlari argument turlarini ham tekshiradi: qolgan qism "_"
+bo'yicha bo'linadi va har bir bo'lak `int`, `str` yoki ruxsat etilgan
+qiymatlar to'plami (tuple) bilan tekshiriladi. Oxirgi argument qolgan
+hamma qismni oladi (masalan `"1_month"`). Natija `context.args` ga
+yoziladi. Mos kelmagan callback jim `query.answer()` bilan yopiladi.
+
+    router = Router()
+    router.callback("back_subjects", back_to_subjects_callback)
+    router.callback("diff_", difficulty_selected_callback, int, ("easy", "medium", "hard", "all"))
+    router.text("📚 Bo'limlar", subjects_command)
+    router.install(app)
+"""
+import logging
+
+from telegram.ext import CallbackQueryHandler, MessageHandler, filters
+
+logger = logging.getLogger(__name__)
+
+_ROUTE = None  # trie tugunidagi marshrut kaliti
+
+
+def _parse(rest, spec):
+    """`rest` ni spec bo'yicha tekshirib, argumentlar ro'yxatini qaytarish (mos kelmasa None)"""
+    if spec is None:
+        return [rest] if rest else []
+    if not spec:
+        return [] if not rest else None
+    parts = rest.split("_", len(spec) - 1)
+    if len(parts) != len(spec):
+        return None
+    args = []
+    for part, kind in zip(parts, spec):
+        if kind is int:
+            if not part.isdigit():
+                return None
+            args.append(int(part))
+        elif isinstance(kind, tuple):
+            if part not in kind:
+                return None
+            args.append(part)
+        elif not part:
+            return None
+        else:
+            args.append(part)
+    return args
+
+
+class _TextIn(filters.MessageFilter):
+    """Xabar matni lug'at kalitlaridan biri (regex siz, O(1))"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        super().__init__(name="Router.text")
+
+    def filter(self, message):
+        return message.text in self.texts
+
+
+class Router:
+    def __init__(self):
+        self._exact = {}      # callback_data -> handler
+        self._trie = {}       # belgi -> tugun; tugun[None] = (prefix, handler, spec)
+        self._texts = {}      # tugma matni -> handler
+
+    # === Ro'yxatdan o'tkazish ===
+
+    def callback(self, key, handler, *spec, any_suffix=False):
+        """`key` "_" bilan tugasa — prefiks marshrut, aks holda aniq moslik.
+
+        `spec` — prefiksdan keyingi bo'laklar turlari; `any_suffix=True`
+        bo'lsa qolgan qism tekshirilmaydi (handler o'zi ajratadi).
+        """
+        if not key.endswith("_"):
+            self._exact[key] = handler
+            return
+        node = self._trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[_ROUTE] = (key, handler, None if any_suffix else spec)
+
+    def text(self, text, handler):
+        self._texts[text] = handler
+
+    # === Qidirish ===
+
+    def resolve(self, data):
+        """(handler, args) yoki (None, None)"""
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, []
+        node, best = self._trie, None
+        for ch in data:
+            node = node.get(ch)
+            if node is None:
+                break
+            if _ROUTE in node:
+                best = node[_ROUTE]
+        # Eng uzun prefiks mos kelmasa qisqaroqlari sinalmaydi: prefikslar
+        # bir-birining ichida bo'lsa (fc_ / fc_reveal_) uzunrog'i aniqroq
+        if best is not None:
+            prefix, handler, spec = best
+            args = _parse(data[len(prefix):], spec)
+            if args is not None:
+                return handler, args
+        return None, None
+
+    async def dispatch_callback(self, update, context):
+        query = update.callback_query
+        handler, args = self.resolve(query.data or "")
+        if handler is None:
+            logger.debug(f"Marshrut topilmadi: {query.data!r}")
+            await query.answer()
+            return
+        context.args = args
+        await handler(update, context)
+
+    async def dispatch_text(self, update, context):
+        handler = self._texts.get(update.effective_message.text)
+        if handler is not None:
+            await handler(update, context)
+
+    def install(self, app, group=0):
+        """Ikkita PTB handler: barcha callback lar va menyu tugmalari"""
+        app.add_handler(CallbackQueryHandler(self.dispatch_callback), group=group)
+        if self._texts:
+            # Faqat yangi xabarlar: tahrirlangan xabarda update.message yo'q (handlerlar unga javob yozadi)
+            app.add_handler(
+                MessageHandler(filters.UpdateType.MESSAGE & _TextIn(self._texts), self.dispatch_text),
+                group=group,
+            )
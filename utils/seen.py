@@ -0,0 +1,211 @@
+"""Foydalanuvchi ko'rgan savollar — takrorlanmaydigan savol tanlash uchun.
+
+Har bir foydalanuvchi uchun question.id bo'yicha ikkita bitset saqlanadi:
+`current` (joriy aylanishda ko'rilgan) va `previous` (oldingi aylanishda).
+Tanlashda savollar uch darajaga bo'linadi: hech ko'rilmagan -> oldingi
+aylanishda ko'rilgan -> yaqinda ko'rilgan. Pool (fan/qiyinlik) dagi
+yaqinda ko'rilmaganlar yetmay qolsa, faqat shu pool ning bitlari
+`current` dan `previous` ga o'tkaziladi — boshqa fanlar tarixi saqlanadi.
+
+Tanlash pooldan tasodifiy `k * PROBE_FACTOR` tagacha id tekshiradi, shuning
+uchun narxi savollar banki hajmiga bog'liq emas. Pool ni aylantirish O(n),
+lekin u pool dagi savollarning deyarli hammasi ko'rilgandagina bo'ladi.
+
+Bitsetlar xotirada keshlanadi (birinchi murojaatda bitta SELECT),
+o'zgarganlari esa `SEEN_FLUSH_INTERVAL` da bir marta `seen_questions`
+jadvaliga upsert qilinadi. Bot to'xtaganda `flush()` qolganini yozadi;
+kutilmagan to'xtashda oxirgi belgilar yo'qolishi mumkin — bu faqat
+afzallik, xolos.
+"""
+import logging
+import random
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from config import DB_URL, SEEN_CACHE_SIZE
+from database import SeenQuestions, get_async_session
+from utils.question_bank import question_bank
+
+logger = logging.getLogger(__name__)
+
+# Bitta tanlash uchun tekshiriladigan tasodifiy id lar soni: k * PROBE_FACTOR
+PROBE_FACTOR = 8
+
+FRESH, OLDER, RECENT = 0, 1, 2
+
+
+def _test(bits, i):
+    byte = i >> 3
+    return byte < len(bits) and bits[byte] >> (i & 7) & 1
+
+
+def _set(bits, i):
+    byte = i >> 3
+    if byte >= len(bits):
+        bits.extend(bytes(byte + 1 - len(bits)))
+    bits[byte] |= 1 << (i & 7)
+
+
+def _clear(bits, i):
+    byte = i >> 3
+    if byte < len(bits):
+        bits[byte] &= ~(1 << (i & 7)) & 0xFF
+
+
+class SeenSet:
+    """Bitta foydalanuvchining ikki avlodli bitseti"""
+    __slots__ = ("current", "previous")
+
+    def __init__(self, current=b"", previous=b""):
+        self.current = bytearray(current or b"")
+        self.previous = bytearray(previous or b"")
+
+    def tier(self, qid):
+        if _test(self.current, qid):
+            return RECENT
+        if _test(self.previous, qid):
+            return OLDER
+        return FRESH
+
+    def mark(self, qids):
+        for qid in qids:
+            _set(self.current, qid)
+
+    def rotate(self, pool):
+        """Pool dagi yaqinda ko'rilganlarni oldingi aylanishga o'tkazish"""
+        for qid in pool:
+            if _test(self.current, qid):
+                _clear(self.current, qid)
+                _set(self.previous, qid)
+
+    def pick(self, pool, k):
+        """pool dan k ta id: avval yangilari, keyin eskiroq ko'rilganlari.
+
+        Qaytadi: (ids, exhausted) — exhausted=True bo'lsa pool da yaqinda
+        ko'rilmagan savollar k tadan kam topildi.
+        """
+        n = len(pool)
+        if n <= k:
+            ids = list(pool)
+            random.shuffle(ids)
+            return ids, any(self.tier(q) == RECENT for q in ids)
+
+        tiers = ([], [], [])
+        probed = set()
+        for _ in range(k * PROBE_FACTOR):
+            qid = pool[random.randrange(n)]
+            if qid in probed:
+                continue
+            probed.add(qid)
+            tiers[self.tier(qid)].append(qid)
+            if len(tiers[FRESH]) >= k:
+                break
+
+        ids = (tiers[FRESH] + tiers[OLDER] + tiers[RECENT])[:k]
+        # Juda kam ehtimol: takroriy tekshiruvlar sabab k ga yetmadi
+        while len(ids) < k:
+            qid = pool[random.randrange(n)]
+            if qid not in probed:
+                probed.add(qid)
+                ids.append(qid)
+        random.shuffle(ids)
+        return ids, len(tiers[FRESH]) + len(tiers[OLDER]) < k
+
+
+class SeenTracker:
+    def __init__(self, max_users=SEEN_CACHE_SIZE):
+        self.max_users = max_users
+        self._cache = OrderedDict()   # user_id -> SeenSet (LRU)
+        self._dirty = set()
+        if "postgresql" in DB_URL:
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        self._insert = insert
+
+    async def get(self, user_id):
+        seen = self._cache.get(user_id)
+        if seen is not None:
+            self._cache.move_to_end(user_id)
+            return seen
+        async with get_async_session() as session:
+            row = await session.scalar(select(SeenQuestions).filter_by(user_id=user_id).limit(1))
+        # await paytida parallel chaqiruv allaqachon yuklagan bo'lishi mumkin
+        seen = self._cache.get(user_id)
+        if seen is None:
+            seen = SeenSet(row.current, row.previous) if row else SeenSet()
+            self._cache[user_id] = seen
+            self._evict()
+        return seen
+
+    def _evict(self):
+        # O'zgargan (hali yozilmagan) foydalanuvchilar keshdan chiqarilmaydi
+        for user_id in list(self._cache):
+            if len(self._cache) <= self.max_users:
+                break
+            if user_id not in self._dirty:
+                del self._cache[user_id]
+
+    async def sample(self, user_id, k, subject_id=None, difficulty=None):
+        """question_bank.sample o'rniga: ko'rilmagan savollarni afzal ko'radi va belgilaydi"""
+        pool = question_bank.ids(subject_id, difficulty)
+        if not pool or k <= 0:
+            return []
+        seen = await self.get(user_id)
+        ids, exhausted = seen.pick(pool, k)
+        if exhausted:
+            seen.rotate(pool)
+        seen.mark(ids)
+        self._dirty.add(user_id)
+        return ids
+
+    def peek(self, user_id):
+        """Keshdagi SeenSet yoki None (DB ga murojaatsiz)"""
+        return self._cache.get(user_id)
+
+    def mark(self, user_id, qids):
+        """Savollarni ko'rilgan deb belgilash (bitset oldin get() bilan yuklangan bo'lsa)"""
+        seen = self._cache.get(user_id)
+        if seen is not None:
+            seen.mark(qids)
+            self._dirty.add(user_id)
+
+    async def flush(self):
+        """O'zgargan bitsetlarni bitta tranzaksiyada yozish"""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        rows = [
+            {"user_id": uid, "current": bytes(s.current), "previous": bytes(s.previous)}
+            for uid in dirty
+            if (s := self._cache.get(uid)) is not None
+        ]
+        stmt = self._insert(SeenQuestions)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SeenQuestions.user_id],
+            set_={
+                "current": stmt.excluded.current,
+                "previous": stmt.excluded.previous,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+        try:
+            async with get_async_session() as session:
+                await session.execute(stmt, rows)
+                await session.commit()
+        except Exception:
+            self._dirty |= dirty
+            raise
+        return len(rows)
+
+
+seen_questions = SeenTracker()
+
+
+async def seen_flush_job(context):
+    """JobQueue: o'zgargan bitsetlarni yozish"""
+    try:
+        await seen_questions.flush()
+    except Exception as e:
+        logger.error(f"Seen bitset flush xatosi: {e}")
@@ -0,0 +1,109 @@
+"""Parallel update lar — foydalanuvchi bo'yicha tartib saqlangan holda.
+
+PTB standart holatda update larni ketma-ket bajaradi: bitta foydalanuvchining
+sekin nutq tahlili yoki PDF yaratishi hammaning test tugmalarini kutdiradi.
+`PerUserUpdateProcessor` turli foydalanuvchilar update larini parallel
+(`CONCURRENT_UPDATES` tagacha) bajaradi, bitta foydalanuvchinikini esa
+qat'iy kelish tartibida — quiz/speed/spaced holati `user_data` da
+qulfsiz o'qiladi va o'zgartiriladi.
+
+Navbat avval foydalanuvchi qulfida, keyin umumiy semaforda kutiladi:
+bitta foydalanuvchining ko'p tugma bosishi worker o'rinlarini band qilmaydi.
+Update dan tashqarida `user_data` ni o'zgartiradigan kod (savol taymerlari —
+utils/deadlines.py) ham shu qulfni oladi:
+
+    async with user_locks(user_id):
+        ...
+
+`after_update` (ixtiyoriy) update qayta ishlangandan keyin, hali qulf
+ostida chaqiriladi — bir nechta worker rejimida holatni darhol yozish uchun
+(bot.py, PERSISTENCE_SHARED).
+"""
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Asosiy semafor faqat kutayotgan update lar sonini cheklaydi; haqiqiy
+# parallellik — foydalanuvchi qulfidan keyingi `_workers` semaforida
+BACKLOG_FACTOR = 16
+
+
+class KeyedLocks:
+    """Kalit bo'yicha asyncio.Lock; kutayotgani qolmagan qulf o'chiriladi"""
+
+    def __init__(self):
+        self._locks = {}   # kalit -> [Lock, foydalanuvchilar soni]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __call__(self, key):
+        return _KeyedLock(self, key)
+
+
+class _KeyedLock:
+    __slots__ = ("owner", "key")
+
+    def __init__(self, owner, key):
+        self.owner, self.key = owner, key
+
+    async def __aenter__(self):
+        entry = self.owner._locks.get(self.key)
+        if entry is None:
+            entry = self.owner._locks[self.key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release_ref(entry)
+            raise
+
+    async def __aexit__(self, *exc):
+        entry = self.owner._locks[self.key]
+        entry[0].release()
+        self._release_ref(entry)
+
+    def _release_ref(self, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.owner._locks[self.key]
+
+
+user_locks = KeyedLocks()
+
+
+def update_key(update):
+    """Tartib kaliti: foydalanuvchi, bo'lmasa chat; aniqlab bo'lmasa None"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates, after_update=None):
+        super().__init__(max_concurrent_updates * BACKLOG_FACTOR)
+        self.workers = max_concurrent_updates
+        self.after_update = after_update    # async (update) -> None
+        self._workers = asyncio.Semaphore(max_concurrent_updates)
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+        async with user_locks(key), self._workers:
+            await coroutine
+            if self.after_update is not None:
+                await self.after_update(update)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,105 @@
+"""user_stats — foydalanuvchi natijalarining yig'indisi.
+
+Har bir UserResult qo'shilganda o'sha tranzaksiyada `record_result` (webapp)
+yoki `record_result_async` (bot) chaqiriladi, shuning uchun stats ekranlari,
+achievementlar va web dashboard butun tarixni emas, bitta qatorni o'qiydi.
+Commit chaqiruvchining vazifasi.
+"""
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database import UserStats
+
+
+def apply_result(stats, subject_id, percentage, is_mock):
+    """Bitta natijani yig'indiga qo'shish (DB ga murojaatsiz)"""
+    stats.total_tests = (stats.total_tests or 0) + 1
+    stats.sum_pct = (stats.sum_pct or 0.0) + percentage
+    stats.best_pct = max(stats.best_pct or 0.0, percentage)
+    if is_mock:
+        stats.mock_count = (stats.mock_count or 0) + 1
+        stats.best_mock_pct = max(stats.best_mock_pct or 0.0, percentage)
+
+    # JSON ustun o'zgarishini SQLAlchemy sezishi uchun yangi dict
+    subjects = dict(stats.subjects or {})
+    tests, total_pct, best = subjects.get(str(subject_id), (0, 0.0, 0.0))
+    subjects[str(subject_id)] = [tests + 1, total_pct + percentage, max(best, percentage)]
+    stats.subjects = subjects
+    stats.version = (stats.version or 0) + 1
+    stats.updated_at = datetime.utcnow()
+
+
+def subject_rows(stats):
+    """[(subject_id, tests, avg_pct, best_pct)] — subject_id bo'yicha tartiblangan"""
+    rows = []
+    for sid, (tests, total_pct, best) in (stats.subjects or {}).items():
+        rows.append((int(sid), tests, total_pct / tests if tests else 0.0, best))
+    return sorted(rows)
+
+
+def _new_stats(user_id):
+    return UserStats(
+        user_id=user_id, total_tests=0, sum_pct=0.0, mock_count=0,
+        best_pct=0.0, best_mock_pct=0.0, subjects={}, version=0,
+    )
+
+
+def _locked(user_id):
+    # Postgres da bir vaqtdagi bot/webapp yozuvlari bir-birini yo'qotmasligi uchun
+    return select(UserStats).filter_by(user_id=user_id).with_for_update().limit(1)
+
+
+def _get_or_create(session, user_id):
+    stats = session.scalar(_locked(user_id))
+    if stats:
+        return stats
+    try:
+        with session.begin_nested():
+            stats = _new_stats(user_id)
+            session.add(stats)
+        return stats
+    except IntegrityError:
+        # Parallel so'rov qatorni birinchi yaratdi
+        return session.scalar(_locked(user_id))
+
+
+async def _get_or_create_async(session, user_id):
+    stats = await session.scalar(_locked(user_id))
+    if stats:
+        return stats
+    try:
+        async with session.begin_nested():
+            stats = _new_stats(user_id)
+            session.add(stats)
+        return stats
+    except IntegrityError:
+        return await session.scalar(_locked(user_id))
+
+
+def record_result(session, result):
+    """Sync sessiya (webapp) — UserResult qo'shilgan tranzaksiya ichida chaqiriladi"""
+    stats = _get_or_create(session, result.user_id)
+    apply_result(stats, result.subject_id, result.percentage, bool(result.is_mock))
+    return stats
+
+
+def record_results(session, user_id, rows):
+    """Sync sessiya — bitta foydalanuvchining bir nechta natijasi (dict lar, /api/sync)
+    bitta qulflangan yig'indi qatoriga qo'shiladi"""
+    stats = _get_or_create(session, user_id)
+    for row in rows:
+        apply_result(stats, row["subject_id"], row["percentage"], bool(row.get("is_mock")))
+    return stats
+
+
+async def record_result_async(session, result):
+    """Async sessiya (bot) — UserResult qo'shilgan tranzaksiya ichida chaqiriladi"""
+    stats = await _get_or_create_async(session, result.user_id)
+    apply_result(stats, result.subject_id, result.percentage, bool(result.is_mock))
+    return stats
+
+
+async def get_user_stats(session, user_id):
+    return await session.scalar(select(UserStats).filter_by(user_id=user_id).limit(1))
@@ -0,0 +1,474 @@
+"""Web API ning freymvorkka bog'liq bo'lmagan qismi.
+
+Flask (webapp_server.py) va ASGI (webapp_asgi.py) serverlari bir xil JSON
+shartnomalarini shu yerdan oladi: funksiyalar so'rov obyektini emas, oddiy
+qiymatlarni (`args` — `.get()` li mapping) qabul qiladi, DB so'rovlari esa
+`select` iboralari sifatida qaytariladi — server ularni o'zining sync yoki
+async sessiyasida bajaradi.
+
+Savollar va fanlar xotiradagi savollar bankidan olinadi; uni yangilab turish
+(`response_cache.ensure_fresh[_async]`) va reytingni tail qilish
+(`leaderboard.ensure_fresh[_async]`) chaqiruvchining vazifasi.
+
+`apply_sync` (POST /api/sync) sync sessiya oladi — ASGI varianti uni
+`AsyncSession.run_sync` orqali chaqiradi.
+"""
+import json
+import random
+import zlib
+from bisect import bisect_right
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import DailyStreak, Flashcard, PremiumSubscription, SyncEvent, UserResult, UserStats
+from utils.leaderboard import WEBAPP_NAME, leaderboard
+from utils.question_bank import question_bank
+from utils.user_stats import record_results, subject_rows
+
+# === Fanlar va savollar (v1) ===
+
+def subjects_json():
+    return [
+        {
+            'id': s.id,
+            'name': s.name,
+            'emoji': s.emoji,
+            'description': s.description,
+            'question_count': question_bank.count(s.id),
+        }
+        for s in sorted(question_bank.subjects(), key=lambda s: s.id)
+    ]
+
+
+def questions_json(subject_id):
+    result = []
+    for qid in question_bank.ids(subject_id):
+        q = question_bank.get(qid)
+        result.append({
+            'id': q.id,
+            'text': q.text,
+            'options': q.get_options(),
+            'correct': q.correct_answer,
+            'difficulty': q.difficulty,
+        })
+    return result
+
+
+# === v2: sahifalash, maydon tanlash, server tomonda tanlash ===
+# To'g'ri javob v2 da yuborilmaydi — check_answers() tekshiradi
+
+V2_FIELDS = ('id', 'subject_id', 'text', 'text_uz', 'options', 'difficulty')
+V2_DEFAULT_FIELDS = ('id', 'text', 'options', 'difficulty')
+V2_PAGE_SIZE, V2_MAX_PAGE_SIZE = 50, 200
+V2_MAX_SAMPLE = 50
+MAX_CHECK_ANSWERS = 100
+
+V2_EMPTY = {'items': [], 'total': 0, 'next_cursor': None}
+
+_V2_GETTERS = {
+    'id': lambda q: q.id,
+    'subject_id': lambda q: q.subject_id,
+    'text': lambda q: q.text,
+    'text_uz': lambda q: q.text_uz,
+    'options': lambda q: q.get_options(),
+    'difficulty': lambda q: q.difficulty,
+}
+
+
+def _int_arg(args, key, default=None):
+    # Flask `type=int` kabi: noto'g'ri qiymat — standart qiymat
+    try:
+        return int(args.get(key))
+    except (TypeError, ValueError):
+        return default
+
+
+def v2_params(args):
+    """(fields, difficulties, sample, cursor, limit); noto'g'ri parametrda ValueError"""
+    raw = args.get('fields')
+    fields = tuple(f.strip() for f in raw.split(',') if f.strip()) if raw else V2_DEFAULT_FIELDS
+    unknown = [f for f in fields if f not in V2_FIELDS]
+    if unknown:
+        raise ValueError(f"noma'lum maydon: {', '.join(unknown)}")
+    if 'id' not in fields:
+        fields = ('id',) + fields
+
+    raw = args.get('difficulty') or ''
+    try:
+        difficulties = sorted({int(d) for d in raw.split(',') if d.strip() and d.strip() != '0'})
+    except ValueError:
+        raise ValueError("difficulty: 1, 2, 3 yoki ularning ro'yxati")
+    if any(d not in (1, 2, 3) for d in difficulties):
+        raise ValueError("difficulty: 1, 2, 3 yoki ularning ro'yxati")
+
+    sample = _int_arg(args, 'sample')
+    cursor = _int_arg(args, 'cursor', 0)
+    limit = min(max(_int_arg(args, 'limit', V2_PAGE_SIZE), 1), V2_MAX_PAGE_SIZE)
+    return fields, difficulties, sample, cursor, limit
+
+
+def _v2_pool(subject_id, difficulties):
+    """Filtrlangan id lar, o'sish tartibida (kursor shu tartibda)"""
+    if not difficulties:
+        return question_bank.ids(subject_id)
+    if len(difficulties) == 1:
+        return question_bank.ids(subject_id, difficulties[0])
+    return sorted(qid for d in difficulties for qid in question_bank.ids(subject_id, d))
+
+
+def _v2_items(ids, fields):
+    getters = [(f, _V2_GETTERS[f]) for f in fields]
+    items = []
+    for qid in ids:
+        q = question_bank.get(qid)
+        if q:
+            items.append({f: get(q) for f, get in getters})
+    return items
+
+
+def v2_sample(subject_id, fields, difficulties, k):
+    pool = _v2_pool(subject_id, difficulties)
+    k = min(max(k, 1), V2_MAX_SAMPLE)
+    return {'items': _v2_items(random.sample(pool, min(k, len(pool))), fields), 'total': len(pool)}
+
+
+def v2_page(subject_id, fields, difficulties, cursor, limit):
+    pool = _v2_pool(subject_id, difficulties)
+    start = bisect_right(pool, cursor)
+    page = pool[start:start + limit]
+    more = start + limit < len(pool)
+    return {
+        'items': _v2_items(page, fields),
+        'total': len(pool),
+        'next_cursor': page[-1] if more else None,
+    }
+
+
+def v2_etag(version, query_string):
+    """Sahifa faqat so'rov parametrlari va kontent versiyasiga bog'liq (zaif ETag qiymati)"""
+    return f"{version}-{zlib.crc32(query_string):08x}"
+
+
+def check_answers(data):
+    """{"answers": [{"id": 12, "answer": "b"}, ...]} — javob null bo'lsa (vaqt tugadi) ham
+    to'g'ri javob qaytariladi; noto'g'ri so'rovda ValueError"""
+    answers = (data or {}).get('answers') if isinstance(data, dict) else None
+    if not isinstance(answers, list) or not answers:
+        raise ValueError("answers ro'yxati kerak")
+    if len(answers) > MAX_CHECK_ANSWERS:
+        raise ValueError(f"ko'pi bilan {MAX_CHECK_ANSWERS} ta javob")
+
+    results, score = [], 0
+    for item in answers:
+        qid = item.get('id') if isinstance(item, dict) else None
+        q = question_bank.get(qid) if isinstance(qid, int) else None
+        answer = item.get('answer') if isinstance(item, dict) else None
+        correct = q is not None and isinstance(answer, str) and answer.lower() == q.correct_answer
+        score += correct
+        results.append({
+            'id': qid,
+            'correct': correct,
+            'correct_answer': q.correct_answer if q else None,
+        })
+    return {'results': results, 'score': score, 'total': len(results)}
+
+
+# === Natijalar va statistika ===
+
+def new_result(data):
+    """POST /api/results tanasidan UserResult (record_result bilan birga qo'shiladi)"""
+    return UserResult(
+        user_id=data['user_id'],
+        username='webapp',
+        full_name=WEBAPP_NAME,
+        subject_id=data['subject_id'],
+        score=data['score'],
+        total=data['total'],
+        percentage=data['percentage'],
+        is_mock=data.get('is_mock', False),
+    )
+
+
+def band(avg_pct):
+    if avg_pct >= 90: return '8.0+'
+    if avg_pct >= 75: return '7.0'
+    if avg_pct >= 60: return '6.0'
+    if avg_pct >= 40: return '5.0'
+    return '4.0'
+
+
+def leaderboard_section(user_id):
+    """Top-10 va foydalanuvchi o'rni — xotiradagi reytingdan (DB siz)"""
+    rows = [
+        {'name': name or 'Foydalanuvchi', 'avg': round(avg, 1)}
+        for _, name, avg, _ in leaderboard.top(10)
+    ]
+    pos = leaderboard.position(user_id)
+    my_rank = {
+        'rank': pos[0], 'total': pos[1], 'percentile': round(pos[2], 1),
+    } if pos else None
+    return rows, my_rank
+
+
+def stats_row_query(user_id):
+    """1-so'rov: yig'indi + streak (user_id bo'yicha unique indekslar)"""
+    return (
+        select(UserStats, DailyStreak.current_streak)
+        .outerjoin(DailyStreak, DailyStreak.user_id == UserStats.user_id)
+        .where(UserStats.user_id == user_id)
+        .limit(1)
+    )
+
+
+def recent_results_query(user_id):
+    """2-so'rov: trend va tarix uchun oxirgi 30 ta natija (user_id, completed_at indeksi)"""
+    return (
+        select(
+            UserResult.subject_id, UserResult.score, UserResult.total,
+            UserResult.percentage, UserResult.completed_at,
+        )
+        .where(UserResult.user_id == user_id)
+        .order_by(UserResult.completed_at.desc())
+        .limit(30)
+    )
+
+
+def stats_etag(user_id, stats, streak, leaderboard_rows, my_rank):
+    """user_stats.version (har natijada +1), streak va reyting bo'limi (zaif ETag qiymati)"""
+    board = json.dumps([leaderboard_rows, my_rank], sort_keys=True).encode()
+    return f"{user_id}-{stats.version if stats else 0}-{streak}-{zlib.crc32(board):08x}"
+
+
+def stats_payload(stats, streak, recent_results, leaderboard_rows, my_rank):
+    chart_trend = [
+        {'date': r.completed_at.strftime('%d.%m'), 'pct': round(r.percentage)}
+        for r in reversed(recent_results)
+    ]
+
+    total_tests = stats.total_tests if stats else 0
+    avg_pct = round(stats.avg_pct, 1) if total_tests > 0 else 0
+
+    # Subject performance (Radar Chart data)
+    subject_stats = []
+    for sid, _, avg, _ in (subject_rows(stats) if stats else []):
+        subj = question_bank.subject(sid)
+        if subj:
+            subject_stats.append({
+                'name': subj.name,
+                'emoji': subj.emoji,
+                'avg': round(avg, 1),
+            })
+
+    # History list
+    history = []
+    for r in recent_results[:10]:
+        subj = question_bank.subject(r.subject_id)
+        history.append({
+            'subject': subj.name if subj else '?',
+            'emoji': subj.emoji if subj else '📚',
+            'score': r.score,
+            'total': r.total,
+            'percentage': round(r.percentage),
+            'date': r.completed_at.strftime('%d.%m.%Y') if r.completed_at else '',
+        })
+
+    return {
+        'total_tests': total_tests,
+        'avg_percentage': avg_pct,
+        'avg_band': band(avg_pct),
+        'streak': streak,
+        'subject_stats': subject_stats,
+        'history': history,
+        'leaderboard': leaderboard_rows,
+        'my_rank': my_rank,
+        'chart_trend': chart_trend,
+    }
+
+
+# === Flashcardlar va premium ===
+
+def flashcards_query(user_id):
+    return select(Flashcard).filter_by(user_id=user_id)
+
+
+def flashcards_payload(cards):
+    total = len(cards)
+    mastered = sum(1 for c in cards if c.mastered)
+    card_list = [
+        {
+            'id': c.id,
+            'front': c.front,
+            'back': c.back,
+            'example': c.example or '',
+            'mastered': c.mastered,
+        }
+        for c in cards if not c.mastered
+    ]
+    return {
+        'total': total,
+        'mastered': mastered,
+        'learning': total - mastered,
+        'cards': card_list[:50],
+    }
+
+
+def apply_flashcard_response(card, data):
+    """Karta javobi; o'zgarish bo'lsa True (commit chaqiruvchida)"""
+    if card and card.user_id == data.get('user_id') and data.get('response') == 'knew':
+        card.mastered = True
+        return True
+    return False
+
+
+def premium_expiry_query(user_id):
+    return (
+        select(PremiumSubscription.end_date)
+        .filter_by(user_id=user_id, is_active=True)
+        .order_by(PremiumSubscription.end_date.desc())
+        .limit(1)
+    )
+
+
+# === Sinxronlash (POST /api/sync) ===
+# {"user_id": 1, "events": [{"id": "<uuid>", "type": "result" | "flashcard", "data": {...}}]}
+# Hodisalar bitta tranzaksiyada qo'llanadi; id lar sync_events da saqlanadi,
+# shuning uchun javobi yo'qolgan partiyani mijoz bemalol qayta yuboradi.
+
+MAX_SYNC_EVENTS = 200
+MAX_EVENT_ID = 64
+FLASHCARD_RESPONSES = ('knew', 'review')
+
+
+def _sync_result(data, now):
+    subject_id, score, total = data.get('subject_id'), data.get('score'), data.get('total')
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in (subject_id, score, total)):
+        raise ValueError("subject_id, score, total butun son bo'lishi kerak")
+    if question_bank.subject(subject_id) is None:
+        raise ValueError("fan topilmadi")
+    if total <= 0 or not 0 <= score <= total:
+        raise ValueError("score/total noto'g'ri")
+    percentage = data.get('percentage')
+    if not isinstance(percentage, (int, float)) or isinstance(percentage, bool) or not 0 <= percentage <= 100:
+        percentage = score / total * 100
+
+    # Offline yechilgan test — mijoz vaqti (kelajakdagi vaqt qabul qilinmaydi)
+    completed_at = now
+    if isinstance(data.get('completed_at'), str):
+        try:
+            parsed = datetime.fromisoformat(data['completed_at'].replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError("completed_at ISO formatda bo'lishi kerak")
+        if parsed.tzinfo is not None:
+            parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+        completed_at = min(parsed, now)
+
+    return {
+        'subject_id': subject_id,
+        'score': score,
+        'total': total,
+        'percentage': float(percentage),
+        'is_mock': bool(data.get('is_mock', False)),
+        'completed_at': completed_at,
+    }
+
+
+def _sync_flashcard(data):
+    card_id, response = data.get('card_id'), data.get('response')
+    if not isinstance(card_id, int) or isinstance(card_id, bool):
+        raise ValueError("card_id butun son bo'lishi kerak")
+    if response not in FLASHCARD_RESPONSES:
+        raise ValueError(f"response: {', '.join(FLASHCARD_RESPONSES)}")
+    return card_id, response
+
+
+def _sync_events(payload):
+    if not isinstance(payload, dict):
+        raise ValueError("JSON obyekt kerak")
+    user_id, events = payload.get('user_id'), payload.get('events')
+    if not isinstance(user_id, int) or isinstance(user_id, bool) or user_id <= 0:
+        raise ValueError("user_id kerak")
+    if not isinstance(events, list) or not events:
+        raise ValueError("events ro'yxati kerak")
+    if len(events) > MAX_SYNC_EVENTS:
+        raise ValueError(f"ko'pi bilan {MAX_SYNC_EVENTS} ta hodisa")
+    return user_id, events
+
+
+def _apply_sync_once(session, user_id, events):
+    now = datetime.utcnow()
+    applied, duplicates, rejected = [], [], []
+    seen = set()
+    valid = []
+    for event in events:
+        event_id = event.get('id') if isinstance(event, dict) else None
+        if not isinstance(event_id, str) or not 0 < len(event_id) <= MAX_EVENT_ID:
+            rejected.append({'id': event_id if isinstance(event_id, str) else None, 'error': "id noto'g'ri"})
+            continue
+        if event_id in seen:
+            duplicates.append(event_id)
+            continue
+        seen.add(event_id)
+        valid.append(event)
+
+    existing = set(session.scalars(
+        select(SyncEvent.event_id)
+        .where(SyncEvent.user_id == user_id, SyncEvent.event_id.in_(list(seen)))
+    )) if seen else set()
+
+    results, knew, done = [], set(), []
+    for event in valid:
+        event_id, kind, data = event['id'], event.get('type'), event.get('data')
+        if event_id in existing:
+            duplicates.append(event_id)
+            continue
+        try:
+            if not isinstance(data, dict):
+                raise ValueError("data obyekt bo'lishi kerak")
+            if kind == 'result':
+                results.append(_sync_result(data, now))
+            elif kind == 'flashcard':
+                card_id, response = _sync_flashcard(data)
+                if response == 'knew':
+                    knew.add(card_id)
+            else:
+                raise ValueError(f"noma'lum tur: {kind}")
+        except ValueError as e:
+            rejected.append({'id': event_id, 'error': str(e)})
+            continue
+        done.append({'user_id': user_id, 'event_id': event_id, 'kind': kind, 'received_at': now})
+        applied.append(event_id)
+
+    if results:
+        rows = [
+            dict(r, user_id=user_id, username='webapp', full_name=WEBAPP_NAME)
+            for r in results
+        ]
+        session.execute(insert(UserResult), rows)
+        record_results(session, user_id, rows)
+    if knew:
+        # Faqat shu foydalanuvchining kartalari
+        session.execute(
+            update(Flashcard)
+            .where(Flashcard.id.in_(sorted(knew)), Flashcard.user_id == user_id)
+            .values(mastered=True)
+        )
+    if done:
+        session.execute(insert(SyncEvent), done)
+    session.commit()
+    return {'ok': True, 'applied': applied, 'duplicates': duplicates, 'rejected': rejected}
+
+
+def apply_sync(session, payload):
+    """Partiyani bitta tranzaksiyada qo'llash; noto'g'ri so'rovda ValueError.
+
+    Javob: applied / duplicates (oldin qo'llangan) / rejected (xato — qayta yuborilmaydi).
+    Bir vaqtda kelgan bir xil partiya PK ga uriladi — qayta o'qib, takrorlar o'tkazib yuboriladi.
+    """
+    user_id, events = _sync_events(payload)
+    try:
+        return _apply_sync_once(session, user_id, events)
+    except IntegrityError:
+        session.rollback()
+        return _apply_sync_once(session, user_id, events)
@@ -0,0 +1,123 @@
+"""Write-behind bufer — faqat qo'shiladigan (append-only) qatorlar uchun.
+
+Javob berish yo'lidagi INSERT lar (WrongAnswer va h.k.) handler ichida commit
+qilinmaydi: `write_behind.add(Model, {...})` qatorni navbatga qo'yadi, fon
+vazifasi esa ularni jadval bo'yicha guruhlab bitta ko'p qatorli INSERT bilan
+yozadi — navbat `WRITE_BEHIND_BATCH` ga yetganda yoki har
+`WRITE_BEHIND_INTERVAL` soniyada. Bot to'xtaganda `stop()` qolganini yozadi.
+
+Shu qatorlarni o'qiydigan handlerlar avval `await write_behind.flush()`
+chaqiradi (navbat bo'sh bo'lsa hech narsa qilmaydi).
+"""
+import asyncio
+import logging
+from collections import deque
+
+from sqlalchemy import insert
+
+from config import WRITE_BEHIND_BATCH, WRITE_BEHIND_INTERVAL
+from database import get_async_session
+
+logger = logging.getLogger(__name__)
+
+# Xato bo'lsa qatorlar navbatga qaytariladi; shuncha urinishdan keyin tashlanadi
+MAX_ATTEMPTS = 5
+
+
+class WriteBehindBuffer:
+    def __init__(self, max_batch=WRITE_BEHIND_BATCH, interval=WRITE_BEHIND_INTERVAL):
+        self.max_batch = max_batch
+        self.interval = interval
+        self._queue = deque()          # (table, row, attempts)
+        self._wakeup = None
+        self._flush_lock = None
+        self._task = None
+        self.flushed = 0
+        self.dropped = 0
+
+    @property
+    def depth(self):
+        """Hali yozilmagan qatorlar soni"""
+        return len(self._queue)
+
+    def add(self, model, row):
+        """`model` — ORM klass yoki Table; `row` — ustun qiymatlari (dict)"""
+        table = getattr(model, "__table__", model)
+        self._queue.append((table, row, 0))
+        self._ensure_task()
+        if len(self._queue) >= self.max_batch and self._wakeup:
+            self._wakeup.set()
+
+    def _ensure_task(self):
+        if self._task and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Event loop yo'q — keyingi flush() yozadi
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = loop.create_task(self._run(), name="write_behind")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush xatosi: {e}")
+
+    async def flush(self):
+        """Navbatdagi hamma qatorni yozish; yozilganlar sonini qaytaradi"""
+        if not self._queue:
+            return 0
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            written = 0
+            while self._queue:
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+                by_table = {}
+                for table, row, attempts in batch:
+                    by_table.setdefault(table, []).append((row, attempts))
+                try:
+                    async with get_async_session() as session:
+                        for table, items in by_table.items():
+                            await session.execute(insert(table), [row for row, _ in items])
+                        await session.commit()
+                except Exception:
+                    self._requeue(by_table)
+                    raise
+                written += len(batch)
+            self.flushed += written
+            return written
+
+    def _requeue(self, by_table):
+        retry = []
+        for table, items in by_table.items():
+            for row, attempts in items:
+                if attempts + 1 >= MAX_ATTEMPTS:
+                    self.dropped += 1
+                else:
+                    retry.append((table, row, attempts + 1))
+        self._queue.extendleft(reversed(retry))
+        if self.dropped:
+            logger.warning(f"Write-behind: {self.dropped} ta qator yozilmay tashlandi")
+
+    async def stop(self):
+        """Fon vazifasini to'xtatib, qolgan qatorlarni yozish (post_shutdown)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+write_behind = WriteBehindBuffer()
@@ -48,6 +48,13 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     document.getElementById('loading').classList.add('hidden');
     document.getElementById('app').classList.remove('hidden');
+
+    // Oldingi (offline) sessiyadan qolgan hodisalar — API ishga tushganda ham yuboriladi
+    flushSync();
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') flushSync();
+    });
+    window.addEventListener('online', () => flushSync());
 });
 
 // === Tab Switching ===
@@ -78,6 +85,114 @@ async function apiFetch(endpoint) {
     }
 }
 
+// v2 savollarida to'g'ri javob yo'q — server tekshiradi
+async function checkAnswers(answers) {
+    try {
+        const res = await fetch(`${API_BASE}/answers/check`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ user_id: userId, answers }),
+        });
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        return (await res.json()).results;
+    } catch (e) {
+        console.error('Check error:', e);
+        return null;
+    }
+}
+
+async function resolveCorrect(q, selected) {
+    if (!q.correct) {
+        const results = await checkAnswers([{ id: q.id, answer: selected }]);
+        q.correct = results?.[0]?.correct_answer || null;
+    }
+    return q.correct;
+}
+
+// === Sinxronlash navbati (/api/sync) ===
+// Natijalar va flashcard javoblari localStorage dagi navbatga yoziladi va
+// bitta so'rovda yuboriladi; tarmoq bo'lmasa keyingi ochilishda yuboriladi.
+// Har bir hodisa id si server tomonda takrorlanishdan himoya qiladi.
+// Navbat static rejimda ham yoziladi: ishga tushishda API javob bermagan
+// bo'lsa (offline), yuborishdan oldin u qayta tekshiriladi.
+const SYNC_KEY = 'ielts_sync_outbox';
+const SYNC_BATCH = 200;
+const SYNC_MAX = 2000; // API umuman yo'q joyda (GitHub Pages) navbat cheksiz o'smasin
+let syncTimer = null;
+let syncInFlight = null;
+
+function readOutbox() {
+    try { return JSON.parse(localStorage.getItem(SYNC_KEY)) || []; }
+    catch (e) { return []; }
+}
+
+function writeOutbox(events) {
+    try { localStorage.setItem(SYNC_KEY, JSON.stringify(events.slice(-SYNC_MAX))); }
+    catch (e) { console.error('Outbox error:', e); }
+}
+
+function newEventId() {
+    if (window.crypto?.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+function queueSync(type, data, delay = 0) {
+    if (!userId) return;
+    const events = readOutbox();
+    events.push({ id: newEventId(), user_id: userId, type, data });
+    writeOutbox(events);
+    clearTimeout(syncTimer);
+    // Ketma-ket flashcard javoblari bitta partiyaga yig'iladi
+    syncTimer = setTimeout(flushSync, delay);
+}
+
+// Static rejimda: API qaytdimi (/health)
+async function syncReachable() {
+    if (!isStaticMode) return true;
+    try {
+        const res = await fetch(window.location.origin + '/health', { signal: AbortSignal.timeout(5000) });
+        return res.ok;
+    } catch (e) {
+        return false;
+    }
+}
+
+async function flushSync() {
+    if (!userId) return;
+    if (syncInFlight) return syncInFlight;
+    syncInFlight = (async () => {
+        try {
+            if (!readOutbox().some(e => e.user_id === userId)) return;
+            if (!(await syncReachable())) return;
+            while (true) {
+                const batch = readOutbox().filter(e => e.user_id === userId).slice(0, SYNC_BATCH);
+                if (batch.length === 0) return;
+                const res = await fetch(`${API_BASE}/sync`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        user_id: userId,
+                        events: batch.map(({ id, type, data }) => ({ id, type, data })),
+                    }),
+                    keepalive: true,
+                });
+                const body = res.status === 400 ? null : await res.json();
+                if (res.status !== 400 && (!res.ok || !body.ok)) throw new Error(body?.error || `HTTP ${res.status}`);
+                // Qo'llangan, takror va rad etilganlar navbatdan chiqariladi (400 — butun partiya yaroqsiz)
+                const sent = new Set(batch.map(e => e.id));
+                writeOutbox(readOutbox().filter(e => !sent.has(e.id)));
+                if (body?.rejected?.length) console.warn('Sync rejected:', body.rejected);
+                if (batch.length < SYNC_BATCH) return;
+            }
+        } catch (e) {
+            console.warn('Sync deferred:', e.message);
+        } finally {
+            syncInFlight = null;
+        }
+    })();
+    return syncInFlight;
+}
+
 async function loadStaticJSON(filename) {
     try {
         const res = await fetch(`data/${filename}`);
@@ -131,12 +246,17 @@ function selectDifficulty(level) {
 }
 
 async function startDailyChallenge() {
-    // Mix questions from all subjects
+    // Mix questions from all subjects (API: server 10 tasini tanlaydi)
     let allQuestions = [];
-    for (const s of allSubjects) {
-        let data = await apiFetch(`/questions/${s.id}`);
-        if (!data) data = await loadStaticJSON(`questions_${s.id}.json`);
-        if (data) allQuestions = allQuestions.concat(data.map(q => ({ ...q, subjectEmoji: s.emoji })));
+    const sampled = await apiFetch('/v2/questions?sample=10&fields=id,subject_id,text,options,difficulty');
+    if (sampled) {
+        const emojis = Object.fromEntries(allSubjects.map(s => [s.id, s.emoji]));
+        allQuestions = sampled.items.map(q => ({ ...q, subjectEmoji: emojis[q.subject_id] }));
+    } else {
+        for (const s of allSubjects) {
+            const data = await loadStaticJSON(`questions_${s.id}.json`);
+            if (data) allQuestions = allQuestions.concat(data.map(q => ({ ...q, subjectEmoji: s.emoji })));
+        }
     }
     if (allQuestions.length === 0) { showToast('❌', 'Savollar topilmadi!'); return; }
 
@@ -151,15 +271,21 @@ async function startDailyChallenge() {
 }
 
 async function startQuiz(subjectId, name, emoji, difficulty) {
-    let data = await apiFetch(`/questions/${subjectId}`);
-    if (!data) data = await loadStaticJSON(`questions_${subjectId}.json`);
-    if (!data || data.length === 0) { showToast('❌', 'Savollar topilmadi!'); return; }
-
-    // Filter by difficulty
-    if (difficulty > 0) {
-        const filtered = data.filter(q => q.difficulty === difficulty);
-        if (filtered.length >= 5) data = filtered;
+    // API: faqat testga kerakli 10 ta savol (qiyinlik bo'yicha kam bo'lsa — aralash)
+    let sampled = await apiFetch(`/v2/questions/${subjectId}?sample=10${difficulty > 0 ? `&difficulty=${difficulty}` : ''}`);
+    if (sampled && difficulty > 0 && sampled.items.length < 5) {
+        sampled = await apiFetch(`/v2/questions/${subjectId}?sample=10`);
+    }
+    let data = sampled?.items;
+    if (!data) {
+        data = await loadStaticJSON(`questions_${subjectId}.json`);
+        // Filter by difficulty
+        if (data && difficulty > 0) {
+            const filtered = data.filter(q => q.difficulty === difficulty);
+            if (filtered.length >= 5) data = filtered;
+        }
     }
+    if (!data || data.length === 0) { showToast('❌', 'Savollar topilmadi!'); return; }
 
     const shuffled = data.sort(() => Math.random() - 0.5).slice(0, 10);
     currentQuiz = {
@@ -190,7 +316,7 @@ function showQuestion() {
     const keys = ['a', 'b', 'c', 'd'];
     const optsDiv = document.getElementById('quizOptions');
     optsDiv.innerHTML = keys.map((k, i) => `
-        <button class="option-btn" id="opt_${k}" onclick="selectAnswer('${k}', '${q.correct}')">
+        <button class="option-btn" id="opt_${k}" onclick="selectAnswer('${k}')">
             <span class="option-letter">${letters[i]}</span>
             <span>${q.options[k]}</span>
         </button>
@@ -223,7 +349,11 @@ function startTimer(seconds) {
     }, seconds * 1000);
 }
 
-function autoSkipAnswer(q) {
+async function autoSkipAnswer(q) {
+    const btns = document.querySelectorAll('.option-btn');
+    btns.forEach(b => b.style.pointerEvents = 'none');
+    await resolveCorrect(q, null);
+
     currentQuiz.answers.push({
         question: q.text, correct: q.correct, selected: null,
         options: q.options, isCorrect: false, timedOut: true,
@@ -233,9 +363,6 @@ function autoSkipAnswer(q) {
     const correctBtn = document.getElementById(`opt_${q.correct}`);
     if (correctBtn) correctBtn.classList.add('correct');
 
-    const btns = document.querySelectorAll('.option-btn');
-    btns.forEach(b => b.style.pointerEvents = 'none');
-
     showToast('⏱️', 'Vaqt tugadi!');
 
     setTimeout(() => {
@@ -245,19 +372,20 @@ function autoSkipAnswer(q) {
     }, 1200);
 }
 
-function selectAnswer(selected, correct) {
+async function selectAnswer(selected) {
     clearTimeout(timerInterval);
     const btns = document.querySelectorAll('.option-btn');
     btns.forEach(b => b.style.pointerEvents = 'none');
 
+    const q = currentQuiz.questions[currentQuiz.current];
+    const correct = await resolveCorrect(q, selected);
     const isCorrect = selected === correct;
     if (isCorrect) currentQuiz.score++;
 
-    document.getElementById(`opt_${correct}`).classList.add('correct');
+    document.getElementById(`opt_${correct}`)?.classList.add('correct');
     if (!isCorrect) document.getElementById(`opt_${selected}`).classList.add('wrong');
 
     // Store answer for review
-    const q = currentQuiz.questions[currentQuiz.current];
     currentQuiz.answers.push({
         question: q.text, correct, selected,
         options: q.options, isCorrect, timedOut: false,
@@ -288,15 +416,12 @@ async function finishQuiz() {
     else if (pct >= 40) { band = '5.0'; emoji = '📖'; title = 'Davom eting!'; }
     else { band = '4.0'; emoji = '💪'; title = 'Ko\'proq mashq kerak'; }
 
-    // Save result
+    // Save result (navbat orqali — offline bo'lsa keyin yuboriladi)
     if (subjectId > 0) {
-        try {
-            await fetch(`${API_BASE}/results`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ user_id: userId, subject_id: subjectId, score, total, percentage: pct }),
-            });
-        } catch (e) { console.error(e); }
+        queueSync('result', {
+            subject_id: subjectId, score, total, percentage: pct, completed_at: new Date().toISOString(),
+        });
+        await flushSync();
     }
 
     showView('quizResult');
@@ -442,13 +567,7 @@ async function flashcardResponse(type) {
     if (flashcards.length === 0) return;
     const fc = flashcards[currentFcIndex];
 
-    try {
-        await fetch(`${API_BASE}/flashcards/response`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ user_id: userId, card_id: fc.id, response: type }),
-        });
-    } catch (e) { console.error(e); }
+    queueSync('flashcard', { card_id: fc.id, response: type }, 2000);
 
     if (type === 'knew') {
         flashcards.splice(currentFcIndex, 1);
@@ -628,7 +747,7 @@ async function openCBTSimulator() {
     document.getElementById('cbtOverlay').classList.remove('hidden');
 
     // Fetch Reading questions for CBT
-    let questions = await apiFetch('/questions/18'); // Assuming 18 is Reading based on previous logs or data
+    let questions = (await apiFetch('/v2/questions/18?sample=40'))?.items; // Assuming 18 is Reading based on previous logs or data
     if (!questions || questions.length === 0) {
         // Mock data for demo if no reading subject found
         questions = Array(40).fill(0).map((_, i) => ({
@@ -729,23 +848,26 @@ function startCBTTimer(seconds) {
 
 async function submitCBT() {
     let score = 0;
-    cbtQuestions.forEach((q, i) => {
-        if (cbtAnswers[i] === q.correct) score++;
-    });
+    if (cbtQuestions.some(q => !q.correct) && !isStaticMode) {
+        // v2 savollari — bitta so'rovda server tekshiradi
+        const results = await checkAnswers(cbtQuestions.map((q, i) => ({ id: q.id, answer: cbtAnswers[i] || null })));
+        score = (results || []).filter(r => r.correct).length;
+    } else {
+        cbtQuestions.forEach((q, i) => {
+            if (cbtAnswers[i] === q.correct) score++;
+        });
+    }
 
     const total = cbtQuestions.length;
     const pct = Math.round((score / total) * 100);
 
     showToast('📈', `CBT yakunlandi: ${score}/${total}`);
 
-    // Save to results via same API
-    if (userId && !isStaticMode) {
-        await fetch(`${API_BASE}/results`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ user_id: userId, subject_id: 18, score, total, percentage: pct, is_mock: true }),
-        });
-    }
+    // Save to results via sync queue
+    queueSync('result', {
+        subject_id: 18, score, total, percentage: pct, is_mock: true, completed_at: new Date().toISOString(),
+    });
+    await flushSync();
 
     closeCBTSimulator(true);
     switchTab('stats');
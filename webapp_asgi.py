@@ -0,0 +1,427 @@
+"""IELTS WebApp — ASGI server (webapp_server.py bilan bir xil marshrutlar va JSON).
+
+gunicorn ning sync workerida bitta sekin so'rov (masalan, Neon) qolgan
+hamma foydalanuvchini kutdiradi, har bir qo'shimcha worker esa yana bitta
+DB pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) ochadi. Bu variant bitta jarayonda
+event loop bilan ishlaydi: barcha so'rovlar bitta async engine
+(`database.async_engine`) poolini bo'lishadi, parallellik korutinalar
+hisobidan.
+
+Freymvork kerak emas — kichik ASGI ilova; JSON shartnomalari
+utils/webapp_api.py da Flask varianti bilan umumiy. Ishga tushirish
+(start.sh da WEBAPP_SERVER=asgi):
+
+    uvicorn webapp_asgi:app --host 0.0.0.0 --port 8080
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+from urllib.parse import parse_qs
+
+from config import API_CACHE_MAX_AGE, METRICS_TOKEN
+from database import Flashcard, async_engine, check_premium_async, get_async_session
+from utils import metrics, webapp_api as api
+from utils.leaderboard import leaderboard
+from utils.question_bank import question_bank
+from utils.response_cache import response_cache
+from utils.user_stats import record_result_async
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'webapp')
+
+# So'rov tanasi chegarasi (JSON API uchun yetarli)
+MAX_BODY = 1024 * 1024
+
+
+# === So'rov / javob ===
+
+class Request:
+    __slots__ = ('method', 'path', 'query_string', 'args', 'headers', '_receive')
+
+    def __init__(self, scope, receive):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'')
+        self.args = {
+            k: v[0] for k, v in parse_qs(self.query_string.decode('latin-1'), keep_blank_values=True).items()
+        }
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self._receive = receive
+
+    def int_arg(self, key, default=0):
+        try:
+            return int(self.args.get(key))
+        except (TypeError, ValueError):
+            return default
+
+    async def body(self):
+        chunks, size = [], 0
+        while True:
+            message = await self._receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY:
+                raise ValueError("so'rov tanasi juda katta")
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def json(self):
+        """JSON tana yoki None (Flask `get_json(silent=True)` kabi)"""
+        try:
+            return json.loads(await self.body() or b'null')
+        except ValueError:
+            return None
+
+    def etag_matches(self, tags, weak=False):
+        """If-None-Match sarlavhasi `tags` dan biriga mos keladimi"""
+        header = self.headers.get('if-none-match')
+        if not header:
+            return False
+        for raw in header.split(','):
+            raw = raw.strip()
+            if raw == '*':
+                return True
+            is_weak = raw.startswith('W/')
+            if is_weak and not weak:
+                continue
+            if raw.removeprefix('W/').strip('"') in tags:
+                return True
+        return False
+
+
+class Response:
+    __slots__ = ('status', 'body', 'headers')
+
+    def __init__(self, body=b'', status=200, content_type='text/html; charset=utf-8', headers=None):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.headers = {'Content-Type': content_type} if content_type else {}
+        if headers:
+            self.headers.update(headers)
+
+    def set_etag(self, tag, weak=False):
+        self.headers['ETag'] = f'W/"{tag}"' if weak else f'"{tag}"'
+
+    async def send(self, send, head=False):
+        headers = dict(self.headers)
+        # CORS — flask_cors ning standart sozlamasi kabi
+        headers.setdefault('Access-Control-Allow-Origin', '*')
+        body = b'' if self.status == 304 else self.body
+        if self.status != 304:
+            headers['Content-Length'] = str(len(body))
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+def json_response(data, status=200):
+    # Flask jsonify bilan bir xil: ixcham, kalitlar tartiblangan
+    body = json.dumps(data, separators=(',', ':'), sort_keys=True).encode() + b'\n'
+    return Response(body, status, 'application/json')
+
+
+def not_modified(tag, weak=False, headers=None):
+    response = Response(status=304, content_type=None, headers=headers)
+    response.set_etag(tag, weak)
+    return response
+
+
+def bad_request(message):
+    return json_response({'error': message}, 400)
+
+
+# === Marshrutlar ===
+
+ROUTES = []   # (metodlar, regex, handler)
+
+
+def route(pattern, methods=('GET',)):
+    regex = re.compile('^' + re.sub(r'<int:(\w+)>', r'(?P<\1>\\d+)', pattern) + '$')
+
+    def decorator(handler):
+        ROUTES.append((set(methods), regex, handler))
+        return handler
+    return decorator
+
+
+@route('/health')
+async def health(request):
+    return Response('OK')
+
+
+@route('/metrics')
+async def metrics_endpoint(request):
+    """Prometheus: shu jarayonning DB pool va so'rov metrikalari"""
+    if METRICS_TOKEN:
+        token = request.args.get('token') or request.headers.get('authorization', '').removeprefix('Bearer ')
+        if token != METRICS_TOKEN:
+            return Response('Forbidden', 403)
+    body = metrics.render_prometheus({'exambot_leaderboard_watermark': leaderboard.watermark})
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# === API ===
+
+async def _cached_json(request, key, build):
+    """Kesh (utils/response_cache.py) dagi tayyor JSON: kuchli ETag, gzip/br, uzoq Cache-Control"""
+    entry = response_cache.get(key, build)
+    encoding, body = entry.pick(request.headers.get('accept-encoding'))
+    headers = {'Cache-Control': f'public, max-age={API_CACHE_MAX_AGE}', 'Vary': 'Accept-Encoding'}
+    if request.etag_matches(set(entry.etags.values())):
+        return not_modified(entry.etags[encoding], headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    response = Response(body, content_type='application/json', headers=headers)
+    response.set_etag(entry.etags[encoding])
+    return response
+
+
+@route('/api/subjects')
+async def api_subjects(request):
+    await response_cache.ensure_fresh_async()
+    return await _cached_json(request, 'subjects', api.subjects_json)
+
+
+@route('/api/questions/<int:subject_id>')
+async def api_questions(request, subject_id):
+    await response_cache.ensure_fresh_async()
+    if question_bank.subject(subject_id) is None:
+        return json_response([])
+    return await _cached_json(request, ('questions', subject_id), lambda: api.questions_json(subject_id))
+
+
+@route('/api/v2/questions')
+@route('/api/v2/questions/<int:subject_id>')
+async def api_v2_questions(request, subject_id=None):
+    try:
+        fields, difficulties, sample, cursor, limit = api.v2_params(request.args)
+    except ValueError as e:
+        return bad_request(str(e))
+
+    await response_cache.ensure_fresh_async()
+    if subject_id is not None and question_bank.subject(subject_id) is None:
+        return json_response(api.V2_EMPTY)
+
+    if sample is not None:
+        response = json_response(api.v2_sample(subject_id, fields, difficulties, sample))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    etag = api.v2_etag(response_cache.version, request.query_string)
+    headers = {'Cache-Control': f'public, max-age={API_CACHE_MAX_AGE}'}
+    if request.etag_matches({etag}, weak=True):
+        return not_modified(etag, weak=True, headers=headers)
+    response = json_response(api.v2_page(subject_id, fields, difficulties, cursor, limit))
+    response.headers.update(headers)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@route('/api/answers/check', methods=('POST',))
+async def api_answers_check(request):
+    data = await request.json()
+    await response_cache.ensure_fresh_async()
+    try:
+        return json_response(api.check_answers(data))
+    except ValueError as e:
+        return bad_request(str(e))
+
+
+@route('/api/results', methods=('POST',))
+async def api_save_result(request):
+    data = await request.json()
+    async with get_async_session() as session:
+        try:
+            result = api.new_result(data)
+            session.add(result)
+            await record_result_async(session, result)
+            await session.commit()
+            return json_response({'ok': True})
+        except Exception as e:
+            await session.rollback()
+            return json_response({'ok': False, 'error': str(e)})
+
+
+@route('/api/sync', methods=('POST',))
+async def api_sync(request):
+    data = await request.json()
+    await response_cache.ensure_fresh_async()
+    async with get_async_session() as session:
+        try:
+            return json_response(await session.run_sync(api.apply_sync, data))
+        except ValueError as e:
+            await session.rollback()
+            return bad_request(str(e))
+        except Exception as e:
+            await session.rollback()
+            return json_response({'ok': False, 'error': str(e)})
+
+
+@route('/api/stats')
+async def api_stats(request):
+    """Mini-app statistikasi — ETag va so'rovlar webapp_server.api_stats bilan bir xil"""
+    user_id = request.int_arg('user_id')
+    await leaderboard.ensure_fresh_async()
+    leaderboard_rows, my_rank = api.leaderboard_section(user_id)
+
+    async with get_async_session() as session:
+        row = (await session.execute(api.stats_row_query(user_id))).first()
+        stats, streak = row if row else (None, 0)
+        streak = streak or 0
+
+        etag = api.stats_etag(user_id, stats, streak, leaderboard_rows, my_rank)
+        headers = {'Cache-Control': 'private, no-cache'}
+        if request.etag_matches({etag}, weak=True):
+            return not_modified(etag, weak=True, headers=headers)
+        recent_results = (await session.execute(api.recent_results_query(user_id))).all()
+
+    await response_cache.ensure_fresh_async()
+    response = json_response(api.stats_payload(stats, streak, recent_results, leaderboard_rows, my_rank))
+    response.headers.update(headers)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@route('/api/flashcards')
+async def api_flashcards(request):
+    user_id = request.int_arg('user_id')
+    async with get_async_session() as session:
+        cards = (await session.scalars(api.flashcards_query(user_id))).all()
+    return json_response(api.flashcards_payload(cards))
+
+
+@route('/api/flashcards/response', methods=('POST',))
+async def api_flashcard_response(request):
+    data = await request.json() or {}
+    async with get_async_session() as session:
+        try:
+            card_id = data.get('card_id')
+            card = await session.get(Flashcard, card_id) if card_id is not None else None
+            if api.apply_flashcard_response(card, data):
+                await session.commit()
+            return json_response({'ok': True})
+        except Exception as e:
+            await session.rollback()
+            return json_response({'ok': False, 'error': str(e)})
+
+
+@route('/api/premium/status')
+async def api_premium_status(request):
+    user_id = request.int_arg('user_id')
+    is_prem = await check_premium_async(user_id)
+
+    expiry = None
+    if is_prem:
+        async with get_async_session() as session:
+            end_date = await session.scalar(api.premium_expiry_query(user_id))
+        if end_date:
+            expiry = end_date.strftime('%d.%m.%Y')
+
+    return json_response({
+        'is_premium': is_prem,
+        'expiry': expiry,
+    })
+
+
+# === Static files ===
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read(), os.fstat(f.fileno())
+
+
+async def static_file(request, path):
+    full = os.path.normpath(os.path.join(STATIC_DIR, path))
+    if not full.startswith(STATIC_DIR + os.sep) or not os.path.isfile(full):
+        return Response('Not Found', 404)
+    body, st = await asyncio.to_thread(_read_file, full)
+    # Flask send_file kabi: mtime-hajm ETag, keshda saqlanadi lekin qayta tekshiriladi
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    headers = {'Cache-Control': 'no-cache', 'Last-Modified': formatdate(st.st_mtime, usegmt=True)}
+    if request.etag_matches({etag}):
+        return not_modified(etag, headers=headers)
+    content_type = mimetypes.guess_type(full)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+        content_type += '; charset=utf-8'
+    response = Response(body, content_type=content_type, headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+@route('/')
+async def index(request):
+    return await static_file(request, 'index.html')
+
+
+# === ASGI ===
+
+def _preflight(request):
+    headers = {
+        'Access-Control-Allow-Methods': 'GET, HEAD, POST, OPTIONS',
+        'Access-Control-Allow-Headers': request.headers.get('access-control-request-headers', '*'),
+    }
+    return Response(content_type=None, headers=headers)
+
+
+async def dispatch(request):
+    if request.method == 'OPTIONS':
+        return _preflight(request)
+    method = 'GET' if request.method == 'HEAD' else request.method
+    allowed = False
+    for methods, regex, handler in ROUTES:
+        match = regex.match(request.path)
+        if match:
+            if method in methods:
+                kwargs = {k: int(v) for k, v in match.groupdict().items() if v is not None}
+                return await handler(request, **kwargs)
+            allowed = True
+    if allowed:
+        return Response('Method Not Allowed', 405)
+    if method == 'GET':
+        return await static_file(request, request.path.lstrip('/'))
+    return Response('Not Found', 404)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                # Savollar banki va reyting birinchi so'rovdan oldin tayyor
+                await response_cache.ensure_fresh_async()
+                await leaderboard.ensure_fresh_async(max_age=0)
+            except Exception as e:
+                logger.error(f"WebApp ishga tushishida xato: {e}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    request = Request(scope, receive)
+    try:
+        response = await dispatch(request)
+    except Exception:
+        logger.exception(f"{request.method} {request.path} xatosi")
+        response = Response('Internal Server Error', 500)
+    await response.send(send, head=request.method == 'HEAD')
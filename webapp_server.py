@@ -1,16 +1,18 @@
-"""IELTS WebApp — Flask API server"""
+"""IELTS WebApp — Flask API server (async variant: webapp_asgi.py)"""
 import os
-from datetime import datetime
 from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
 
 # DB import
 import sys
 sys.path.insert(0, os.path.dirname(__file__))
-from database import (
-    get_session, Subject, Question, UserResult, Flashcard,
-    UserSettings, DailyStreak, PremiumSubscription, check_premium,
-)
+from database import get_session, Flashcard, check_premium
+from config import METRICS_TOKEN, API_CACHE_MAX_AGE
+from utils import metrics, webapp_api as api
+from utils.leaderboard import leaderboard
+from utils.question_bank import question_bank
+from utils.response_cache import response_cache
+from utils.user_stats import record_result
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__, static_folder=os.path.join(BASE_DIR, 'webapp'), static_url_path='')
@@ -32,6 +34,17 @@ def health():
     return "OK", 200
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus: shu worker jarayonining DB pool va so'rov metrikalari"""
+    if METRICS_TOKEN:
+        token = request.args.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if token != METRICS_TOKEN:
+            return "Forbidden", 403
+    body = metrics.render_prometheus({'exambot_leaderboard_watermark': leaderboard.watermark})
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
@@ -44,43 +57,78 @@ def static_files(path):
 
 # === API ===
 
+def _bad_request(message):
+    return jsonify({'error': message}), 400
+
+
+def _cached_json(key, build):
+    """Kesh (utils/response_cache.py) dagi tayyor JSON: kuchli ETag, gzip/br, uzoq Cache-Control"""
+    response_cache.ensure_fresh()
+    entry = response_cache.get(key, build)
+    if any(request.if_none_match.contains(tag) for tag in entry.etags.values()):
+        encoding = entry.pick(request.headers.get('Accept-Encoding'))[0]
+        response = app.response_class(status=304)
+    else:
+        encoding, body = entry.pick(request.headers.get('Accept-Encoding'))
+        response = app.response_class(body, mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(entry.etags[encoding])
+    response.headers['Cache-Control'] = f'public, max-age={API_CACHE_MAX_AGE}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
 @app.route('/api/subjects')
 def api_subjects():
-    session = get_session()
-    try:
-        subjects = session.query(Subject).all()
-        result = []
-        for s in subjects:
-            q_count = session.query(Question).filter_by(subject_id=s.id).count()
-            result.append({
-                'id': s.id,
-                'name': s.name,
-                'emoji': s.emoji,
-                'description': s.description,
-                'question_count': q_count,
-            })
-        return jsonify(result)
-    finally:
-        session.close()
+    return _cached_json('subjects', api.subjects_json)
 
 
 @app.route('/api/questions/<int:subject_id>')
 def api_questions(subject_id):
-    session = get_session()
+    # Mavjud bo'lmagan fanlar keshni to'ldirmasligi uchun
+    response_cache.ensure_fresh()
+    if question_bank.subject(subject_id) is None:
+        return jsonify([])
+    return _cached_json(('questions', subject_id), lambda: api.questions_json(subject_id))
+
+
+@app.route('/api/v2/questions')
+@app.route('/api/v2/questions/<int:subject_id>')
+def api_v2_questions(subject_id=None):
+    """?cursor=&limit= — sahifa (id bo'yicha); ?sample=N — N ta tasodifiy savol.
+    ?fields=id,text,... va ?difficulty=1,2 ikkala rejimda ham ishlaydi."""
     try:
-        questions = session.query(Question).filter_by(subject_id=subject_id).all()
-        result = []
-        for q in questions:
-            result.append({
-                'id': q.id,
-                'text': q.text,
-                'options': q.get_options(),
-                'correct': q.correct_answer,
-                'difficulty': q.difficulty,
-            })
-        return jsonify(result)
-    finally:
-        session.close()
+        fields, difficulties, sample, cursor, limit = api.v2_params(request.args)
+    except ValueError as e:
+        return _bad_request(str(e))
+
+    response_cache.ensure_fresh()
+    if subject_id is not None and question_bank.subject(subject_id) is None:
+        return jsonify(api.V2_EMPTY)
+
+    if sample is not None:
+        response = jsonify(api.v2_sample(subject_id, fields, difficulties, sample))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    etag = api.v2_etag(response_cache.version, request.query_string)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(api.v2_page(subject_id, fields, difficulties, cursor, limit))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = f'public, max-age={API_CACHE_MAX_AGE}'
+    return response
+
+
+@app.route('/api/answers/check', methods=['POST'])
+def api_answers_check():
+    response_cache.ensure_fresh()
+    try:
+        return jsonify(api.check_answers(request.get_json(silent=True)))
+    except ValueError as e:
+        return _bad_request(str(e))
 
 
 @app.route('/api/results', methods=['POST'])
@@ -88,17 +136,9 @@ def api_save_result():
     data = request.json
     session = get_session()
     try:
-        result = UserResult(
-            user_id=data['user_id'],
-            username='webapp',
-            full_name='WebApp User',
-            subject_id=data['subject_id'],
-            score=data['score'],
-            total=data['total'],
-            percentage=data['percentage'],
-            is_mock=data.get('is_mock', False),
-        )
+        result = api.new_result(data)
         session.add(result)
+        record_result(session, result)
         session.commit()
         return jsonify({'ok': True})
     except Exception as e:
@@ -108,101 +148,49 @@ def api_save_result():
         session.close()
 
 
+@app.route('/api/sync', methods=['POST'])
+def api_sync():
+    """Natijalar va flashcard javoblari partiyasi (offline navbat ham) — bitta tranzaksiya"""
+    response_cache.ensure_fresh()
+    session = get_session()
+    try:
+        return jsonify(api.apply_sync(session, request.get_json(silent=True)))
+    except ValueError as e:
+        session.rollback()
+        return _bad_request(str(e))
+    except Exception as e:
+        session.rollback()
+        return jsonify({'ok': False, 'error': str(e)})
+    finally:
+        session.close()
+
+
 @app.route('/api/stats')
 def api_stats():
-    from sqlalchemy import func
-
+    """Mini-app statistikasi. ETag = user_stats.version (har natijada +1), streak va
+    reyting bo'limi — hech narsa o'zgarmagan bo'lsa bitta PK so'rovidan keyin 304."""
     user_id = request.args.get('user_id', 0, type=int)
+    leaderboard.ensure_fresh()
+    leaderboard_rows, my_rank = api.leaderboard_section(user_id)
+
     session = get_session()
     try:
-        # Get more results for the trend chart (up to 50)
-        trend_results = (
-            session.query(UserResult)
-            .filter_by(user_id=user_id)
-            .order_by(UserResult.completed_at.asc())
-            .all()
-        )
-        
-        # We'll take the latest 30 for the chart to keep it clean but readable
-        chart_trend = [
-            {'date': r.completed_at.strftime('%d.%m'), 'pct': round(r.percentage)}
-            for r in trend_results[-30:]
-        ] if trend_results else []
-
-        # Latest results for the history list
-        latest_results = trend_results[::-1][:10]
-        total_tests = len(trend_results)
-        avg_pct = round(sum(r.percentage for r in trend_results) / total_tests, 1) if total_tests > 0 else 0
-
-        if avg_pct >= 90: avg_band = '8.0+'
-        elif avg_pct >= 75: avg_band = '7.0'
-        elif avg_pct >= 60: avg_band = '6.0'
-        elif avg_pct >= 40: avg_band = '5.0'
-        else: avg_band = '4.0'
-
-        # Streak
-        streak_obj = session.query(DailyStreak).filter_by(user_id=user_id).first()
-        streak = streak_obj.current_streak if streak_obj else 0
-
-        # Subject performance (Radar Chart data)
-        subject_stats = []
-        ss_raw = (
-            session.query(
-                UserResult.subject_id,
-                func.avg(UserResult.percentage).label('avg_pct'),
-            )
-            .filter_by(user_id=user_id)
-            .group_by(UserResult.subject_id)
-            .all()
-        )
-        for sr in ss_raw:
-            subj = session.query(Subject).get(sr.subject_id)
-            if subj:
-                subject_stats.append({
-                    'name': subj.name,
-                    'emoji': subj.emoji,
-                    'avg': round(sr.avg_pct, 1),
-                })
-
-        # History list
-        history = []
-        for r in latest_results:
-            subj = session.query(Subject).get(r.subject_id)
-            history.append({
-                'subject': subj.name if subj else '?',
-                'emoji': subj.emoji if subj else '📚',
-                'score': r.score,
-                'total': r.total,
-                'percentage': round(r.percentage),
-                'date': r.completed_at.strftime('%d.%m.%Y') if r.completed_at else '',
-            })
-
-        # Leaderboard
-        lb_raw = (
-            session.query(
-                UserResult.full_name,
-                func.avg(UserResult.percentage).label('avg_pct'),
-            )
-            .group_by(UserResult.user_id, UserResult.full_name)
-            .order_by(func.avg(UserResult.percentage).desc())
-            .limit(10)
-            .all()
-        )
-        leaderboard = [
-            {'name': r.full_name or 'Foydalanuvchi', 'avg': round(r.avg_pct, 1)}
-            for r in lb_raw
-        ]
-
-        return jsonify({
-            'total_tests': total_tests,
-            'avg_percentage': avg_pct,
-            'avg_band': avg_band,
-            'streak': streak,
-            'subject_stats': subject_stats,
-            'history': history,
-            'leaderboard': leaderboard,
-            'chart_trend': chart_trend,
-        })
+        row = session.execute(api.stats_row_query(user_id)).first()
+        stats, streak = row if row else (None, 0)
+        streak = streak or 0
+
+        etag = api.stats_etag(user_id, stats, streak, leaderboard_rows, my_rank)
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            recent_results = session.execute(api.recent_results_query(user_id)).all()
+            # Fan nomlari — savollar bankidan (import bo'lsa qayta yuklanadi)
+            response_cache.ensure_fresh()
+            response = jsonify(api.stats_payload(stats, streak, recent_results, leaderboard_rows, my_rank))
+        response.set_etag(etag, weak=True)
+        # Brauzer saqlaydi, lekin har safar ETag bilan qayta tekshiradi
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     finally:
         session.close()
 
@@ -212,28 +200,8 @@ def api_flashcards():
     user_id = request.args.get('user_id', 0, type=int)
     session = get_session()
     try:
-        cards = session.query(Flashcard).filter_by(user_id=user_id).all()
-        total = len(cards)
-        mastered = sum(1 for c in cards if c.mastered)
-        learning = total - mastered
-
-        card_list = [
-            {
-                'id': c.id,
-                'front': c.front,
-                'back': c.back,
-                'example': c.example or '',
-                'mastered': c.mastered,
-            }
-            for c in cards if not c.mastered
-        ]
-
-        return jsonify({
-            'total': total,
-            'mastered': mastered,
-            'learning': learning,
-            'cards': card_list[:50],
-        })
+        cards = session.scalars(api.flashcards_query(user_id)).all()
+        return jsonify(api.flashcards_payload(cards))
     finally:
         session.close()
 
@@ -243,11 +211,10 @@ def api_flashcard_response():
     data = request.json
     session = get_session()
     try:
-        card = session.query(Flashcard).get(data.get('card_id'))
-        if card and card.user_id == data.get('user_id'):
-            if data.get('response') == 'knew':
-                card.mastered = True
-                session.commit()
+        card_id = data.get('card_id')
+        card = session.get(Flashcard, card_id) if card_id is not None else None
+        if api.apply_flashcard_response(card, data):
+            session.commit()
         return jsonify({'ok': True})
     except Exception as e:
         session.rollback()
@@ -265,14 +232,9 @@ def api_premium_status():
     if is_prem:
         session = get_session()
         try:
-            sub = (
-                session.query(PremiumSubscription)
-                .filter_by(user_id=user_id, is_active=True)
-                .order_by(PremiumSubscription.end_date.desc())
-                .first()
-            )
-            if sub:
-                expiry = sub.end_date.strftime('%d.%m.%Y')
+            end_date = session.scalar(api.premium_expiry_query(user_id))
+            if end_date:
+                expiry = end_date.strftime('%d.%m.%Y')
         finally:
             session.close()
 